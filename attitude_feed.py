@@ -0,0 +1,224 @@
+import argparse
+import math
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+# Latest converted attitude states for other processes on the same PC, in shared memory.
+# The converter publishes every decoded state as a fixed-size record into a ring; readers map the
+# segment and get NumPy views of the newest records without system calls or parsing.
+# Every record has its own sequence counter (a seqlock): odd while the record is being written,
+# 2 * (index + 1) once record number index is complete. A reader checks the counters after it
+# used a view and reads again when the writer lapped it.
+# Each record is written twice, at slot and slot + capacity, so the newest n records
+# (n <= capacity) are always one contiguous slice.
+# Run: python attitude_feed.py tss1_attitude [--count 10]
+
+feed_magic = b"ATTFEED1"
+default_feed_name = "tss1_attitude"
+
+# magic, capacity, record size, records published
+_header = struct.Struct("<8sIIQ")
+_header_size = 64
+_count_offset = 16
+_count = struct.Struct("<Q")
+
+# sequence, then gps_time (s), arrival_ns (monotonic), hor_accel, vert_accel (m/s^2), heave (m),
+# roll, pitch, heading (deg, NaN when not decoded), INS status (-1 until known), message ID
+_sequence = struct.Struct("<Q")
+_body = struct.Struct("<dqddddddiH2x")
+record_size = _sequence.size + _body.size
+
+record_fields = [
+    ("sequence", "<u8"),
+    ("gps_time", "<f8"),
+    ("arrival_ns", "<i8"),
+    ("hor_accel", "<f8"),
+    ("vert_accel", "<f8"),
+    ("heave", "<f8"),
+    ("roll", "<f8"),
+    ("pitch", "<f8"),
+    ("heading", "<f8"),
+    ("status", "<i4"),
+    ("message_id", "<u2"),
+    ("reserved", "<u2"),
+]
+
+
+def _feed_size(capacity):
+    return _header_size + 2 * capacity * record_size
+
+
+def _attach(name):
+    # Opens an existing segment without handing it to the resource tracker,
+    # which would remove it when a reader exits
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:  # before Python 3.13
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+class AttitudeFeedWriter:
+    """
+    Creates the shared-memory ring and publishes states into it. One writer per feed;
+    the segment is removed on close(). A feed left over by a converter that did not exit cleanly
+    is replaced; one that is still being published, or a segment that is not a feed, is refused
+    """
+
+    def __init__(self, name=default_feed_name, capacity=1024, takeover_wait=0.25):
+        self.name = name
+        self.capacity = capacity
+        self.count = 0
+        try:
+            self._memory = shared_memory.SharedMemory(name, create=True, size=_feed_size(capacity))
+        except FileExistsError:
+            self._remove_stale(name, takeover_wait)
+            self._memory = shared_memory.SharedMemory(name, create=True, size=_feed_size(capacity))
+        self._buffer = self._memory.buf
+        _header.pack_into(self._buffer, 0, feed_magic, capacity, record_size, 0)
+
+    @staticmethod
+    def _remove_stale(name, wait):
+        # Unlinks an existing feed whose count does not move within wait seconds.
+        # It is checked untracked, so refusing it does not hand it to the resource tracker
+        existing = _attach(name)
+        try:
+            if existing.size < _header_size or _header.unpack_from(existing.buf, 0)[0] != feed_magic:
+                raise RuntimeError(f"Shared memory {name!r} exists and is not an attitude feed")
+            count = _count.unpack_from(existing.buf, _count_offset)[0]
+            time.sleep(wait)
+            if _count.unpack_from(existing.buf, _count_offset)[0] != count:
+                raise RuntimeError(f"Attitude feed {name!r} is still being published by another converter")
+        finally:
+            existing.close()
+        stale = shared_memory.SharedMemory(name)
+        stale.close()
+        stale.unlink()
+
+    def publish(self, fields, gps_time=math.nan, status=-1, message_id=0, arrival_ns=0):
+        # Appends a state; fields as in the converter (hor_accel, vert_accel, heave, roll, pitch[, heading])
+        buffer = self._buffer
+        index = self.count
+        slot = index % self.capacity
+        first = _header_size + slot * record_size
+        second = first + self.capacity * record_size
+        _sequence.pack_into(buffer, first, 2 * index + 1)
+        _sequence.pack_into(buffer, second, 2 * index + 1)
+        values = (gps_time, arrival_ns, fields["hor_accel"], fields["vert_accel"], fields["heave"],
+                  fields["roll"], fields["pitch"], fields.get("heading", math.nan), status, message_id)
+        _body.pack_into(buffer, first + _sequence.size, *values)
+        _body.pack_into(buffer, second + _sequence.size, *values)
+        _sequence.pack_into(buffer, first, 2 * index + 2)
+        _sequence.pack_into(buffer, second, 2 * index + 2)
+        self.count = index + 1
+        _count.pack_into(buffer, _count_offset, self.count)
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+            self._memory.close()
+            self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AttitudeFeedReader:
+    """
+    Maps a feed created by AttitudeFeedWriter. latest(n) is a zero-copy view of the newest
+    records, snapshot(n) a checked copy
+    """
+
+    def __init__(self, name=default_feed_name):
+        import numpy as np
+
+        self.name = name
+        self._memory = _attach(name)
+        magic, capacity, size, _ = _header.unpack_from(self._memory.buf, 0)
+        if magic != feed_magic or size != record_size:
+            self._memory.close()
+            raise RuntimeError(f"Shared memory {name!r} is not an attitude feed")
+        self.capacity = capacity
+        self.dtype = np.dtype(record_fields)
+        self._count = np.ndarray(1, dtype="<u8", buffer=self._memory.buf, offset=_count_offset)
+        self.records = np.ndarray(2 * capacity, dtype=self.dtype, buffer=self._memory.buf, offset=_header_size)
+
+    @property
+    def count(self):
+        # records published so far
+        return int(self._count[0])
+
+    def latest(self, n=1):
+        # (view of the newest min(n, capacity, count) records, oldest first, index of its first record).
+        # The view keeps changing with the writer; check it with is_current() after use
+        count = self.count
+        n = min(n, self.capacity, count)
+        first = count - n
+        start = first % self.capacity
+        return self.records[start:start + n], first
+
+    def is_current(self, view, first):
+        # True when every record of a latest() view is still the one it was
+        import numpy as np
+
+        expected = 2 * (np.arange(first, first + len(view), dtype=np.uint64) + 1)
+        return bool(np.array_equal(view["sequence"], expected))
+
+    def snapshot(self, n=1, retries=100):
+        # Copy of the newest n records, consistent: none was rewritten while it was copied
+        for _ in range(retries):
+            view, first = self.latest(n)
+            copy = view.copy()
+            # the copy must hold completed records and the live ones must not have moved on since
+            if self.is_current(copy, first) and self.is_current(view, first):
+                return copy
+        raise RuntimeError("Attitude feed writer kept overwriting the records being read")
+
+    def latest_state(self):
+        # Newest record as a dict, None before the first one
+        records = self.snapshot(1)
+        if not len(records):
+            return None
+        return {name: records[name][0].item() for name in records.dtype.names if name != "reserved"}
+
+    def close(self):
+        self._count = self.records = None
+        self._memory.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="print the newest states of a converter attitude feed")
+    parser.add_argument("name", nargs="?", default=default_feed_name)
+    parser.add_argument("--count", type=int, default=1, help="newest states to print")
+    parser.add_argument("--follow", action="store_true", help="keep printing new states")
+    args = parser.parse_args()
+
+    with AttitudeFeedReader(args.name) as reader:
+        seen = max(reader.count - args.count, 0)
+        while True:
+            count = reader.count
+            if count > seen:
+                for record in reader.snapshot(min(count - seen, reader.capacity)):
+                    print(f"GPS {record['gps_time']:.3f} roll {record['roll']:.2f} pitch {record['pitch']:.2f} "
+                          f"heave {record['heave']:.2f} hor {record['hor_accel']:.3f} vert {record['vert_accel']:.3f} "
+                          f"status {record['status']} msg {record['message_id']}")
+                seen = count
+            if not args.follow:
+                break
+            time.sleep(0.05)
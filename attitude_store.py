@@ -0,0 +1,151 @@
+import numpy as np
+
+import span6_to_tss1 as rs6
+
+# GPS-time indexed storage of the TSS1 input quantities
+
+tss1_quantities = ("hor_accel", "vert_accel", "heave", "roll", "pitch")
+
+
+class TimeSeriesBuffer:
+    """
+    Fixed-capacity circular buffer of (GPS time, value) samples in time order.
+    Lookups bisect the buffer, so they cost O(log n)
+    """
+
+    def __init__(self, capacity=1024):
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._start = 0
+        self._count = 0
+        self.out_of_order = 0  # samples older than the newest one, ignored
+
+    @property
+    def capacity(self):
+        return len(self._times)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, time, value):
+        if self._count and time <= self._times[(self._start + self._count - 1) % self.capacity]:
+            self.out_of_order += 1
+            return
+        if self._count < self.capacity:
+            index = (self._start + self._count) % self.capacity
+            self._count += 1
+        else:
+            index = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._times[index] = time
+        self._values[index] = value
+
+    def time_at(self, position):
+        return float(self._times[(self._start + position) % self.capacity])
+
+    def value_at(self, position):
+        return float(self._values[(self._start + position) % self.capacity])
+
+    @property
+    def first_time(self):
+        return self.time_at(0) if self._count else None
+
+    @property
+    def last_time(self):
+        return self.time_at(self._count - 1) if self._count else None
+
+    def bisect(self, time):
+        # Number of samples with a time <= time
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self.time_at(middle) <= time:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def interpolate(self, time, max_gap=None):
+        # Value linearly interpolated at time, clamped to the first/last sample.
+        # None when the buffer is empty or the surrounding samples are more than max_gap apart
+        if not self._count:
+            return None
+        position = self.bisect(time)
+        if position == 0:
+            return self.value_at(0)
+        if position == self._count:
+            return self.value_at(self._count - 1)
+        time_0, time_1 = self.time_at(position - 1), self.time_at(position)
+        if max_gap is not None and time_1 - time_0 > max_gap:
+            return None
+        value_0, value_1 = self.value_at(position - 1), self.value_at(position)
+        return value_0 + (value_1 - value_0) * (time - time_0) / (time_1 - time_0)
+
+    def arrays(self):
+        # Copies of the stored times and values in time order
+        positions = (self._start + np.arange(self._count)) % self.capacity
+        return self._times[positions], self._values[positions]
+
+
+class AttitudeStore:
+    """
+    One TimeSeriesBuffer per TSS1 input quantity, filled from decoded SPAN6 messages.
+    aligned_fields() assembles a sentence from values interpolated to one common epoch
+    """
+
+    def __init__(self, capacity=1024, max_gap=None):
+        self.max_gap = max_gap  # seconds, larger gaps are not interpolated over
+        self.series = {name: TimeSeriesBuffer(capacity) for name in tss1_quantities}
+
+    def update(self, message_id, message, header_record):
+        fields = rs6.tss1_fields(message_id, message)
+        if not fields:
+            return None
+        time = rs6.message_gps_time(message_id, message, header_record)
+        for name, value in fields.items():
+            self.series[name].append(time, value)
+        return time
+
+    def fields_at(self, time):
+        # TSS1 input values interpolated at GPS time, None until every quantity has a sample
+        fields = {}
+        for name, series in self.series.items():
+            value = series.interpolate(time, self.max_gap)
+            if value is None:
+                return None
+            fields[name] = value
+        return fields
+
+    def aligned_epoch(self):
+        # Newest GPS time every quantity has reached
+        last_times = [series.last_time for series in self.series.values()]
+        if None in last_times:
+            return None
+        return min(last_times)
+
+    def aligned_fields(self):
+        # (epoch, fields) at the newest common epoch or None
+        epoch = self.aligned_epoch()
+        if epoch is None:
+            return None
+        fields = self.fields_at(epoch)
+        if fields is None:
+            return None
+        return epoch, fields
+
+
+def interpolate_series(times, values, epochs, max_gap=None):
+    # Batch version of TimeSeriesBuffer.interpolate over whole arrays.
+    # times must be increasing; epochs between samples further apart than max_gap give NaN
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    epochs = np.asarray(epochs, dtype=np.float64)
+    if len(times) == 0:
+        return np.full(len(epochs), np.nan)
+    result = np.interp(epochs, times, values)
+    if max_gap is not None and len(times) > 1:
+        position = np.clip(np.searchsorted(times, epochs, side="right"), 1, len(times) - 1)
+        inside = (epochs > times[0]) & (epochs < times[-1])
+        gap = times[position] - times[position - 1]
+        result[inside & (gap > max_gap)] = np.nan
+    return result
@@ -0,0 +1,377 @@
+import argparse
+import json
+import platform
+import random
+import struct
+import sys
+import time
+
+import span6_to_tss1 as rs6
+import span6_synthetic
+from span6_synthetic import make_frame
+
+# Run: python benchmark.py [--suite] [--json results.json] [--baseline baseline.json]
+
+def _legacy_find_header(buffer, offset=0):
+    # byte-at-a-time header search, kept as the reference for comparison
+    loop = True
+    while loop:
+        header = rs6.check_header_type(buffer[offset:offset+3])
+        if header == "UNKN":
+            offset += 1
+        else:
+            loop = False
+    return header, offset
+
+
+def _legacy_get_insupdate_size(buffer, offset):
+    header_size = 0
+    while offset + header_size < len(buffer):
+        try:
+            buffer[offset + header_size:offset + header_size+1].decode(encoding='utf-8', errors='strict')
+        except UnicodeDecodeError:
+            break
+        header_size += 1
+    return header_size
+
+
+def _legacy_find_headers(buffer):
+    headers = []
+    header, offset = _legacy_find_header(buffer)
+    while header != "OVER":
+        headers.append((header, offset))
+        header, offset = _legacy_find_header(buffer, offset + 1)
+    return headers
+
+
+def _legacy_read_span6_header(buffer, header, offset):
+    # slice + unpack + dict per frame, kept as the reference for comparison
+    block = rs6.header_long if header == "LONG" else rs6.header_short
+    header_array = block._struct.unpack(buffer[offset:offset+block.size])
+    header_dict = {}
+    for num, name in enumerate(block._names):
+        header_dict[name] = header_array[num]
+    return header_dict, block.size
+
+
+def _legacy_read_span6_message(buffer, offset, message_id):
+    message = rs6.messages_dict[str(message_id)]
+    message_array = message._struct.unpack(buffer[offset:offset+message.size])
+    message_data = {}
+    for num, name in enumerate(message._names):
+        message_data[name] = message_array[num]
+    return message_data
+
+
+def make_noisy_buffer(size, seed=0):
+    # Binary frames and ASCII records separated by random garbage
+    rng = random.Random(seed)
+    body = bytes(rng.randrange(0x80) for _ in range(rs6.inspvax_message.size - 4))
+    records = [
+        make_frame("LONG", 1465, body),
+        make_frame("SHORT", 1708, bytes(rs6.syncheave_message.size - 4)),
+        b'<INSUPDATE COM1 0 80.0 FINESTEERING 2200 0.000 00000000 0000 0\r\n',
+    ]
+    chunks = []
+    length = 0
+    while length < size:
+        garbage = bytes(rng.randrange(0x80, 0x100) for _ in range(rng.randrange(16)))
+        record = rng.choice(records)
+        chunks.append(garbage + record)
+        length += len(garbage) + len(record)
+    return b''.join(chunks)[:size]
+
+
+def _best_time(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_header_search(sizes=(1 << 12, 1 << 14, 1 << 16, 1 << 18, 1 << 20), legacy_limit=1 << 18):
+    results = []
+    for size in sizes:
+        buffer = make_noisy_buffer(size)
+        result = {"size": size, "headers": len(rs6.find_headers(buffer))}
+        result["find_headers_s"] = _best_time(rs6.find_headers, buffer)
+        result["split_frames_s"] = _best_time(rs6.split_span6_frames, buffer)
+        if size <= legacy_limit:
+            assert _legacy_find_headers(buffer) == rs6.find_headers(buffer)
+            result["legacy_s"] = _best_time(_legacy_find_headers, buffer, repeat=1)
+        results.append(result)
+    return results
+
+
+def bench_ascii_size(sizes=(64, 1 << 10, 1 << 14, 1 << 16)):
+    results = []
+    for size in sizes:
+        buffer = b'<IN' + b'A' * (size - 4) + b'\xaa'
+        assert _legacy_get_insupdate_size(buffer, 0) == rs6.get_insupdate_size(buffer, 0) == size - 1
+        results.append({
+            "size": size,
+            "get_insupdate_size_s": _best_time(rs6.get_insupdate_size, buffer, 0),
+            "legacy_s": _best_time(_legacy_get_insupdate_size, buffer, 0, repeat=1),
+        })
+    return results
+
+
+def bench_crc(counts=(1 << 10, 1 << 14, 1 << 17)):
+    import numpy as np
+    import span6_batch
+
+    def check_table(buffer, size):
+        for offset in range(0, len(buffer), size):
+            expected, = struct.unpack_from('<I', buffer, offset + size - 4)
+            assert rs6.calculate_block_crc32(buffer[offset:offset + size - 4]) == expected
+
+    def check_frames(buffer, size):
+        for offset in range(0, len(buffer), size):
+            assert rs6.check_span6_crc(buffer, offset, size)
+
+    results = []
+    frame = make_frame("LONG", 1465, bytes(rs6.inspvax_message.size - 4))
+    size = len(frame)
+    for count in counts:
+        buffer = frame * count
+        offsets = np.arange(count) * size
+        sizes = np.full(count, size)
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        assert span6_batch.check_crc_batch(data, offsets, sizes).all()
+        results.append({
+            "frames": count,
+            "table_s": _best_time(check_table, buffer[:min(count, 1024) * size], size, repeat=1) * count / min(count, 1024),
+            "check_span6_crc_s": _best_time(check_frames, buffer, size),
+            "batch_s": _best_time(span6_batch.check_crc_batch, data, offsets, sizes),
+        })
+    return results
+
+
+def bench_tss1_encode(counts=(1 << 10, 1 << 14, 1 << 18)):
+    import numpy as np
+    import tss1_batch
+
+    rng = np.random.default_rng(0)
+    results = []
+    for count in counts:
+        values = (rng.uniform(0, 9.81, count), rng.uniform(-20.48, 20.47, count),
+                  rng.uniform(-99.99, 99.99, count), rng.uniform(-99.99, 99.99, count),
+                  rng.uniform(-99.99, 99.99, count))
+        rows = list(zip(*(column.tolist() for column in values)))
+        records, _ = tss1_batch.encode_tss1_batch(*values)
+        assert records.tobytes() == "".join(rs6.create_tss1(*row) for row in rows).encode()
+        create_s = _best_time(lambda: [rs6.create_tss1(*row) for row in rows], repeat=1)
+        batch_s = _best_time(tss1_batch.encode_tss1_batch, *values)
+        results.append({
+            "records": count,
+            "create_tss1_s": create_s,
+            "batch_s": batch_s,
+            "batch_records_per_sec": int(count / batch_s),
+        })
+    return results
+
+
+def bench_decode(count=1 << 15):
+    frame = make_frame("LONG", 1465, bytes(rs6.inspvax_message.size - 4))
+    buffer = frame * count
+    offsets = range(0, len(buffer), len(frame))
+
+    def legacy():
+        for offset in offsets:
+            header_dict, header_length = _legacy_read_span6_header(buffer, "LONG", offset)
+            _legacy_read_span6_message(buffer, offset + header_length, header_dict["message_id"])
+
+    def compiled():
+        decode_header = rs6.decode_span6_header
+        decode_message = rs6.decode_span6_message
+        header_length = rs6.header_long.size
+        for offset in offsets:
+            header = decode_header(buffer, "LONG", offset)
+            decode_message(buffer, offset + header_length, header.message_id, offset + len(frame))
+
+    legacy_s = _best_time(legacy)
+    compiled_s = _best_time(compiled)
+    return [{
+        "frames": count,
+        "legacy_s": legacy_s,
+        "compiled_s": compiled_s,
+        "legacy_ns_per_frame": int(legacy_s / count * 1e9),
+        "compiled_ns_per_frame": int(compiled_s / count * 1e9),
+    }]
+
+
+def print_results(title, results):
+    print(title)
+    for result in results:
+        print("  " + "  ".join(
+            f"{key}={value * 1e3:.3f}ms" if key.endswith("_s") else f"{key}={value}"
+            for key, value in result.items()))
+
+
+##############################
+###  End-to-end suite on synthetic streams
+##############################
+
+regression_tolerance = 0.2  # a stage slower than the baseline by more than this fraction is a regression
+
+
+def _stage(seconds, frames, size):
+    return {
+        "seconds": seconds,
+        "frames": frames,
+        "bytes": size,
+        "frames_per_s": frames / seconds,
+        "bytes_per_s": size / seconds,
+    }
+
+
+def bench_suite(duration=60.0, garbage_probability=0.05, chunk_size=512, seed=0, repeat=3):
+    # Every stage alone and end-to-end on one synthetic stream.
+    # Returns a JSON-serialisable dict; "stages" maps stage name -> frames/s and bytes/s
+    import numpy as np
+    import span6_batch
+    import tss1_batch
+
+    stream = span6_synthetic.generate_stream(duration, garbage_probability=garbage_probability, seed=seed)
+    chunks = span6_synthetic.split_chunks(stream, 1, chunk_size, seed=seed)
+    data = np.frombuffer(stream, dtype=np.uint8)
+
+    index, _ = span6_batch.index_frames(stream)
+    binary = index[index["kind"] != span6_batch.header_kinds.index("INS_UPDATE")]
+    frames = [(span6_batch.header_kinds[kind], int(offset), int(size), int(header_length), int(message_id))
+              for offset, size, kind, header_length, message_id
+              in binary[["offset", "size", "kind", "header_length", "message_id"]].tolist()]
+    frame_bytes = int(binary["size"].sum())
+    inputs = span6_batch.tss1_inputs(data, index)
+    rows = list(zip(*(inputs[name].tolist() for name in ("hor_accel", "vert_accel", "heave", "roll", "pitch"))))
+    sentence_bytes = len(rows) * rs6.tss1_size
+
+    def header_decode():
+        decode_header = rs6.decode_span6_header
+        for header, offset, _, _, _ in frames:
+            decode_header(stream, header, offset)
+
+    def message_decode():
+        decode_message = rs6.decode_span6_message
+        for _, offset, size, header_length, message_id in frames:
+            decode_message(stream, offset + header_length, message_id, offset + size)
+
+    def crc_check():
+        check_crc = rs6.check_span6_crc
+        for _, offset, size, _, _ in frames:
+            check_crc(stream, offset, size)
+
+    def tss1_encode():
+        create_tss1 = rs6.create_tss1
+        return "".join([create_tss1(*row) for row in rows]).encode()
+
+    def stream_convert():
+        # main.py without the serial ports: framer over port-sized reads -> decode -> TSS1
+        framer = rs6.Span6Framer()
+        fields = dict(hor_accel=0, vert_accel=0, heave=0, roll=0, pitch=0)
+        sentences = []
+        for chunk in chunks:
+            framer.feed(chunk)
+            for header, header_rec, header_len, frame in framer:
+                if header == "INS_UPDATE":
+                    continue
+                message_id = header_rec.message_id
+                if message_id in rs6.tss1_message_ids:
+                    msg = rs6.decode_span6_message(frame, header_len, message_id)
+                    if msg is not None:
+                        fields.update(rs6.tss1_fields(message_id, msg))
+                sentences.append(rs6.create_tss1(**fields))
+        return "".join(sentences).encode()
+
+    def batch_convert():
+        index, _ = span6_batch.index_frames(stream)
+        inputs = span6_batch.tss1_inputs(data, index)
+        records, _ = tss1_batch.encode_tss1_batch(**inputs)
+        return records.tobytes()
+
+    # every path has to produce the same output before its speed means anything
+    assert stream_convert() == batch_convert() == tss1_encode()
+
+    offsets = binary["offset"]
+    sizes = binary["size"]
+    stages = {
+        "header_search": _stage(_best_time(rs6.find_headers, stream, repeat=repeat), len(index), len(stream)),
+        "header_decode": _stage(_best_time(header_decode, repeat=repeat), len(frames), frame_bytes),
+        "message_decode": _stage(_best_time(message_decode, repeat=repeat), len(frames), frame_bytes),
+        "crc_check": _stage(_best_time(crc_check, repeat=repeat), len(frames), frame_bytes),
+        "crc_check_batch": _stage(_best_time(span6_batch.check_crc_batch, data, offsets, sizes, repeat=repeat),
+                                  len(frames), frame_bytes),
+        "tss1_encode": _stage(_best_time(tss1_encode, repeat=repeat), len(rows), sentence_bytes),
+        "tss1_encode_batch": _stage(_best_time(lambda: tss1_batch.encode_tss1_batch(**inputs), repeat=repeat),
+                                    len(rows), sentence_bytes),
+        "end_to_end_stream": _stage(_best_time(stream_convert, repeat=repeat), len(frames), len(stream)),
+        "end_to_end_batch": _stage(_best_time(batch_convert, repeat=repeat), len(frames), len(stream)),
+    }
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "stream": {
+            "duration_s": duration,
+            "bytes": len(stream),
+            "frames": len(frames),
+            "ascii_records": len(index) - len(frames),
+            "chunks": len(chunks),
+            "garbage_probability": garbage_probability,
+            "seed": seed,
+        },
+        "stages": stages,
+    }
+
+
+def compare_results(results, baseline, tolerance=regression_tolerance):
+    # [(stage, baseline frames/s, current frames/s)] of stages slower than baseline by more than tolerance
+    regressions = []
+    for name, stage in results["stages"].items():
+        reference = baseline.get("stages", {}).get(name)
+        if reference is None:
+            continue
+        if stage["frames_per_s"] < reference["frames_per_s"] * (1 - tolerance):
+            regressions.append((name, reference["frames_per_s"], stage["frames_per_s"]))
+    return regressions
+
+
+def print_suite(results):
+    stream = results["stream"]
+    print(f"Synthetic stream: {stream['bytes']} bytes, {stream['frames']} frames, "
+          f"{stream['ascii_records']} ASCII records, {stream['chunks']} chunks")
+    for name, stage in results["stages"].items():
+        print(f"  {name:<20} {stage['frames_per_s']:>14,.0f} frames/s {stage['bytes_per_s'] / 1e6:>10.2f} MB/s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SPAN6 -> TSS1 benchmarks")
+    parser.add_argument("--suite", action="store_true", help="only run the end-to-end suite")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of synthetic stream")
+    parser.add_argument("--json", metavar="FILE", help="write the suite results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="fail on regressions against a saved --json FILE")
+    parser.add_argument("--tolerance", type=float, default=regression_tolerance)
+    args = parser.parse_args()
+
+    if not args.suite:
+        print_results("Header search", bench_header_search())
+        print_results("INS_UPDATE size", bench_ascii_size())
+        print_results("CRC-32", bench_crc())
+        print_results("TSS1 encode", bench_tss1_encode())
+        print_results("Header + message decode", bench_decode())
+
+    suite = bench_suite(args.duration)
+    print_suite(suite)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(suite, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_results(suite, json.load(file), args.tolerance)
+        for name, reference, current in regressions:
+            print(f"REGRESSION {name}: {current:,.0f} frames/s, baseline {reference:,.0f} frames/s")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,26 @@
+import pytest
+
+# Known SPAN6 frames, written out byte for byte. GPS week 2200; the CRCs are NovAtel CRC-32
+# (reflected 0xEDB88320, initial value 0, no final XOR), least significant byte first
+
+# SYNCHEAVE (1708), LONG header, ms 302400000: heave -0.42 m, heave_std 0.05 m
+syncheave_long = bytes.fromhex(
+    "AA44121CAC0600201000000000B49808004206120000000000000000E17A14AE"
+    "47E1DABF9A9999999999A93F2E6208BC")
+
+# INSATTS (319), SHORT header, ms 302400010: roll 1.25, pitch -3.5, azimuth 87 deg, status 3
+insatts_short = bytes.fromhex(
+    "AA4413283F0198080A42061298080000A4703D0A00751241000000000000F43F"
+    "0000000000000CC00000000000C0554003000000A8C26B37")
+
+# CORRIMUDATAS (813), SHORT header, ms 302400020: pitch_rate 0.001, roll_rate -0.002, yaw_rate 0,
+# lateral_acc 0.03, longitudinal_acc 0.04, vertical_acc -0.0981 (increments per 100 Hz sample)
+corrimudatas_short = bytes.fromhex(
+    "AA44133C2D039808144206129808000048E17A1400751241FCA9F1D24D62503F"
+    "FCA9F1D24D6260BF0000000000000000B81E85EB51B89E3F7B14AE47E17AA43F"
+    "5BD3BCE3141DB9BF9B380C79")
+
+
+@pytest.fixture
+def known_frames():
+    return {"SYNCHEAVE": syncheave_long, "INSATTS": insatts_short, "CORRIMUDATAS": corrimudatas_short}
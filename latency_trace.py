@@ -0,0 +1,213 @@
+import argparse
+import math
+import struct
+import threading
+
+import numpy as np
+
+import span6_to_tss1 as rs6
+
+# Latency tracing of the converter: every sentence sent is logged with the monotonic time its
+# frame arrived, the GPS time in the frame header and the times decoding, encoding and the TX
+# write finished. Records are packed into a buffer and written in blocks, so tracing costs a
+# struct.pack per sentence and no system call.
+# Frame age (TX time - GPS time of the data) needs the GPS -> monotonic mapping: reference
+# records pair a GPS second with the monotonic time of its PPS edge (or of a synthetic clock).
+# Without references the age is relative to the fastest frame of the trace.
+# Run: python latency_trace.py trace.bin [--spike-ms 5]
+
+trace_magic = b"SPANLAT1"
+trace_kinds = ("SENT", "SKIPPED", "REFERENCE")  # sentence written, sentence dropped for a newer one, PPS
+
+# gps_time (s, NaN when unknown), arrival_ns (monotonic), ns from arrival to decoded, encoded and
+# TX written (saturated at 2**32 - 1), message ID, kind
+_record = struct.Struct("<dqIIIHH")
+trace_dtype = np.dtype([
+    ("gps_time", "<f8"),
+    ("arrival_ns", "<i8"),
+    ("decode_ns", "<u4"),
+    ("encode_ns", "<u4"),
+    ("tx_ns", "<u4"),
+    ("message_id", "<u2"),
+    ("kind", "<u2"),
+])
+assert trace_dtype.itemsize == _record.size
+_max_delta = 0xFFFFFFFF
+
+
+class LatencyTracer:
+    """
+    Appends trace records to a file. sent() is called by the TX thread, skipped() by the TX thread and
+    by the decoder for a sentence replaced before the TX thread took it, reference() by whatever
+    watches the PPS; records are flushed every flush_size bytes and on close.
+    A lock keeps the threads from appending to the buffer while it is being written out
+    """
+
+    def __init__(self, path, flush_size=1 << 16):
+        self.path = path
+        self.flush_size = flush_size
+        self.records = 0
+        self._file = open(path, "wb")
+        self._file.write(trace_magic)
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+
+    def _add(self, gps_time, arrival_ns, decoded_ns, encoded_ns, tx_ns, message_id, kind):
+        record = _record.pack(gps_time, arrival_ns,
+                              min(max(decoded_ns - arrival_ns, 0), _max_delta),
+                              min(max(encoded_ns - arrival_ns, 0), _max_delta),
+                              min(max(tx_ns - arrival_ns, 0), _max_delta), message_id, kind)
+        with self._lock:
+            buffer = self._buffer
+            buffer += record
+            self.records += 1
+            if len(buffer) >= self.flush_size:
+                self._flush()
+
+    def sent(self, tag, tx_ns):
+        # tag is (arrival_ns, gps_time, message_id, decoded_ns, encoded_ns) of the sentence's frame
+        arrival_ns, gps_time, message_id, decoded_ns, encoded_ns = tag
+        self._add(gps_time, arrival_ns, decoded_ns, encoded_ns, tx_ns, message_id, 0)
+
+    def skipped(self, tag, now_ns):
+        arrival_ns, gps_time, message_id, decoded_ns, encoded_ns = tag
+        self._add(gps_time, arrival_ns, decoded_ns, encoded_ns, now_ns, message_id, 1)
+
+    def reference(self, gps_time, monotonic_ns):
+        # GPS second gps_time began at monotonic_ns, e.g. a PPS edge
+        self._add(gps_time, monotonic_ns, monotonic_ns, monotonic_ns, monotonic_ns, 0, 2)
+
+    def _flush(self):
+        # the caller holds the lock
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._flush()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def frame_tag(arrival_ns, header, header_record):
+    # Trace tag of a frame before decoding: GPS time from the LONG/SHORT header.
+    # The decoder fills in the decoded and encoded times
+    gps_time = math.nan if header == "INS_UPDATE" else rs6.header_gps_time(header_record)
+    message_id = 0 if header == "INS_UPDATE" else header_record.message_id
+    return [arrival_ns, gps_time, message_id, 0, 0]
+
+
+##############################
+###  Analysis
+##############################
+
+def read_trace(path):
+    # Structured array of the records of a trace file
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[:len(trace_magic)] != trace_magic:
+        raise RuntimeError(f"{path} is not a latency trace")
+    count = (len(data) - len(trace_magic)) // trace_dtype.itemsize
+    return np.frombuffer(data, dtype=trace_dtype, count=count, offset=len(trace_magic))
+
+
+def clock_fit(records):
+    # (gps0, base_ns, slope, referenced) with monotonic_ns = base_ns + slope * (gps_time - gps0) * 1e9;
+    # referenced tells whether the mapping comes from reference records. One reference fixes the
+    # offset, two or more also the drift. Without any the fastest frame's transport time is zero
+    references = records[records["kind"] == trace_kinds.index("REFERENCE")]
+    if len(references):
+        gps0 = float(references["gps_time"][0])
+        base_ns = float(references["arrival_ns"][0])
+        if len(references) == 1:
+            return gps0, base_ns, 1.0, True
+        slope, base_ns = np.polyfit((references["gps_time"] - gps0) * 1e9,
+                                    (references["arrival_ns"] - references["arrival_ns"][0]).astype(np.float64), 1)
+        return gps0, float(references["arrival_ns"][0] + base_ns), float(slope), True
+    frames = records[np.isfinite(records["gps_time"])]
+    if not len(frames):
+        return 0.0, 0.0, 1.0, False
+    gps0 = float(frames["gps_time"][0])
+    base_ns = frames["arrival_ns"][0] + np.min((frames["arrival_ns"] - frames["arrival_ns"][0])
+                                               - (frames["gps_time"] - gps0) * 1e9)
+    return gps0, float(base_ns), 1.0, False
+
+
+def _percentiles_ms(values_ns, percentiles=(50, 90, 99, 99.9)):
+    if not len(values_ns):
+        return {}
+    result = {f"p{percentile:g}": float(value) / 1e6
+              for percentile, value in zip(percentiles, np.percentile(values_ns, percentiles))}
+    result["max"] = float(np.max(values_ns)) / 1e6
+    return result
+
+
+def analyze_trace(records, spike_factor=8.0, spike_ms=None, max_spikes=20):
+    # Percentiles in ms of every stage and of the frame age at TX, plus jitter spikes: sentences
+    # whose age exceeds spike_ms, or the median by more than spike_factor x the median absolute
+    # deviation (at least 1 ms) when spike_ms is not given
+    sent = records[records["kind"] == trace_kinds.index("SENT")]
+    gps0, base_ns, slope, referenced = clock_fit(records)
+    timed = sent[np.isfinite(sent["gps_time"])]
+    age_ns = ((timed["arrival_ns"] - np.int64(base_ns)) + timed["tx_ns"].astype(np.int64)
+              - (base_ns - np.int64(base_ns)) - slope * (timed["gps_time"] - gps0) * 1e9)
+
+    report = {
+        "sentences": len(sent),
+        "skipped": int(np.count_nonzero(records["kind"] == trace_kinds.index("SKIPPED"))),
+        "references": int(np.count_nonzero(records["kind"] == trace_kinds.index("REFERENCE"))),
+        "clock": {"gps0": gps0, "base_ns": base_ns, "drift_ppm": (slope - 1) * 1e6, "referenced": referenced},
+        "decode_ms": _percentiles_ms(sent["decode_ns"]),
+        "encode_ms": _percentiles_ms(sent["encode_ns"].astype(np.int64) - sent["decode_ns"]),
+        "tx_wait_ms": _percentiles_ms(sent["tx_ns"].astype(np.int64) - sent["encode_ns"]),
+        "pipeline_ms": _percentiles_ms(sent["tx_ns"]),
+        "age_ms": _percentiles_ms(age_ns),
+    }
+    spikes = np.zeros(0, dtype=np.int64)
+    if len(age_ns):
+        median = np.median(age_ns)
+        if spike_ms is None:
+            spread = max(np.median(np.abs(age_ns - median)), 1e6 / spike_factor)
+            limit = median + spike_factor * spread
+        else:
+            limit = spike_ms * 1e6
+        spikes = np.flatnonzero(age_ns > limit)
+        report["spike_limit_ms"] = float(limit) / 1e6
+    report["spike_count"] = len(spikes)
+    report["spikes"] = [(float(timed["gps_time"][index]), int(timed["message_id"][index]), float(age_ns[index]) / 1e6)
+                        for index in spikes[:max_spikes]]
+    return report
+
+
+def print_trace_report(report):
+    clock = report["clock"]
+    print(f"{report['sentences']} sentences, {report['skipped']} skipped, {report['references']} clock references "
+          f"({'PPS' if clock['referenced'] else 'relative to the fastest frame'}, drift {clock['drift_ppm']:.1f} ppm)")
+    for name in ("decode_ms", "encode_ms", "tx_wait_ms", "pipeline_ms", "age_ms"):
+        values = ", ".join(f"{key} {value:.3f}" for key, value in report[name].items())
+        print(f"  {name[:-3]:<9} ms: {values}")
+    if "spike_limit_ms" in report:
+        print(f"  {report['spike_count']} jitter spikes over {report['spike_limit_ms']:.3f} ms")
+    for gps_time, message_id, age_ms in report["spikes"]:
+        print(f"    GPS {gps_time:.3f} s, message {message_id}: {age_ms:.3f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="frame age and stage latency percentiles of a converter trace")
+    parser.add_argument("trace", help="file written with ConverterPipeline(trace=LatencyTracer(...))")
+    parser.add_argument("--spike-ms", type=float, help="age that counts as a spike, adaptive by default")
+    parser.add_argument("--spike-factor", type=float, default=8.0, help="median absolute deviations for a spike")
+    args = parser.parse_args()
+
+    print_trace_report(analyze_trace(read_trace(args.trace), args.spike_factor, args.spike_ms))
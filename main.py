@@ -1,83 +1,85 @@
+import argparse
 import time
-import math
-import span6_to_tss1 as rs6
 
+import span6_metrics
+import span6_pipeline
+import span6_to_tss1 as rs6
 
+# Run: python main.py [--verbose] [--stats-interval 5] [--stats-file stats.json]
 
 if __name__ == '__main__':
-  
+    parser = argparse.ArgumentParser(description="SPAN6 -> TSS1 converter")
+    parser.add_argument("--verbose", action="store_true", help="print every frame and sentence (slow)")
+    parser.add_argument("--stats-interval", type=float, default=5.0, help="seconds between summary lines")
+    parser.add_argument("--stats-file", help="JSON file rewritten with the metrics every interval")
+    args = parser.parse_args()
+
     port_list= rs6.get_com_list() # List of available serial ports
-    
+
     print('Please, pick RX COM (that receives attitude data)')
     rx_com_name = rs6.pick_comport(port_list)
     rx_com_baud = rs6.pick_baud_rate()
     com_rx = rs6.serial_open(rx_com_name, rx_com_baud)
-    
+
     print("Please, pick TX COM (that will transmit TSS1)")
     tx_com_name = rs6.pick_comport(port_list)
     tx_com_baud = rs6.pick_baud_rate()
     com_tx = rs6.serial_open(tx_com_name, tx_com_baud)
-                
-    
+
+
     loop = True
-    hor_accel = 0
-    vert_accel = 0
-    heave = 0
-    roll = 0
-    pitch = 0
-    rx_buf = ''
-    
+    verbose = args.verbose
+    fields = dict(hor_accel=0, vert_accel=0, heave=0, roll=0, pitch=0)
+    framer = rs6.Span6Framer()
+    metrics = span6_metrics.ConverterMetrics(framer)
+    reporter = span6_metrics.MetricsReporter(metrics, args.stats_interval, args.stats_file)
+    # keeps the TX line from queueing sentences when it is slower than the input
+    writer = span6_pipeline.Tss1Writer(com_tx, tx_com_baud, metrics=metrics)
+    timers = metrics.timers
+    clock = time.perf_counter_ns
+
     while loop:
         try:
-            rx_buf = ''
-            rx_buf = com_rx.read()
-            if rx_buf != b'':
-                time.sleep(0.02)
-                rx_buf = rx_buf + com_rx.read_all()
-                
-                while 3 > len(rx_buf):
-                    rx_buf = rx_buf + com_rx.read(3 - len(rx_buf))
-                header, offset = rs6.find_header(rx_buf)
-                
+            # blocks for up to the port timeout when nothing arrives
+            start = clock()
+            chunk = com_rx.read(com_rx.in_waiting or 1)
+            now = clock()
+            timers["read"].record(now - start)
+            metrics.rx_bytes += len(chunk)
+            framer.feed(chunk)
+
+            start = now
+            for header, header_rec, header_len, frame in framer:
+                now = clock()
+                timers["frame"].record(now - start)
                 if header == "SHORT" or header == "LONG":
-                    print(header)
-                    while offset + 28 > len(rx_buf):
-                        rx_buf = rx_buf + com_rx.read(offset + 28 - len(rx_buf))
-                        
-                    header_dict, header_len = rs6.read_span6_header(rx_buf, header, offset)
-                    message_start = offset + header_len
-                    
-                    message_len = header_dict["message_length"]
-                    message_id = header_dict['message_id']
-                    
-                    while message_start + message_len + 4 > len(rx_buf):
-                        rx_buf = rx_buf + com_rx.read(message_start + message_len + 4 - len(rx_buf))
-                    
-                    if message_id == 1465:
-                        msg_dir = rs6.read_span6_message(rx_buf, message_start, message_id)
-                        
-                        hor_accel = msg_dir["up_vel"]*100
-                        vert_accel = math.sqrt(msg_dir["north_vel"]**2 + msg_dir["east_vel"]**2)*100
-                        roll = msg_dir["roll"]
-                        pitch = msg_dir["pitch"]
-                        
-                    elif message_id == 1708:
-                        msg_dir = rs6.read_span6_message(rx_buf, message_start, message_id)
-                        
-                        hor_accel = msg_dir["vertical_acc"]*100
-                        vert_accel = math.sqrt(msg_dir["lateral_acc"]**2 + msg_dir["longitudinal_acc"]**2)*100
-                        roll = msg_dir["roll_rate"]*100
-                        pitch = msg_dir["pitch_rate"]*100
-                        
-                    elif message_id == 813:
-                        msg_dir = rs6.read_span6_message(rx_buf, message_start, message_id)
-                        heave = msg_dir["heave"]
-                    
-                    tss1 = rs6.create_tss1(hor_accel=hor_accel, vert_accel=vert_accel, heave=heave, roll=roll, pitch=pitch)
-                    com_tx.write(tss1.encode('utf-8'))
-                    print(tss1)
+                    if verbose:
+                        print(header)
+                    message_id = header_rec.message_id
+                    metrics.messages[message_id] += 1
+
+                    if message_id in rs6.tss1_message_ids:
+                        msg = rs6.decode_span6_message(frame, header_len, message_id)
+                        if msg is not None:  # None for a log of another length than its layout
+                            fields.update(rs6.tss1_fields(message_id, msg))
+                        start, now = now, clock()
+                        timers["decode"].record(now - start)
+
+                    try:
+                        tss1 = rs6.create_tss1(**fields)
+                    finally:
+                        start, now = now, clock()
+                        timers["encode"].record(now - start)
+                    writer.write(tss1.encode('utf-8'))
+                    if verbose:
+                        print(tss1)
+                else:
+                    metrics.ascii_records += 1
+                start = clock()
 
-            time.sleep(0.02)
         except RuntimeError as error:
+            metrics.range_errors += 1
             print(error)
 
+        writer.poll()
+        reporter.poll()
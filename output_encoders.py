@@ -0,0 +1,196 @@
+import struct
+
+import span6_to_tss1 as rs6
+
+# Output datagram encoders: TSS1 text and the binary Kongsberg EM1000/EM3000 attitude datagram.
+# Every encoder packs a record straight into a buffer with pack_into, encode() reuses one buffer
+# per encoder, and has an array version for whole captures (NumPy is only loaded for that).
+# Values come in a fields dict like the one rs6.tss1_fields fills, names an encoder does not use
+# are ignored. Out-of-range values raise RuntimeError like create_tss1.
+
+
+class OutputEncoder:
+    """
+    Base of the output encoders: a fixed-size record per attitude state.
+    Subclasses set name, size and fields and implement encode_into and encode_batch
+    """
+
+    name = None
+    size = 0
+    fields = ()  # names read from the fields dict
+
+    def __init__(self):
+        self._buffer = bytearray(self.size)
+        self._view = memoryview(self._buffer)
+
+    def encode_into(self, buffer, offset, fields, status_f="F"):
+        # Packs one record into buffer[offset:offset + size]
+        raise NotImplementedError
+
+    def encode_view(self, fields, status_f="F"):
+        # One record in the encoder's own buffer, valid until the next call. For a writer on the
+        # same thread; use encode() when the record is handed to another thread
+        self.encode_into(self._buffer, 0, fields, status_f)
+        return self._view
+
+    def encode(self, fields, status_f="F"):
+        self.encode_into(self._buffer, 0, fields, status_f)
+        return bytes(self._buffer)
+
+    def encode_batch(self, fields, status_f="F", out=None):
+        # Records for arrays of values: (n, size) uint8 array and the mask of the rows that were
+        # in range (the others are saturated). out is an optional buffer to write the records into
+        raise NotImplementedError
+
+
+##############################
+###  TSS1
+##############################
+# ':XXVVVV SHHHHFSRRRR SPPPP<CR><LF>', see create_tss1
+_tss1_struct = struct.Struct("c2s4scc4scc4scc4s2s")
+assert _tss1_struct.size == rs6.tss1_size
+
+_hex2 = [b"%02X" % value for value in range(256)]
+_decimal4 = [b"%04d" % value for value in range(10000)]
+
+
+class Tss1Encoder(OutputEncoder):
+    """
+    TSS1 sentences, byte-identical to create_tss1 without building a str
+    """
+
+    name = "tss1"
+    size = rs6.tss1_size
+    fields = ("hor_accel", "vert_accel", "heave", "roll", "pitch")
+
+    def encode_into(self, buffer, offset, fields, status_f="F"):
+        hor_accel = fields["hor_accel"]
+        vert_accel = fields["vert_accel"]
+        heave = fields["heave"]
+        roll = fields["roll"]
+        pitch = fields["pitch"]
+        if hor_accel > 9.81 or hor_accel < 0:
+            raise RuntimeError('Horizontal accel is wrong')
+        if vert_accel > 20.47 or vert_accel < -20.48:
+            raise RuntimeError('Vertical accel is wrong')
+        if heave > 99.99 or heave < -99.99:
+            raise RuntimeError('Heave is wrong')
+        if roll > 99.99 or roll < -99.99:
+            raise RuntimeError('Roll is wrong')
+        if pitch > 99.99 or pitch < -99.99:
+            raise RuntimeError('pitch is wrong')
+
+        vert = int(round(vert_accel / rs6.tss1_vert_accel_lsb)) & 0xFFFF
+        _tss1_struct.pack_into(
+            buffer, offset, b":",
+            _hex2[min(int(round(hor_accel / rs6.tss1_hor_accel_lsb)), 255)],
+            _hex2[vert >> 8] + _hex2[vert & 0xFF], b" ",
+            b"-" if heave < 0 else b" ", _decimal4[round(abs(heave) * 100)],
+            status_f.encode() if isinstance(status_f, str) else status_f,
+            b"-" if roll < 0 else b" ", _decimal4[round(abs(roll) * 100)], b" ",
+            b"-" if pitch < 0 else b" ", _decimal4[round(abs(pitch) * 100)], b"\r\n")
+
+    def encode_batch(self, fields, status_f="F", out=None):
+        import tss1_batch
+        return tss1_batch.encode_tss1_batch(*(fields[name] for name in self.fields), status_f=status_f, out=out)
+
+
+##############################
+###  EM3000
+##############################
+# Kongsberg EM1000/EM3000 attitude datagram, 10 bytes, integers least significant byte first:
+# status, sync 0x90, roll, pitch, heave (int16, 0.01 deg/m) and heading (uint16, 0.01 deg).
+# Roll positive port up, pitch bow up, heave up: the TSS1 conventions
+em3000_size = 10
+em3000_sync = 0x90
+em3000_lsb = 0.01  # deg for angles, m for heave
+_em3000_struct = struct.Struct("<BBhhhH")
+assert _em3000_struct.size == em3000_size
+
+# status byte from the TSS1 status flag: 0x90 valid, 0x91 reduced performance, 0xA0 invalid
+em3000_status = {"F": 0x90, "f": 0x91, "H": 0x91, "h": 0x91, "G": 0x91, "g": 0x91, "U": 0xA0, "u": 0xA0}
+_em3000_status_bytes = {flag.encode(): value for flag, value in em3000_status.items()}
+_int16_limit = 32767 * em3000_lsb
+
+
+class Em3000Encoder(OutputEncoder):
+    """
+    Binary EM1000/EM3000 attitude datagrams. Heading is the INS azimuth (heading_fields), 0 until known
+    """
+
+    name = "em3000"
+    size = em3000_size
+    fields = ("roll", "pitch", "heave", "heading")
+
+    def encode_into(self, buffer, offset, fields, status_f="F"):
+        roll = fields["roll"]
+        pitch = fields["pitch"]
+        heave = fields["heave"]
+        if not -_int16_limit <= roll <= _int16_limit:
+            raise RuntimeError('Roll is wrong')
+        if not -_int16_limit <= pitch <= _int16_limit:
+            raise RuntimeError('pitch is wrong')
+        if not -_int16_limit <= heave <= _int16_limit:
+            raise RuntimeError('Heave is wrong')
+        status = em3000_status.get(status_f) if isinstance(status_f, str) else _em3000_status_bytes.get(status_f)
+        _em3000_struct.pack_into(
+            buffer, offset, 0x91 if status is None else status, em3000_sync,
+            round(roll * 100), round(pitch * 100), round(heave * 100),
+            round(fields.get("heading", 0.0) % 360 * 100) % 36000)
+
+    def encode_batch(self, fields, status_f="F", out=None):
+        import numpy as np
+
+        count = len(fields["roll"])
+        if out is None:
+            records = np.empty((count, em3000_size), dtype=np.uint8)
+        else:
+            records = np.frombuffer(out, dtype=np.uint8)[:count * em3000_size].reshape(count, em3000_size)
+        datagrams = records.view(np.dtype([("status", "u1"), ("sync", "u1"), ("roll", "<i2"), ("pitch", "<i2"),
+                                           ("heave", "<i2"), ("heading", "<u2")])).reshape(count)
+
+        in_range = np.ones(count, dtype=bool)
+        for name in ("roll", "pitch", "heave"):
+            values = np.asarray(fields[name], dtype=np.float64)
+            with np.errstate(invalid="ignore"):
+                in_range &= (values >= -_int16_limit) & (values <= _int16_limit)
+            datagrams[name] = np.clip(np.rint(np.nan_to_num(values) * 100), -32767, 32767)
+        heading = np.nan_to_num(np.asarray(fields.get("heading", np.zeros(count)), dtype=np.float64))
+        datagrams["heading"] = np.rint(np.mod(heading, 360) * 100).astype(np.int64) % 36000
+        datagrams["sync"] = em3000_sync
+
+        if isinstance(status_f, str):
+            datagrams["status"] = em3000_status.get(status_f, 0x91)
+        else:
+            table = np.full(256, 0x91, dtype=np.uint8)
+            for flag, value in _em3000_status_bytes.items():
+                table[flag[0]] = value
+            datagrams["status"] = table[np.asarray(status_f).view(np.uint8)]
+        return records, in_range
+
+
+def heading_fields(message_id, message):
+    # Heading carried by a decoded message, for the encoders that send it
+    if message_id in rs6.attitude_message_ids:
+        return {"heading": message.azimuth}
+    return {}
+
+
+##############################
+###  Registry
+##############################
+output_encoders = {encoder.name: encoder for encoder in (Tss1Encoder, Em3000Encoder)}
+
+
+def register_encoder(encoder_class):
+    # Adds an OutputEncoder subclass under its name, usable as a decorator
+    output_encoders[encoder_class.name] = encoder_class
+    return encoder_class
+
+
+def get_encoder(name="tss1"):
+    # New encoder instance by name
+    encoder_class = output_encoders.get(name)
+    if encoder_class is None:
+        raise RuntimeError(f"Unknown output format {name!r}, known: {', '.join(output_encoders)}")
+    return encoder_class()
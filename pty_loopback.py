@@ -0,0 +1,376 @@
+import argparse
+import bisect
+import collections
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+import tty
+
+import numpy as np
+
+import latency_trace
+import span6_batch
+import span6_pipeline
+import span6_synthetic
+import span6_to_tss1 as rs6
+import tss1_batch
+
+# Load test of the converter without SPAN hardware (Linux only).
+# Two linked pty pairs stand in for the COM ports: the harness replays SPAN6 bytes into the RX pair
+# at a chosen baud and reads the TSS1 sentences back from the TX pair.
+# Run: python pty_loopback.py [capture.bin] [--baud 921600] [--max-rate] [--startup] [--trace trace.bin]
+
+
+class PtyPair:
+    """
+    Pseudo-terminal pair. The harness uses the master fd, the converter opens
+    the slave path (e.g. /dev/pts/5) as if it were a COM port
+    """
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave)
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def expected_output(stream):
+    # (end offset of each binary frame in stream, TSS1 sentence the converter should send for it)
+    data = np.frombuffer(stream, dtype=np.uint8)
+    index, _ = span6_batch.index_frames(stream)
+    binary = index[index["kind"] != span6_batch.header_kinds.index("INS_UPDATE")]
+    records, _ = tss1_batch.encode_tss1_batch(**span6_batch.tss1_inputs(data, index))
+    ends = (binary["offset"] + binary["size"]).tolist()
+    return ends, [record.tobytes() for record in records]
+
+
+def replay(fd, chunks, baud, bits_per_byte=10):
+    # Writes chunks to fd paced like a serial line at baud.
+    # Returns (end offset, monotonic ns after the write) per chunk and the worst lateness in ns
+    byte_ns = bits_per_byte * 1e9 / baud
+    sent = []
+    position = 0
+    worst_late = 0
+    start = time.monotonic_ns()
+    for chunk in chunks:
+        deadline = start + int((position + len(chunk)) * byte_ns)
+        now = time.monotonic_ns()
+        if now < deadline:
+            time.sleep((deadline - now) / 1e9)
+        else:
+            worst_late = max(worst_late, now - deadline)
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(fd, view):]
+        position += len(chunk)
+        sent.append((position, time.monotonic_ns()))
+    return sent, worst_late
+
+
+def clocked_chunks(stream, baud, bits_per_byte=10):
+    # Synthetic receiver clock: (chunk, monotonic offset in ns at which its last byte is out) per frame.
+    # A frame starts when GPS time reaches the time in its header (relative to the first frame) or
+    # when the line is free, and takes its bytes' time on the line. Returns the chunks and the
+    # GPS time at offset 0
+    data = np.frombuffer(stream, dtype=np.uint8)
+    index, _ = span6_batch.index_frames(stream)
+    gps_times = span6_batch.frame_gps_times(data, index)
+    binary = index["kind"] != span6_batch.header_kinds.index("INS_UPDATE")
+    gps0 = float(gps_times[binary][0]) if binary.any() else 0.0
+    byte_ns = bits_per_byte * 1e9 / baud
+    chunks = []
+    position = 0
+    line_free_ns = 0.0
+    start_ns = 0.0
+    for frame, gps_time, is_binary in zip(index.tolist(), gps_times.tolist(), binary.tolist()):
+        end = frame[0] + frame[1]
+        if is_binary:
+            start_ns = (gps_time - gps0) * 1e9
+        line_free_ns = max(start_ns, line_free_ns) + (end - position) * byte_ns
+        chunks.append((stream[position:end], int(line_free_ns)))
+        position = end
+    if position < len(stream):
+        chunks.append((stream[position:], int(line_free_ns + (len(stream) - position) * byte_ns)))
+    return chunks, gps0
+
+
+def replay_clocked(fd, chunks, start_ns):
+    # Writes every chunk at start_ns + its offset
+    for chunk, offset_ns in chunks:
+        now = time.monotonic_ns()
+        if now < start_ns + offset_ns:
+            time.sleep((start_ns + offset_ns - now) / 1e9)
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(fd, view):]
+
+
+def run_latency_trace(stream, trace_path, baud=115200, drain=0.5):
+    # Runs the converter with latency tracing on a stream replayed on the synthetic receiver
+    # clock of clocked_chunks. The clock's start goes into the trace as its PPS reference, so
+    # the frame ages are absolute. Returns the latency_trace.analyze_trace report
+    chunks, gps0 = clocked_chunks(stream, baud)
+    with PtyPair() as rx_pair, PtyPair() as tx_pair:
+        com_rx = rs6.serial_open(rx_pair.name, baud)
+        com_tx = rs6.serial_open(tx_pair.name, baud)
+        capture = Tss1Capture(tx_pair.master).start()
+        with latency_trace.LatencyTracer(trace_path) as tracer:
+            pipeline = span6_pipeline.ConverterPipeline(com_rx, com_tx, trace=tracer).start()
+            try:
+                start_ns = time.monotonic_ns() + 50_000_000  # the pipeline threads are up by then
+                tracer.reference(gps0, start_ns)
+                replay_clocked(rx_pair.master, chunks, start_ns)
+                while True:
+                    time.sleep(drain / 4)
+                    if time.monotonic_ns() - (capture.last_arrival_ns or 0) > drain * 1e9:
+                        break
+            finally:
+                pipeline.stop()
+                capture.stop()
+                rs6.serial_close(com_rx)
+                rs6.serial_close(com_tx)
+    if pipeline.error is not None:
+        raise RuntimeError(f"Converter stopped: {pipeline.error!r}")
+    return latency_trace.analyze_trace(latency_trace.read_trace(trace_path))
+
+
+class Tss1Capture:
+    """
+    Reads the TX side of the loopback in a thread and splits it into
+    sentences, each stamped with the monotonic time its last byte arrived
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.sentences = []  # (arrival_ns, sentence)
+        self.garbage_bytes = 0  # bytes that were not part of a 27 byte sentence
+        self.last_arrival_ns = None
+        self._buffer = b''
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tss1-capture", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.fd], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except OSError:
+                break
+            now = time.monotonic_ns()
+            self.last_arrival_ns = now
+            self._split(self._buffer + data, now)
+
+    def _split(self, buffer, now):
+        while True:
+            end = buffer.find(b'\r\n')
+            if end < 0:
+                break
+            sentence = buffer[:end + 2]
+            buffer = buffer[end + 2:]
+            if len(sentence) == rs6.tss1_size and sentence[:1] == b':':
+                self.sentences.append((now, sentence))
+            else:
+                self.garbage_bytes += len(sentence)
+        self._buffer = buffer
+
+
+def match_sentences(expected, received):
+    # Matches received sentences to the expected ones in order, skipping dropped ones.
+    # Returns ([(expected index, received index)], unexpected count).
+    # Equal consecutive sentences match the earliest frame, which errs towards longer latency
+    positions = collections.defaultdict(list)
+    for index, sentence in enumerate(expected):
+        positions[sentence].append(index)
+    matches = []
+    unexpected = 0
+    next_index = 0
+    for received_index, (_, sentence) in enumerate(received):
+        candidates = positions.get(sentence, ())
+        found = bisect.bisect_left(candidates, next_index)
+        if found == len(candidates):
+            unexpected += 1
+            continue
+        matches.append((candidates[found], received_index))
+        next_index = candidates[found] + 1
+    return matches, unexpected
+
+
+def run_loopback(stream, baud=921600, max_chunk=256, seed=0, output_rate=None, time_aligned=False, drain=0.5):
+    # Replays stream through the converter over two pty pairs and reports what came out
+    frame_ends, expected = expected_output(stream)
+    chunks = span6_synthetic.split_chunks(stream, 1, max_chunk, seed=seed)
+
+    with PtyPair() as rx_pair, PtyPair() as tx_pair:
+        com_rx = rs6.serial_open(rx_pair.name, baud)
+        com_tx = rs6.serial_open(tx_pair.name, baud)
+        capture = Tss1Capture(tx_pair.master).start()
+        pipeline = span6_pipeline.ConverterPipeline(com_rx, com_tx, output_rate=output_rate,
+                                                    time_aligned=time_aligned).start()
+        try:
+            start_ns = time.monotonic_ns()
+            sent, worst_late = replay(rx_pair.master, chunks, baud)
+            replay_ns = time.monotonic_ns() - start_ns
+            # wait until the output has been quiet for drain seconds
+            while True:
+                time.sleep(drain / 4)
+                last = capture.last_arrival_ns or sent[-1][1]
+                if time.monotonic_ns() - last > drain * 1e9:
+                    break
+        finally:
+            pipeline.stop()
+            capture.stop()
+            rs6.serial_close(com_rx)
+            rs6.serial_close(com_tx)
+
+    received = capture.sentences
+    sent_ends = [end for end, _ in sent]
+    frame_sent_ns = [sent[bisect.bisect_left(sent_ends, end)][1] for end in frame_ends]
+    report = {
+        "bytes": len(stream),
+        "frames": len(expected),
+        "baud": baud,
+        "replay_s": replay_ns / 1e9,
+        "replay_worst_late_ms": worst_late / 1e6,
+        "frames_per_s": len(expected) / (replay_ns / 1e9),
+        "sentences_received": len(received),
+        "garbage_bytes": capture.garbage_bytes,
+        "sentences_skipped": pipeline.sentences_skipped,
+        "range_errors": pipeline.range_errors,
+        "crc_errors": pipeline.framer.crc_errors,
+        "skipped_bytes": pipeline.framer.skipped_bytes,
+        "error": None if pipeline.error is None else repr(pipeline.error),
+    }
+    if output_rate:
+        # sentences follow the clock, not the frames, so only the rate is checked
+        report["dropped_frames"] = report["lost_frames"] = None
+        report["latency_ms"] = span6_pipeline.latency_percentiles(pipeline.scheduler.ages_ns)
+        return report
+
+    matches, unexpected = match_sentences(expected, received)
+    report["unexpected_sentences"] = unexpected
+    # dropped: frames without their own sentence; lost: the ones not explained by the writer
+    # sending only the newest sentence (sentences_skipped), i.e. frames the converter never got through
+    report["dropped_frames"] = len(expected) - len(matches)
+    report["lost_frames"] = max(0, report["dropped_frames"] - pipeline.sentences_skipped)
+    report["latency_ms"] = span6_pipeline.latency_percentiles(
+        [received[received_index][0] - frame_sent_ns[frame_index] for frame_index, received_index in matches])
+    return report
+
+
+def find_max_rate(stream, bauds=(115200, 230400, 460800, 921600, 2000000, 4000000, 8000000, 16000000),
+                  max_lost_fraction=0.001, max_p99_ms=20.0, max_late_ms=50.0):
+    # Replays stream at rising line rates (a pty has no real baud limit) until the converter
+    # loses frames, falls behind or stalls the writer. Returns (highest sustained frames/s or None, reports)
+    reports = []
+    best = None
+    for baud in bauds:
+        report = run_loopback(stream, baud=baud)
+        reports.append(report)
+        sustained = (report["error"] is None
+                     and report["lost_frames"] <= max_lost_fraction * report["frames"]
+                     and report["latency_ms"].get("p99", 0) <= max_p99_ms
+                     and report["replay_worst_late_ms"] <= max_late_ms)
+        if not sustained:
+            break
+        best = report["frames_per_s"]
+    return best, reports
+
+
+def measure_startup(stream, baud=115200, repeat=5, service_args=(), timeout=10.0):
+    # Milliseconds from launching span6_service.py until its first TSS1 sentence arrives on the TX
+    # port, for each of repeat cold process starts. The receiver is already streaming when the
+    # converter starts, as after a converter-only power cycle
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "span6_service.py")
+    chunks = [stream[offset:offset + 64] for offset in range(0, len(stream), 64)]
+    times_ms = []
+    for _ in range(repeat):
+        with PtyPair() as rx_pair, PtyPair() as tx_pair:
+            feeder = threading.Thread(target=replay, args=(rx_pair.master, chunks, baud), daemon=True)
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, script, "--rx", rx_pair.name, "--rx-baud", str(baud),
+                 "--tx", tx_pair.name, "--tx-baud", str(baud), "--stats-interval", "0", *service_args],
+                stdout=subprocess.DEVNULL)
+            feeder.start()
+            received = b""
+            try:
+                while b"\r\n" not in received:
+                    ready, _, _ = select.select([tx_pair.master], [], [], timeout)
+                    if not ready:
+                        raise RuntimeError(f"No TSS1 within {timeout} s of start")
+                    received += os.read(tx_pair.master, 4096)
+                times_ms.append((time.perf_counter() - start) * 1e3)
+            finally:
+                process.terminate()
+                process.wait()
+    return times_ms
+
+
+def print_report(report):
+    print(f"{report['frames']} frames in {report['replay_s']:.2f} s ({report['frames_per_s']:,.0f} frames/s) "
+          f"at {report['baud']} baud")
+    print(f"  received {report['sentences_received']}, dropped {report['dropped_frames']}, "
+          f"skipped {report['sentences_skipped']}, lost {report['lost_frames']}, CRC errors {report['crc_errors']}, "
+          f"resync bytes {report['skipped_bytes']}")
+    print(f"  latency ms {report['latency_ms']}")
+    if report["error"]:
+        print(f"  converter stopped: {report['error']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SPAN6 -> TSS1 converter over pty loopback ports")
+    parser.add_argument("capture", nargs="?", help="recorded SPAN6 bytes, synthetic when omitted")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of synthetic stream")
+    parser.add_argument("--garbage", type=float, default=0.0, help="chance of garbage before a synthetic frame")
+    parser.add_argument("--max-chunk", type=int, default=256, help="largest write into the RX port")
+    parser.add_argument("--output-rate", type=float, help="TSS1 Hz on a fixed clock instead of per frame")
+    parser.add_argument("--max-rate", action="store_true", help="raise the line rate until the converter falls behind")
+    parser.add_argument("--startup", action="store_true", help="time from launching span6_service.py to its first TSS1")
+    parser.add_argument("--trace", help="trace file: replay on the frames' GPS clock and report frame ages")
+    args = parser.parse_args()
+
+    if args.capture:
+        with open(args.capture, "rb") as file:
+            stream = file.read()
+    else:
+        stream = span6_synthetic.generate_stream(args.duration, garbage_probability=args.garbage)
+
+    if args.trace:
+        latency_trace.print_trace_report(run_latency_trace(stream, args.trace, min(args.baud, 921600)))
+    elif args.startup:
+        times_ms = sorted(measure_startup(stream, min(args.baud, 115200)))
+        print(f"time to first TSS1: min {times_ms[0]:.1f} ms, median {times_ms[len(times_ms) // 2]:.1f} ms, "
+              f"max {times_ms[-1]:.1f} ms")
+    elif args.max_rate:
+        best, reports = find_max_rate(stream)
+        for report in reports:
+            print_report(report)
+        print(f"max sustainable rate: {best and round(best)} frames/s")
+    else:
+        print_report(run_loopback(stream, args.baud, args.max_chunk, output_rate=args.output_rate))
@@ -0,0 +1,261 @@
+from collections import namedtuple
+
+import numpy as np
+
+import span6_batch
+import span6_to_tss1 as rs6
+
+# RAWIMUSXB (ID 1462) -> filtered, decimated accelerations for TSS1.
+# Messages are decoded and scaled in blocks; the anti-alias filters keep their state
+# between blocks, so feeding a stream in any block sizes gives the same output as one block
+
+rawimusxb_id = 1462
+standard_gravity = 9.80665
+
+# Raw count -> per-sample increment: accel in m/s (delta-v), gyro in rad (delta-angle), rate in Hz
+ImuScale = namedtuple("ImuScale", ["accel", "gyro", "rate"])
+
+_ft = 0.3048
+imu_scales = {
+    1: ImuScale(2 ** -27 * _ft, 2 ** -33, 100),  # HG1700_AG11
+    4: ImuScale(2 ** -27 * _ft, 2 ** -33, 100),  # HG1700_AG17
+    5: ImuScale(2 ** -27 * _ft, 2 ** -33, 100),  # HG1900_CA29
+    8: ImuScale(2 ** -14, 2 ** -19, 200),  # LN200
+    11: ImuScale(2 ** -27 * _ft, 2 ** -33, 100),  # HG1700_AG58
+    12: ImuScale(2 ** -27 * _ft, 2 ** -33, 100),  # HG1700_AG62
+    13: ImuScale(0.05 * 2 ** -15, np.radians(0.1 * 2 ** -8 / 3600), 200),  # IMAR_FSAS
+    20: ImuScale(2 ** -27 * _ft, 2 ** -33, 100),  # HG1930_AA99
+    26: ImuScale(2.0e-8, 1.0e-9, 200),  # ISA100C
+    27: ImuScale(2 ** -27 * _ft, 2 ** -33, 100),  # HG1900_CA50
+    28: ImuScale(2 ** -27 * _ft, 2 ** -33, 100),  # HG1930_CA50
+    31: ImuScale(200 / 2 ** 31, np.radians(720 / 2 ** 31), 200),  # ADIS16488
+    32: ImuScale(2 ** -22, np.radians(2 ** -21), 125),  # STIM300
+    34: ImuScale(2.0e-8, 1.0e-9, 200),  # ISA100
+    38: ImuScale(2.0e-8, 1.0e-9, 400),  # ISA100_400HZ
+    39: ImuScale(2.0e-8, 1.0e-9, 400),  # ISA100C_400HZ
+}
+
+
+def imu_scale(imu_type, scale=None):
+    # scale overrides the table, e.g. for an IMU type missing from it
+    if scale is not None:
+        return scale
+    scale = imu_scales.get(int(imu_type))
+    if scale is None:
+        raise RuntimeError(f"No RAWIMUSXB scale factors for IMU type {int(imu_type)}, pass them explicitly")
+    return scale
+
+
+def scale_raw_imu(messages, scale=None):
+    # Structured RAWIMUSXB records -> (GPS times, accelerations (n, 3) m/s^2, angular rates (n, 3) rad/s)
+    # in x right, y forward, z up. The IMU reports y with the opposite sign
+    messages = np.asarray(messages)
+    if len(messages) == 0:
+        return np.zeros(0), np.zeros((0, 3)), np.zeros((0, 3))
+    if scale is None:
+        scale = imu_scale(messages["imu_type"][0])
+    sign = np.array([1.0, -1.0, 1.0])
+    accel = np.stack([messages["x_accel"], messages["y_accel"], messages["z_accel"]], axis=1).astype(np.float64)
+    gyro = np.stack([messages["x_gyro"], messages["y_gyro"], messages["z_gyro"]], axis=1).astype(np.float64)
+    accel *= sign * scale.accel * scale.rate
+    gyro *= sign * scale.gyro * scale.rate
+    times = messages["gnss_week"].astype(np.float64) * rs6.gps_week_seconds + messages["gnss_week_seconds"]
+    return times, accel, gyro
+
+
+##############################
+###  Filters
+##############################
+
+def lowpass_taps(cutoff, rate, count=31):
+    # Hamming-windowed sinc low-pass FIR with unit DC gain
+    n = np.arange(count) - (count - 1) / 2
+    taps = np.sinc(2 * cutoff / rate * n) * np.hamming(count)
+    return taps / taps.sum()
+
+
+class FirDecimator:
+    """
+    FIR filter followed by keeping every factor-th sample, over blocks of (n, channels) samples.
+    Only the kept samples are computed. Group delay is (len(taps) - 1) / 2 input samples
+    """
+
+    def __init__(self, taps, factor=1, channels=3):
+        self.taps = np.asarray(taps, dtype=np.float64)[::-1].copy()
+        self.factor = factor
+        self._history = None  # last len(taps) - 1 input samples
+        self._phase = 0  # input samples to skip before the next kept one
+        self._channels = channels
+
+    def process(self, block):
+        # Filtered samples kept from block and their positions in block
+        block = np.asarray(block, dtype=np.float64)
+        if self._history is None:
+            if not len(block):
+                return np.zeros((0, self._channels)), np.zeros(0, dtype=np.int64)
+            # start as if the first sample had always been there, no ramp up from zero
+            self._history = np.repeat(block[:1], len(self.taps) - 1, axis=0)
+        signal = np.concatenate([self._history, block])
+        positions = np.arange(self._phase, len(block), self.factor)
+        windows = np.lib.stride_tricks.sliding_window_view(signal, len(self.taps), axis=0)
+        output = windows[positions] @ self.taps
+        if len(self.taps) > 1:
+            self._history = signal[len(signal) - len(self.taps) + 1:]
+        self._phase = (positions[-1] + self.factor - len(block)) if len(positions) else self._phase - len(block)
+        return output, positions
+
+
+class BiquadDecimator:
+    """
+    Second-order Butterworth low-pass IIR followed by keeping every factor-th sample.
+    The recursion is solved block_length samples at a time with matrix products of its
+    state-space form, so the state carries across blocks without a per-sample loop
+    """
+
+    def __init__(self, cutoff, rate, factor=1, channels=3, block_length=256):
+        # bilinear transform coefficients (RBJ cookbook, Q = 1/sqrt(2))
+        w = 2 * np.pi * cutoff / rate
+        alpha = np.sin(w) / np.sqrt(2)
+        a0 = 1 + alpha
+        self.b = np.array([(1 - np.cos(w)) / 2, 1 - np.cos(w), (1 - np.cos(w)) / 2]) / a0
+        self.a = np.array([-2 * np.cos(w), 1 - alpha]) / a0
+        self.factor = factor
+        self.block_length = block_length
+        self._state = None  # (2, channels) transposed direct form II state
+        self._phase = 0
+        self._channels = channels
+
+        # transposed direct form II as state space: s[n + 1] = A s[n] + B x[n], y[n] = s[n][0] + b0 x[n]
+        b0, b1, b2 = self.b
+        a1, a2 = self.a
+        transition = np.array([[-a1, 1.0], [-a2, 0.0]])
+        gain = np.array([b1 - a1 * b0, b2 - a2 * b0])
+        powers = [np.eye(2)]
+        for _ in range(block_length):
+            powers.append(transition @ powers[-1])
+        self._powers = np.array(powers)  # A^n for n = 0..block_length
+        # y = response @ x + from_state @ s[0] and s[L] = to_state @ x + A^L @ s[0] over a block of L samples
+        impulse = np.concatenate([[b0], self._powers[:block_length - 1, 0, :] @ gain])
+        lag = np.arange(block_length)[:, None] - np.arange(block_length)[None, :]
+        self._response = np.where(lag >= 0, impulse[np.maximum(lag, 0)], 0.0)
+        self._from_state = self._powers[:block_length, 0, :]
+        self._to_state = (self._powers[block_length - 1::-1] @ gain).T
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if self._state is None:
+            if not len(block):
+                return np.zeros((0, self._channels)), np.zeros(0, dtype=np.int64)
+            # steady state for a constant input equal to the first sample
+            self._state = np.array([block[0] * (1 - self.b[0]), block[0] * (self.b[2] - self.a[1])])
+        length = self.block_length
+        state = self._state
+        filtered = np.empty_like(block)
+        for start in range(0, len(block), length):
+            samples = block[start:start + length]
+            count = len(samples)
+            filtered[start:start + count] = self._response[:count, :count] @ samples + self._from_state[:count] @ state
+            state = self._to_state[:, length - count:] @ samples + self._powers[count] @ state
+        self._state = state
+        positions = np.arange(self._phase, len(block), self.factor)
+        self._phase = (positions[-1] + self.factor - len(block)) if len(positions) else self._phase - len(block)
+        return filtered[positions], positions
+
+
+##############################
+###  RAWIMUSXB -> TSS1
+##############################
+
+class RawImuAccelerations:
+    """
+    Scales, filters and decimates blocks of RAWIMUSXB records to output_rate.
+    kind is "fir" or "iir"; the cut-off defaults to 0.4 x output_rate
+    """
+
+    def __init__(self, output_rate=50, input_rate=None, scale=None, kind="fir", taps=31, cutoff=None,
+                 gravity=standard_gravity):
+        self.output_rate = output_rate
+        self.input_rate = input_rate
+        self.scale = scale
+        self.kind = kind
+        self.taps = taps
+        self.cutoff = cutoff
+        self.gravity = gravity
+        self._filter = None
+
+    def _make_filter(self, input_rate):
+        factor = max(int(round(input_rate / self.output_rate)), 1)
+        cutoff = self.cutoff or 0.4 * input_rate / factor
+        if self.kind == "iir":
+            return BiquadDecimator(cutoff, input_rate, factor)
+        return FirDecimator(lowpass_taps(cutoff, input_rate, self.taps), factor)
+
+    def process(self, messages):
+        # (GPS times, accelerations (n, 3) m/s^2, positions in messages) of the decimated outputs
+        messages = np.asarray(messages)
+        if len(messages) == 0:
+            return np.zeros(0), np.zeros((0, 3)), np.zeros(0, dtype=np.int64)
+        scale = self.scale or imu_scale(messages["imu_type"][0])
+        times, accel, _ = scale_raw_imu(messages, scale)
+        if self._filter is None:
+            self._filter = self._make_filter(self.input_rate or scale.rate)
+        filtered, positions = self._filter.process(accel)
+        return times[positions], filtered, positions
+
+    def tss1_fields(self, accel):
+        # TSS1 acceleration inputs from filtered (n, 3) accelerations: gravity comes off the vertical
+        return {
+            "hor_accel": np.hypot(accel[:, 0], accel[:, 1]),
+            "vert_accel": accel[:, 2] - self.gravity,
+        }
+
+
+class RawImuStream:
+    """
+    Collects RAWIMUSXB frames from a framer and runs RawImuAccelerations every block_size messages.
+    feed() returns the newest TSS1 acceleration fields when a block produced any, otherwise None.
+    Frames of another length than the layout are counted in length_errors and dropped
+    """
+
+    message_id = rawimusxb_id
+
+    def __init__(self, block_size=20, **options):
+        self.block_size = block_size
+        self.accelerations = RawImuAccelerations(**options)
+        self._dtype = rs6.rawimusxb_message.dtype
+        self._pending = bytearray()
+        self._count = 0
+        self.length_errors = 0
+
+    def feed(self, frame, header_length):
+        if len(frame) - header_length != self._dtype.itemsize:
+            self.length_errors += 1
+            return None
+        self._pending += frame[header_length:]
+        self._count += 1
+        if self._count < self.block_size:
+            return None
+        return self.flush()
+
+    def flush(self):
+        messages = np.frombuffer(bytes(self._pending), dtype=self._dtype)
+        self._pending.clear()
+        self._count = 0
+        _, accel, _ = self.accelerations.process(messages)
+        if not len(accel):
+            return None
+        fields = self.accelerations.tss1_fields(accel[-1:])
+        return {name: float(values[0]) for name, values in fields.items()}
+
+
+def raw_imu_tss1_inputs(data, index, **options):
+    # span6_batch.tss1_inputs with the accelerations taken from filtered RAWIMUSXB instead of
+    # CORRIMUDATAS. Every decimated output is used from the frame of its last input sample on
+    inputs = span6_batch.tss1_inputs(data, index)
+    frames = index[index["kind"] != span6_batch.header_kinds.index("INS_UPDATE")]
+    rows, messages = span6_batch.decode_messages(data, frames, rawimusxb_id)
+    accelerations = RawImuAccelerations(**options)
+    _, accel, positions = accelerations.process(messages)
+    for name, values in accelerations.tss1_fields(accel).items():
+        inputs[name] = span6_batch._forward_fill(len(frames), rows[positions], values)
+    return inputs
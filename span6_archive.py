@@ -0,0 +1,338 @@
+import argparse
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+import attitude_store
+import span6_batch
+import span6_to_tss1 as rs6
+import tss1_batch
+
+# Columnar archive of decoded SPAN6 frames.
+# A directory holds one append-only record file per message ID in the DataBlock.numpy_types
+# layout (the message bytes exactly as received), a GPS time sidecar per message ID and a
+# frame log with the arrival order of all binary frames. Everything is memory-mapped on read,
+# so seeking to a time window and regenerating TSS1 needs no re-parsing.
+# Run: python span6_archive.py import capture.bin archive_dir
+#      python span6_archive.py record PORT BAUD archive_dir
+#      python span6_archive.py tss1 archive_dir output.tss1 [--start GPS_S] [--end GPS_S]
+
+meta_name = "meta.json"
+frames_name = "frames.rec"
+archive_version = 1
+
+# Arrival order of the binary frames: header GPS time, message ID, row in the message's file
+frame_log_dtype = np.dtype([("time", "<f8"), ("message_id", "<u2"), ("row", "<u4")])
+no_row = 0xFFFFFFFF  # frames of message IDs without a layout
+_frame_log_struct = struct.Struct("<dHI")
+_time_struct = struct.Struct("<d")
+assert _frame_log_struct.size == frame_log_dtype.itemsize
+
+
+def _records_name(message_id):
+    return f"msg{message_id}.rec"
+
+
+def _times_name(message_id):
+    return f"msg{message_id}.time"
+
+
+def _message_dtype(message_id):
+    return rs6.messages_by_id[message_id].dtype
+
+
+class ArchiveWriter:
+    """
+    Appends frames to an archive directory, creating it if needed.
+    append_frame() takes frames one by one from the framer, append_capture() a whole recorded buffer
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, meta_name)
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                self.meta = json.load(file)
+        else:
+            self.meta = {"version": archive_version, "messages": {}}
+        self._rows = {int(message_id): self._row_count(int(message_id)) for message_id in self.meta["messages"]}
+        self._files = {}
+        self._frames = open(os.path.join(directory, frames_name), "ab")
+        self._frames.truncate(self._frames.tell() // frame_log_dtype.itemsize * frame_log_dtype.itemsize)
+        self.frames_written = 0
+
+    def _row_count(self, message_id):
+        # complete records only, a torn write at the end is overwritten
+        path = os.path.join(self.directory, _records_name(message_id))
+        rows = os.path.getsize(path) // _message_dtype(message_id).itemsize if os.path.exists(path) else 0
+        times_path = os.path.join(self.directory, _times_name(message_id))
+        times = os.path.getsize(times_path) // _time_struct.size if os.path.exists(times_path) else 0
+        return min(rows, times)
+
+    def _open_message(self, message_id):
+        if str(message_id) not in self.meta["messages"]:
+            self.meta["messages"][str(message_id)] = {
+                "name": rs6.messages_by_id[message_id].record_type.__name__,
+                "descr": _message_dtype(message_id).descr,
+            }
+            self._write_meta()
+            self._rows[message_id] = 0
+        rows = self._rows[message_id]
+        records = open(os.path.join(self.directory, _records_name(message_id)), "ab")
+        records.truncate(rows * _message_dtype(message_id).itemsize)
+        times = open(os.path.join(self.directory, _times_name(message_id)), "ab")
+        times.truncate(rows * _time_struct.size)
+        self._files[message_id] = (records, times)
+        return self._files[message_id]
+
+    def _write_meta(self):
+        path = os.path.join(self.directory, meta_name)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(self.meta, file, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def append_frame(self, header_record, header_length, frame):
+        # One LONG/SHORT frame as yielded by Span6Framer
+        message_id = header_record.message_id
+        gps_time = rs6.header_gps_time(header_record)
+        block = rs6.messages_by_id.get(message_id)
+        row = no_row
+        if block is not None and len(frame) == header_length + block.size:
+            files = self._files.get(message_id) or self._open_message(message_id)
+            files[0].write(frame[header_length:])
+            files[1].write(_time_struct.pack(gps_time))
+            row = self._rows[message_id]
+            self._rows[message_id] = row + 1
+        self._frames.write(_frame_log_struct.pack(gps_time, message_id, row))
+        self.frames_written += 1
+
+    def append_capture(self, buffer):
+        # Indexes a whole recorded capture and appends all of its binary frames at once.
+        # The index leaves out the frames the framer drops, so both ways log the same frames.
+        # Returns the number of frames dropped for a bad CRC
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        index, crc_errors = span6_batch.index_frames(buffer)
+        frames = index[index["kind"] != span6_batch.header_kinds.index("INS_UPDATE")]
+        log = np.zeros(len(frames), dtype=frame_log_dtype)
+        log["time"] = span6_batch.frame_gps_times(data, frames)
+        log["message_id"] = frames["message_id"]
+        log["row"] = no_row
+        for message_id, (rows, messages) in span6_batch.decode_message_groups(data, frames).items():
+            records, times = self._files.get(message_id) or self._open_message(message_id)
+            records.write(np.ascontiguousarray(messages).tobytes())
+            times.write(log["time"][rows].astype("<f8").tobytes())
+            first = self._rows[message_id]
+            log["row"][rows] = np.arange(first, first + len(rows))
+            self._rows[message_id] = first + len(rows)
+        self._frames.write(log.tobytes())
+        self.frames_written += len(log)
+        return crc_errors
+
+    def flush(self):
+        for records, times in self._files.values():
+            records.flush()
+            times.flush()
+        self._frames.flush()
+
+    def close(self):
+        self.flush()
+        for records, times in self._files.values():
+            records.close()
+            times.close()
+        self._files = {}
+        self._frames.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _descr_dtype(descr):
+    # dtype from a descr that went through JSON (tuples became lists)
+    return np.dtype([tuple(tuple(part) if isinstance(part, list) else part for part in field) for field in descr])
+
+
+def _memmap(path, dtype, count=None):
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    rows = size // dtype.itemsize if count is None else count
+    if rows == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+
+class Archive:
+    """
+    Read-only, memory-mapped view of an archive directory
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, meta_name)) as file:
+            self.meta = json.load(file)
+        if self.meta.get("version") != archive_version:
+            raise RuntimeError(f"unsupported archive version {self.meta.get('version')}")
+        self.frames = _memmap(os.path.join(directory, frames_name), frame_log_dtype)
+        self._messages = {}
+
+    @property
+    def message_ids(self):
+        return sorted(int(message_id) for message_id in self.meta["messages"])
+
+    def messages(self, message_id):
+        # (GPS times, structured records) of one message ID
+        if message_id not in self._messages:
+            if str(message_id) not in self.meta["messages"]:
+                return np.zeros(0), np.zeros(0, dtype=_message_dtype(message_id))
+            dtype = _descr_dtype(self.meta["messages"][str(message_id)]["descr"])
+            times = _memmap(os.path.join(self.directory, _times_name(message_id)), np.dtype("<f8"))
+            records = _memmap(os.path.join(self.directory, _records_name(message_id)), dtype)
+            count = min(len(times), len(records))
+            self._messages[message_id] = (times[:count], records[:count])
+        return self._messages[message_id]
+
+    def frame_window(self, start=None, end=None):
+        # Slice of the frame log with start <= GPS time < end
+        times = self.frames["time"]
+        first = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        last = len(times) if end is None else int(np.searchsorted(times, end, side="left"))
+        return slice(first, last)
+
+    def message_window(self, message_id, start=None, end=None):
+        # (times, records) of one message ID with start <= GPS time < end
+        times, records = self.messages(message_id)
+        first = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        last = len(times) if end is None else int(np.searchsorted(times, end, side="left"))
+        return times[first:last], records[first:last]
+
+    def tss1_inputs(self, start=None, end=None, time_aligned=False, max_gap=None):
+        # Arrays of TSS1 input values for the binary frames in [start, end), equal to the
+        # matching part of span6_batch.tss1_inputs over the whole original capture
+        window = self.frame_window(start, end)
+        frames = self.frames[window]
+        frame_times = np.asarray(frames["time"])
+        updates = {name: ([], [], []) for name in attitude_store.tss1_quantities}
+        initial = {}  # name -> (time, value) of the latest update before the window
+
+        for message_id in rs6.tss1_message_ids:
+            times, records = self.messages(message_id)
+            if not len(records):
+                continue
+            first = int(np.searchsorted(times, frame_times[0], side="left")) if len(frames) else len(times)
+            if time_aligned:
+                # two samples either side of the window for the interpolation
+                last = int(np.searchsorted(times, frame_times[-1], side="right")) if len(frames) else first
+                selected = records[max(first - 2, 0):last + 2]
+                sample_times = message_times(message_id, selected, times[max(first - 2, 0):last + 2])
+                for name, values in rs6.tss1_fields(message_id, selected.view(np.recarray)).items():
+                    updates[name][1].append(np.asarray(values, dtype=np.float64))
+                    updates[name][2].append(sample_times)
+                continue
+
+            positions = np.flatnonzero(frames["message_id"] == message_id)
+            rows = frames["row"][positions]
+            known = rows != no_row
+            positions, rows = positions[known], rows[known].astype(np.int64)
+            for name, values in rs6.tss1_fields(message_id, records[rows].view(np.recarray)).items():
+                updates[name][0].append(positions)
+                updates[name][1].append(np.asarray(values, dtype=np.float64))
+            # the value in force when the window opens
+            before = (int(rows[0]) if len(rows) else first) - 1
+            if window.start > 0 and before >= 0:
+                previous = records[before:before + 1].view(np.recarray)
+                for name, value in rs6.tss1_fields(message_id, previous).items():
+                    if name not in initial or times[before] >= initial[name][0]:
+                        initial[name] = (times[before], float(value[0]))
+
+        inputs = {}
+        for name, (positions, values, times) in updates.items():
+            if not values:
+                inputs[name] = np.zeros(len(frames))
+            elif time_aligned:
+                times = np.concatenate(times)
+                values = np.concatenate(values)
+                order = np.argsort(times, kind="stable")
+                inputs[name] = attitude_store.interpolate_series(times[order], values[order], frame_times, max_gap)
+            else:
+                positions = np.concatenate(positions)
+                values = np.concatenate(values)
+                order = np.argsort(positions, kind="stable")
+                inputs[name] = span6_batch._forward_fill(len(frames), positions[order], values[order],
+                                                         initial.get(name, (0, 0.0))[1])
+        return inputs
+
+    def tss1(self, start=None, end=None, time_aligned=False, max_gap=None):
+        # TSS1 records of the window and their in-range mask, see tss1_batch.encode_tss1_batch
+        return tss1_batch.encode_tss1_batch(**self.tss1_inputs(start, end, time_aligned, max_gap))
+
+
+def message_times(message_id, records, header_times):
+    # GPS times of archived records: their own time fields if they have them, else the header time
+    time_fields = rs6.message_time_fields.get(message_id)
+    if time_fields is None:
+        return np.asarray(header_times, dtype=np.float64)
+    week, seconds = time_fields
+    return records[week].astype(np.float64) * rs6.gps_week_seconds + records[seconds]
+
+
+def record_port(port, directory, flush_interval=1.0):
+    # Recorder mode: frames from a serial port into an archive until interrupted
+    framer = rs6.Span6Framer()
+    with ArchiveWriter(directory) as writer:
+        next_flush = time.monotonic() + flush_interval
+        while True:
+            framer.feed(port.read(port.in_waiting or 1))
+            for header, header_rec, header_len, frame in framer:
+                if header != "INS_UPDATE":
+                    writer.append_frame(header_rec, header_len, frame)
+            if time.monotonic() >= next_flush:
+                writer.flush()
+                next_flush = time.monotonic() + flush_interval
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="columnar SPAN6 archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("import", help="append a recorded capture to an archive")
+    command.add_argument("capture")
+    command.add_argument("archive")
+    command = commands.add_parser("record", help="record a serial port into an archive")
+    command.add_argument("port")
+    command.add_argument("baud", type=int)
+    command.add_argument("archive")
+    command = commands.add_parser("tss1", help="write the TSS1 sentences of a time window")
+    command.add_argument("archive")
+    command.add_argument("output")
+    command.add_argument("--start", type=float, help="GPS seconds")
+    command.add_argument("--end", type=float, help="GPS seconds")
+    command.add_argument("--time-aligned", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        mapped, data = span6_batch.open_capture(args.capture)
+        try:
+            with ArchiveWriter(args.archive) as writer:
+                crc_errors = writer.append_capture(mapped)
+        finally:
+            del data
+            mapped.close()
+        print(f"{writer.frames_written} frames archived, {crc_errors} CRC errors")
+    elif args.command == "record":
+        port = rs6.serial_open(args.port, args.baud)
+        try:
+            record_port(port, args.archive)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            rs6.serial_close(port)
+    else:
+        records, in_range = Archive(args.archive).tss1(args.start, args.end, args.time_aligned)
+        with open(args.output, "wb") as file:
+            file.write(records[in_range])
+        print(f"{int(np.count_nonzero(in_range))} TSS1 sentences written, "
+              f"{int(np.count_nonzero(~in_range))} out of range")
@@ -0,0 +1,274 @@
+import argparse
+import multiprocessing
+import re
+import zlib
+
+import numpy as np
+
+import attitude_store
+import span6_batch
+import span6_to_tss1 as rs6
+import tss1_batch
+
+# Offline processing of recorded NovAtel ASCII logs ('#...*crc' and '%...*crc' records).
+# The capture is memory mapped and handled in blocks of whole lines, so its size is not limited
+# by memory: the records of a block are split by one regex pass, CRC-checked, grouped by log and
+# every group is converted column by column into the structured arrays of the binary layouts.
+# Binary frames and other text in between are ignored.
+# Run: python span6_ascii.py capture.txt [output.tss1]
+
+default_block_size = 16 << 20
+
+_record = re.compile(rb'([#%])([A-Z][^#%*\r\n]*)\*([0-9a-fA-F]{8})\r\n')
+
+_hex_digits = np.zeros(256, dtype=np.uint32)
+_hex_digits[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+_hex_digits[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+_hex_digits[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+
+
+def capture_blocks(buffer, block_size=default_block_size):
+    # (start, end) of consecutive blocks of buffer, cut after a line end
+    size = len(buffer)
+    start = 0
+    while start < size:
+        end = min(start + block_size, size)
+        if end < size:
+            line_end = buffer.rfind(b"\n", start, end)
+            if line_end != -1:
+                end = line_end + 1
+        yield start, end
+        start = end
+
+
+def parse_hex32(values):
+    # uint32 array from a list of 8-digit hex bytes values
+    digits = _hex_digits[np.frombuffer(b"".join(values), dtype=np.uint8)].reshape(-1, 8)
+    return (digits << np.arange(28, -1, -4, dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+
+
+def ascii_crc_batch(contents):
+    # NovAtel CRC-32 of every bytes value: zlib CRC with the zero-length fix of span6_crc32
+    # applied once per distinct length
+    crcs = np.fromiter(map(zlib.crc32, contents), dtype=np.uint32, count=len(contents))
+    lengths = np.fromiter(map(len, contents), dtype=np.int64, count=len(contents))
+    unique, inverse = np.unique(lengths, return_inverse=True)
+    fixes = np.array([zlib.crc32(bytes(int(length))) for length in unique], dtype=np.uint32)
+    return crcs ^ fixes[inverse]
+
+
+def _decode_columns(message_id, bodies, crcs):
+    # Structured array of message records from the field text of CRC-checked logs.
+    # None if a log does not split into the layout's fields or a number does not parse
+    block = rs6.messages_by_id[message_id]
+    fields = [(name, size) for name, size in zip(block._names, block._sizes) if name != "CRC"]
+    tokens = b",".join(bodies).split(b",")
+    if len(tokens) != len(bodies) * len(fields):
+        return None
+    columns = np.array(tokens).reshape(len(bodies), len(fields))
+    messages = np.zeros(len(bodies), dtype=block.dtype)
+    try:
+        for column, (name, (type_name, count)) in enumerate(fields):
+            values = columns[:, column]
+            if name in rs6.ascii_enums:
+                keys, inverse = np.unique(values, return_inverse=True)
+                table = rs6.ascii_enums[name]
+                messages[name] = np.array([table.get(key.decode(), -1) for key in keys])[inverse]
+            elif type_name == rs6.elemT.c8:
+                data = b"".join(int(value, 16).to_bytes(count, "little") for value in values)
+                messages[name] = np.frombuffer(data, dtype=np.uint8).reshape(messages[name].shape)
+            else:
+                messages[name] = values.astype(messages.dtype[name])
+    except ValueError:
+        return None
+    messages["CRC"] = crcs
+    return messages
+
+
+def _decode_times(heads, long_header):
+    # GPS seconds from the header text of logs, None if a header does not split as expected
+    tokens = b",".join(heads).split(b",")
+    width = 10 if long_header else 3
+    if len(tokens) != len(heads) * width:
+        return None
+    columns = np.array(tokens).reshape(len(heads), width)
+    week_column, seconds_column = (5, 6) if long_header else (1, 2)
+    try:
+        week = columns[:, week_column].astype(np.int64)
+        seconds = columns[:, seconds_column].astype(np.float64)
+    except ValueError:
+        return None
+    return week * rs6.gps_week_seconds + seconds
+
+
+def _decode_records(message_id, records):
+    # Slow path: one log at a time, logs that do not decode are dropped.
+    # Records are packed in the binary layout, which also carries the character array fields
+    block = rs6.messages_by_id[message_id]
+    pack = block._struct.pack
+    rows, times, messages = [], [], []
+    for row, sync, content, crc in records:
+        record = sync + content + b"*" + crc + b"\r\n"
+        decoded = rs6.decode_ascii_record(record, 0, len(record))
+        if decoded is not None:
+            rows.append(row)
+            times.append(rs6.header_gps_time(decoded[0]))
+            messages.append(pack(*decoded[2]))
+    return np.array(rows, dtype=np.int64), np.array(times), np.frombuffer(b"".join(messages), dtype=block.dtype)
+
+
+def decode_block(buffer, start=0, end=None):
+    # Returns (number of decoded logs, {message_id: (rows, GPS times, messages)}, CRC errors)
+    # for the ASCII logs in buffer[start:end]. rows number the decoded logs of the block, the ones
+    # the framer turns into frames: logs without a layout or that do not decode are left out
+    if end is None:
+        end = len(buffer)
+    records = _record.findall(buffer, start, end)
+    if not records:
+        return 0, {}, 0
+    syncs, contents, crcs = zip(*records)
+    expected = parse_hex32(crcs)
+    good = ascii_crc_batch(contents) == expected
+    valid = np.flatnonzero(good)
+
+    groups = {}
+    for row, record in enumerate(valid.tolist()):
+        content = contents[record]
+        groups.setdefault(content[:content.find(b",")], []).append((row, record))
+
+    decoded = {}
+    for name, group in groups.items():
+        message_id = rs6.ascii_log_ids.get(name)
+        if message_id is None:
+            continue
+        # like decode_ascii_record, a log with the other sync than its registered header is dropped
+        long_header = rs6.message_headers[message_id] == "LONG"
+        sync = b"#" if long_header else b"%"
+        group = [(row, record) for row, record in group if syncs[record] == sync]
+        if not group:
+            continue
+        rows, group_records = np.array(group, dtype=np.int64).T
+        heads, bodies = zip(*(contents[record].partition(b";")[::2] for record in group_records.tolist()))
+        messages = _decode_columns(message_id, bodies, expected[group_records])
+        times = _decode_times(heads, long_header)
+        if messages is None or times is None:
+            decoded[message_id] = _decode_records(
+                message_id, [(row, syncs[record], contents[record], crcs[record]) for row, record in group])
+        else:
+            decoded[message_id] = (rows, times, messages)
+
+    # renumber from CRC-checked to decoded logs
+    kept = np.sort(np.concatenate([rows for rows, _, _ in decoded.values()])) if decoded else np.zeros(0, np.int64)
+    decoded = {message_id: (np.searchsorted(kept, rows), times, messages)
+               for message_id, (rows, times, messages) in decoded.items()}
+    return len(kept), decoded, len(records) - len(valid)
+
+
+def read_ascii_capture(buffer, block_size=default_block_size):
+    # Yields decode_block() of every block of a capture
+    for start, end in capture_blocks(buffer, block_size):
+        yield decode_block(buffer, start, end)
+
+
+def _decode_piece(task):
+    # Worker: decode_block() of one block of a capture file
+    path, start, end = task
+    mapped, data = span6_batch.open_capture(path)
+    try:
+        return decode_block(mapped, start, end)
+    finally:
+        del data
+        mapped.close()
+
+
+def read_ascii_file(path, block_size=default_block_size, workers=1):
+    # Yields decode_block() of every block of a capture file, in order.
+    # With more than one worker the blocks are decoded by a process pool
+    mapped, data = span6_batch.open_capture(path)
+    try:
+        if workers == 1:
+            yield from read_ascii_capture(mapped, block_size)
+            return
+        tasks = [(path, start, end) for start, end in capture_blocks(mapped, block_size)]
+    finally:
+        del data
+        mapped.close()
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(_decode_piece, tasks)
+
+
+def ascii_messages(path, message_ids=None, block_size=default_block_size, workers=1):
+    # {message_id: (GPS times, messages)} of a whole capture, like span6_batch.decode_messages
+    # gives for a binary one
+    parts = {}
+    for _, decoded, _ in read_ascii_file(path, block_size, workers):
+        for message_id, (_, times, messages) in decoded.items():
+            if message_ids is None or message_id in message_ids:
+                parts.setdefault(message_id, []).append((times, messages))
+    return {message_id: (np.concatenate([times for times, _ in blocks]), np.concatenate([messages for _, messages in blocks]))
+            for message_id, blocks in parts.items()}
+
+
+def tss1_block_inputs(count, decoded, carry):
+    # Arrays of TSS1 input values, one per log of a block, like span6_batch.tss1_inputs.
+    # carry holds the values before the block and is updated to the values after it
+    updates = {name: ([], []) for name in attitude_store.tss1_quantities}
+    for message_id, (rows, _, messages) in decoded.items():
+        if message_id not in rs6.tss1_message_ids:
+            continue
+        for name, values in rs6.tss1_fields(message_id, messages.view(np.recarray)).items():
+            updates[name][0].append(rows)
+            updates[name][1].append(np.asarray(values, dtype=np.float64))
+
+    inputs = {}
+    for name, (rows, values) in updates.items():
+        if rows:
+            rows = np.concatenate(rows)
+            order = np.argsort(rows, kind="stable")
+            inputs[name] = span6_batch._forward_fill(count, rows[order], np.concatenate(values)[order], carry[name])
+        else:
+            inputs[name] = np.full(count, carry[name], dtype=np.float64)
+        if count:
+            carry[name] = float(inputs[name][-1])
+    return inputs
+
+
+def convert_ascii_capture(input_path, output_path, block_size=default_block_size, workers=1):
+    # Converts a recorded ASCII log capture into a TSS1 text file, one sentence per decoded log.
+    # Returns the number of sentences written, of logs dropped for a bad CRC and
+    # of sentences skipped because a value was out of the TSS1 range
+    carry = {name: 0.0 for name in attitude_store.tss1_quantities}
+    written = crc_errors = out_of_range = 0
+    with open(output_path, "wb") as file:
+        for count, decoded, block_crc_errors in read_ascii_file(input_path, block_size, workers):
+            inputs = tss1_block_inputs(count, decoded, carry)
+            records, in_range = tss1_batch.encode_tss1_batch(**inputs)
+            file.write(records[in_range])
+            written += int(np.count_nonzero(in_range))
+            crc_errors += block_crc_errors
+            out_of_range += int(np.count_nonzero(~in_range))
+    return written, crc_errors, out_of_range
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="NovAtel ASCII log capture -> TSS1 conversion")
+    parser.add_argument("input", help="text capture")
+    parser.add_argument("output", nargs="?", help="TSS1 file, without it the logs are only counted")
+    parser.add_argument("--block-mb", type=float, default=default_block_size / (1 << 20))
+    parser.add_argument("--workers", type=int, default=1, help="decoding processes")
+    args = parser.parse_args()
+
+    block_size = int(args.block_mb * (1 << 20))
+    if args.output:
+        written, crc_errors, out_of_range = convert_ascii_capture(args.input, args.output, block_size, args.workers)
+        print(f"{written} TSS1 sentences written, {crc_errors} CRC errors, {out_of_range} out of range")
+    else:
+        counts = {}
+        logs = crc_errors = 0
+        for count, decoded, block_crc_errors in read_ascii_file(args.input, block_size, args.workers):
+            logs += count
+            crc_errors += block_crc_errors
+            for message_id, (rows, _, _) in decoded.items():
+                counts[message_id] = counts.get(message_id, 0) + len(rows)
+        print(f"{logs} decoded logs, {crc_errors} CRC errors, "
+              + ", ".join(f"{rs6.ascii_message_names[message_id]}: {count}" for message_id, count in sorted(counts.items())))
@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import os
+
+import serial
+
+import span6_metrics
+import span6_stream
+import span6_to_tss1 as rs6
+
+# Single-threaded asyncio converter for many SPAN6 inputs and TSS1 outputs (Linux, fd based).
+# Every input has its own framer; any input can feed any number of serial, UDP or TCP outputs.
+# Run: python span6_async.py --input ins1=/dev/ttyUSB0:921600 --output out1=serial:/dev/ttyUSB1:115200
+#                            --output udp1=udp:127.0.0.1:5000 --route ins1=out1,udp1
+
+
+class StreamConverter:
+    """
+    SPAN6 -> TSS1 state of one input: framer, latest field values and metrics.
+    feed() returns the TSS1 sentences of the frames completed by the bytes
+    """
+
+    def __init__(self, name, time_aligned=False):
+        self.name = name
+        self.framer = rs6.Span6Framer()
+        self.attitude = span6_stream.AttitudeState(time_aligned)
+        self.fields = self.attitude.fields
+        self.metrics = span6_metrics.ConverterMetrics(self.framer)
+        self.outputs = []
+
+    def feed(self, data):
+        metrics = self.metrics
+        fields = self.fields
+        update = self.attitude.update
+        metrics.rx_bytes += len(data)
+        self.framer.feed(data)
+        sentences = []
+        for header, header_rec, header_len, frame in self.framer:
+            if header == "INS_UPDATE":
+                metrics.ascii_records += 1
+                continue
+            message_id = header_rec.message_id
+            metrics.messages[message_id] += 1
+            update(header_rec, frame, header_len)
+            try:
+                sentences.append(rs6.create_tss1(**fields).encode())
+            except RuntimeError:
+                metrics.range_errors += 1
+        return sentences
+
+
+##############################
+###  Outputs
+##############################
+
+class SerialOutput:
+    """
+    Non-blocking writes to a serial port (or any fd). While the port is busy only the
+    newest sentence waits behind the one being written, older ones are skipped
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.fd = port if isinstance(port, int) else port.fileno()
+        self.sent = 0
+        self.skipped = 0
+        self._loop = None
+        self._pending = b''  # rest of the sentence being written
+        self._next = None  # newest sentence waiting for the port
+
+    async def start(self, loop):
+        self._loop = loop
+        os.set_blocking(self.fd, False)
+
+    def send(self, sentence):
+        if self._pending:
+            if self._next is not None:
+                self.skipped += 1
+            self._next = sentence
+            return
+        self._write(sentence)
+
+    def _write(self, data):
+        try:
+            written = os.write(self.fd, data)
+        except BlockingIOError:
+            written = 0
+        if written < len(data):
+            self._pending = data[written:]
+            self._loop.add_writer(self.fd, self._on_writable)
+            return
+        self.sent += 1
+
+    def _on_writable(self):
+        self._loop.remove_writer(self.fd)
+        pending, self._pending = self._pending, b''
+        self._write(pending)
+        if not self._pending and self._next is not None:
+            sentence, self._next = self._next, None
+            self._write(sentence)
+
+    def close(self):
+        if self._loop is not None and self._pending:
+            self._loop.remove_writer(self.fd)
+
+
+class UdpOutput:
+    """
+    One datagram per TSS1 sentence to host:port
+    """
+
+    def __init__(self, host="127.0.0.1", port=5000):
+        self.address = (host, port)
+        self.sent = 0
+        self.skipped = 0
+        self._transport = None
+
+    async def start(self, loop):
+        self._transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                                 remote_addr=self.address)
+
+    def send(self, sentence):
+        self._transport.sendto(sentence)
+        self.sent += 1
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+class TcpOutput:
+    """
+    TCP server on host:port streaming the sentences to every connected client.
+    A client that does not keep up gets sentences skipped instead of an ever growing buffer
+    """
+
+    def __init__(self, host="127.0.0.1", port=5001, max_buffer=4 * rs6.tss1_size):
+        self.address = (host, port)
+        self.max_buffer = max_buffer
+        self.sent = 0
+        self.skipped = 0
+        self._server = None
+        self._clients = set()
+
+    async def start(self, loop):
+        self._server = await asyncio.start_server(self._on_client, *self.address)
+
+    async def _on_client(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            await reader.read()  # until the client disconnects
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def send(self, sentence):
+        for writer in self._clients:
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.skipped += 1
+                continue
+            writer.write(sentence)
+            self.sent += 1
+
+    def close(self):
+        for writer in self._clients:
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+
+
+##############################
+###  Engine
+##############################
+
+class Span6Engine:
+    """
+    Converts any number of SPAN6 inputs on one event loop.
+    Inputs are read when their fd becomes readable, so idle streams cost nothing
+    """
+
+    def __init__(self, read_size=1 << 16):
+        self.read_size = read_size
+        self.inputs = {}  # name -> (fd, StreamConverter)
+        self.outputs = {}
+        self.closed_inputs = set()  # inputs that reached end of file
+        self._loop = None
+        self._stop = None
+
+    def add_input(self, name, port, time_aligned=False):
+        # port: an open serial.Serial or a file descriptor
+        if name in self.inputs:
+            raise RuntimeError(f"input {name} already exists")
+        fd = port if isinstance(port, int) else port.fileno()
+        converter = StreamConverter(name, time_aligned)
+        self.inputs[name] = (fd, converter)
+        return converter
+
+    def add_output(self, name, output):
+        if name in self.outputs:
+            raise RuntimeError(f"output {name} already exists")
+        self.outputs[name] = output
+        return output
+
+    def route(self, input_name, *output_names):
+        _, converter = self.inputs[input_name]
+        for output_name in output_names:
+            if output_name not in self.outputs:
+                raise RuntimeError(f"unknown output {output_name}")
+            converter.outputs.append(self.outputs[output_name])
+
+    def stop(self):
+        if self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for output in self.outputs.values():
+            await output.start(self._loop)
+        for name, (fd, converter) in self.inputs.items():
+            os.set_blocking(fd, False)
+            self._loop.add_reader(fd, self._on_readable, name, fd, converter)
+        try:
+            await self._stop.wait()
+        finally:
+            for name, (fd, _) in self.inputs.items():
+                if name not in self.closed_inputs:
+                    self._loop.remove_reader(fd)
+            for output in self.outputs.values():
+                output.close()
+
+    def _on_readable(self, name, fd, converter):
+        try:
+            data = os.read(fd, self.read_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''  # e.g. EIO when the other end of a pty went away
+        if not data:
+            self._loop.remove_reader(fd)
+            self.closed_inputs.add(name)
+            if len(self.closed_inputs) == len(self.inputs):
+                self._stop.set()
+            return
+        outputs = converter.outputs
+        for sentence in converter.feed(data):
+            for output in outputs:
+                output.send(sentence)
+
+
+##############################
+###  Command line
+##############################
+
+def _split_spec(spec):
+    name, _, value = spec.partition("=")
+    if not value:
+        raise RuntimeError(f"expected NAME=VALUE, got {spec}")
+    return name, value
+
+
+def open_output(spec):
+    # serial:PORT[:BAUD], udp:HOST:PORT or tcp:HOST:PORT
+    kind, _, target = spec.partition(":")
+    if kind == "serial":
+        port_name, _, baud = target.partition(":")
+        return SerialOutput(serial.Serial(port_name, int(baud or 115200), timeout=0, write_timeout=0))
+    host, _, port = target.rpartition(":")
+    if kind == "udp":
+        return UdpOutput(host or "127.0.0.1", int(port))
+    if kind == "tcp":
+        return TcpOutput(host or "127.0.0.1", int(port))
+    raise RuntimeError(f"unknown output {spec}")
+
+
+def build_engine(input_specs, output_specs, route_specs, time_aligned=False):
+    engine = Span6Engine()
+    for spec in input_specs:
+        name, target = _split_spec(spec)
+        port_name, _, baud = target.partition(":")
+        engine.add_input(name, serial.Serial(port_name, int(baud or 115200), timeout=0), time_aligned)
+    for spec in output_specs:
+        name, target = _split_spec(spec)
+        engine.add_output(name, open_output(target))
+    if route_specs:
+        for spec in route_specs:
+            name, targets = _split_spec(spec)
+            engine.route(name, *targets.split(","))
+    else:
+        # without routes every input feeds every output
+        for name in engine.inputs:
+            engine.route(name, *engine.outputs)
+    return engine
+
+
+async def report_forever(engine, interval):
+    while True:
+        await asyncio.sleep(interval)
+        for name, (_, converter) in engine.inputs.items():
+            print(f"{name}: {converter.metrics.summary_line()}")
+        for name, output in engine.outputs.items():
+            print(f"{name}: sent {output.sent}, skipped {output.skipped}")
+
+
+async def main(args):
+    engine = build_engine(args.input, args.output, args.route, args.time_aligned)
+    reporter = asyncio.ensure_future(report_forever(engine, args.stats_interval))
+    try:
+        await engine.run()
+    finally:
+        reporter.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="asyncio SPAN6 -> TSS1 converter")
+    parser.add_argument("--input", action="append", default=[], metavar="NAME=PORT[:BAUD]")
+    parser.add_argument("--output", action="append", default=[],
+                        metavar="NAME=serial:PORT[:BAUD]|udp:HOST:PORT|tcp:HOST:PORT")
+    parser.add_argument("--route", action="append", default=[], metavar="INPUT=OUTPUT[,OUTPUT]")
+    parser.add_argument("--time-aligned", action="store_true")
+    parser.add_argument("--stats-interval", type=float, default=5.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
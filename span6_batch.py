@@ -0,0 +1,309 @@
+import mmap
+import sys
+
+import numpy as np
+
+import attitude_store
+import span6_to_tss1 as rs6
+import tss1_batch
+
+# Offline processing of recorded SPAN6 binary logs
+# Run: python span6_batch.py capture.bin [output.tss1]
+
+crc32_table = np.array(rs6.crc32_table, dtype=np.uint32)
+
+header_kinds = ("LONG", "SHORT", "INS_UPDATE")
+
+frame_index_dtype = np.dtype([
+    ("offset", "<i8"),
+    ("size", "<i4"),
+    ("kind", "u1"),  # index in header_kinds
+    ("header_length", "u1"),
+    ("message_id", "<u2"),
+])
+
+
+def open_capture(path):
+    # Read-only memory map of a capture file, returns (mmap, uint8 array)
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped, np.frombuffer(mapped, dtype=np.uint8)
+
+
+def crc32_batch(data, offsets, length):
+    # NovAtel CRC-32 of data[offset:offset + length] for every offset,
+    # one table lookup per byte column across all frames
+    count = len(offsets)
+    crc = np.zeros(count, dtype=np.uint32)
+    index = np.empty(count, dtype=np.uint32)
+    lookup = np.empty(count, dtype=np.uint32)
+    column = np.empty(count, dtype=np.uint8)
+    position = np.array(offsets, dtype=np.int64)
+    for _ in range(length):
+        np.take(data, position, out=column)
+        position += 1
+        np.bitwise_xor(crc, column, out=index)
+        index &= 0xFF
+        crc >>= 8
+        np.take(crc32_table, index, out=lookup)
+        crc ^= lookup
+    return crc
+
+
+def check_crc_batch(data, offsets, sizes, block_rows=1 << 16):
+    # Boolean mask of frames (header + message + CRC) whose CRC matches
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    valid = np.zeros(len(offsets), dtype=bool)
+    for size in np.unique(sizes):
+        group = np.flatnonzero(sizes == size)
+        for first in range(0, len(group), block_rows):
+            rows = group[first:first + block_rows]
+            crc_offsets = offsets[rows] + size - 4
+            expected = (data[crc_offsets].astype(np.uint32)
+                        | data[crc_offsets + 1].astype(np.uint32) << 8
+                        | data[crc_offsets + 2].astype(np.uint32) << 16
+                        | data[crc_offsets + 3].astype(np.uint32) << 24)
+            valid[rows] = crc32_batch(data, offsets[rows], size - 4) == expected
+    return valid
+
+
+def find_binary_syncs(data, block_size=1 << 26):
+    # Offsets and header kinds of every AA 44 12 / AA 44 13 pattern, searched block-wise
+    offsets = []
+    kinds = []
+    for start in range(0, max(len(data) - 2, 0), block_size):
+        block = data[start:start + block_size + 2]
+        candidates = np.flatnonzero(block[:-2] == 0xAA)
+        candidates = candidates[block[candidates + 1] == 0x44]
+        third = block[candidates + 2]
+        candidates = candidates[(third == 0x12) | (third == 0x13)]
+        offsets.append(candidates + start)
+        kinds.append(np.where(block[candidates + 2] == 0x12,
+                              header_kinds.index("LONG"), header_kinds.index("SHORT")).astype(np.uint8))
+    if not offsets:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+    return np.concatenate(offsets).astype(np.int64), np.concatenate(kinds)
+
+
+def _ascii_frames(buffer, binary_offsets, binary_ends, start=0, end=None):
+    # (offset, size) of complete INS_UPDATE records in buffer[start:end] that are not inside a
+    # binary frame, offsets relative to start like the binary ones
+    if end is None:
+        end = len(buffer)
+    records = []
+    offset = buffer.find(rs6.ascii_usb_info, start, end)
+    while offset != -1:
+        size = rs6.get_insupdate_size(buffer, offset, end)
+        if offset + size < end:
+            records.append((offset - start, size))
+        offset = buffer.find(rs6.ascii_usb_info, offset + size, end)
+    if not records:
+        return np.zeros((0, 2), dtype=np.int64)
+    records = np.array(records, dtype=np.int64)
+    inside = np.searchsorted(binary_offsets, records[:, 0], side="right") - 1
+    covered = (inside >= 0) & (records[:, 0] < binary_ends[np.maximum(inside, 0)])
+    return records[~covered]
+
+
+def registered_kinds():
+    # Header kind of every message ID as registered in rs6.message_headers, 255 for the others
+    kinds = np.full(1 << 16, 255, dtype=np.uint8)
+    for message_id, header in rs6.message_headers.items():
+        kinds[message_id] = header_kinds.index(header)
+    return kinds
+
+
+def index_frames(buffer, start=0, end=None):
+    # Frame index of a whole capture and the number of binary frames dropped for a bad CRC.
+    # Every sync candidate is sized from its header and CRC-checked in bulk, so false
+    # syncs are rejected without walking the stream frame by frame.
+    # Like the framer, frames of a log registered with the other header are left out.
+    # With start/end only buffer[start:end] is indexed, without copying it; offsets are relative to start
+    if end is None:
+        end = len(buffer)
+    data = np.frombuffer(buffer, dtype=np.uint8, count=end - start, offset=start)
+    offsets, kinds = find_binary_syncs(data)
+
+    is_long = kinds == header_kinds.index("LONG")
+    header_length = np.where(is_long, rs6.header_long.size, rs6.header_short.size)
+    sizes = np.full(len(offsets), -1, dtype=np.int64)
+    has_length = offsets + np.where(is_long, 10, 4) <= len(data)
+    long_length = data[np.minimum(offsets + 8, len(data) - 1)] | (data[np.minimum(offsets + 9, len(data) - 1)].astype(np.int64) << 8)
+    short_length = data[np.minimum(offsets + 3, len(data) - 1)].astype(np.int64)
+    sizes[has_length] = (header_length + np.where(is_long, long_length, short_length) + 4)[has_length]
+    plausible = has_length & (offsets + sizes <= len(data))
+    plausible &= ~is_long | (data[np.minimum(offsets + 3, len(data) - 1)] == rs6.header_long.size)
+
+    candidates = np.flatnonzero(plausible)
+    valid = check_crc_batch(data, offsets[candidates], sizes[candidates])
+    good = candidates[valid]
+    bad = candidates[~valid]
+
+    # Drop frames overlapping an earlier good frame (a sync pattern inside a message
+    # that happens to pass the CRC)
+    ends = offsets[good] + sizes[good]
+    if len(good) > 1:
+        keep = np.ones(len(good), dtype=bool)
+        keep[1:] = offsets[good][1:] >= np.maximum.accumulate(ends)[:-1]
+        good = good[keep]
+        ends = ends[keep]
+
+    # Bad candidates inside a good frame are just bytes of that frame
+    inside = np.searchsorted(offsets[good], offsets[bad], side="right") - 1
+    covered = (inside >= 0) & (offsets[bad] < ends[np.maximum(inside, 0)])
+    crc_errors = int(np.count_nonzero(~covered))
+
+    records = _ascii_frames(buffer, offsets[good], ends, start, end)
+
+    # a mismatched frame still covers its bytes above, it is just not indexed
+    message_ids = data[offsets[good] + 4] | (data[offsets[good] + 5].astype(np.uint16) << 8)
+    expected_kinds = registered_kinds()[message_ids]
+    matched = (expected_kinds == 255) | (expected_kinds == kinds[good])
+    good = good[matched]
+
+    index = np.zeros(len(good) + len(records), dtype=frame_index_dtype)
+    binary = index[:len(good)]
+    binary["offset"] = offsets[good]
+    binary["size"] = sizes[good]
+    binary["kind"] = kinds[good]
+    binary["header_length"] = header_length[good]
+    binary["message_id"] = message_ids[matched]
+    ascii_records = index[len(good):]
+    ascii_records["offset"] = records[:, 0]
+    ascii_records["size"] = records[:, 1]
+    ascii_records["kind"] = header_kinds.index("INS_UPDATE")
+    index.sort(order="offset", kind="stable")
+    return index, crc_errors
+
+
+def _block_view(data, offsets, block):
+    # Structured array of block records starting at the given offsets.
+    # Evenly spaced records are viewed in place, others are gathered into a copy
+    dtype = block.dtype
+    count = len(offsets)
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    step = int(offsets[1] - offsets[0]) if count > 1 else dtype.itemsize
+    if step >= dtype.itemsize and np.all(np.diff(offsets) == step):
+        return np.ndarray(count, dtype=dtype, buffer=data, offset=int(offsets[0]), strides=(step,))
+    rows = data[offsets[:, None] + np.arange(dtype.itemsize)]
+    return rows.view(dtype).ravel()
+
+
+def decode_messages(data, index, message_id):
+    # Positions in the index and structured array of all messages with message_id
+    block = rs6.messages_dict[str(message_id)]
+    # like the framer, frames with the other header than the layout's are not this log
+    rows = np.flatnonzero((index["message_id"] == message_id)
+                          & (index["kind"] == header_kinds.index(rs6.message_headers[message_id]))
+                          & (index["size"] == index["header_length"].astype(np.int32) + block.size))
+    offsets = index["offset"][rows] + index["header_length"][rows]
+    return rows, _block_view(data, offsets, block)
+
+
+def decode_message_groups(data, index, message_ids=None):
+    # {message_id: (rows, messages)} for every known message ID in the index
+    if message_ids is None:
+        message_ids = [int(message_id) for message_id in rs6.messages_dict]
+    present = set(np.unique(index["message_id"]).tolist())
+    return {message_id: decode_messages(data, index, message_id)
+            for message_id in message_ids if message_id in present}
+
+
+def _forward_fill(length, rows, values, initial=0.0):
+    # Value of the latest update at or before each position, like the streaming loop
+    filled = np.full(length + 1, initial, dtype=np.float64)
+    filled[rows + 1] = values
+    source = np.zeros(length + 1, dtype=np.int64)
+    source[rows + 1] = rows + 1
+    np.maximum.accumulate(source, out=source)
+    return filled[source[1:]]
+
+
+def frame_gps_times(data, index):
+    # GPS seconds of every binary frame in the index from its LONG/SHORT header
+    offsets = index["offset"]
+    is_long = index["kind"] == header_kinds.index("LONG")
+    week_offset = offsets + np.where(is_long, 14, 6)
+    ms_offset = offsets + np.where(is_long, 16, 8)
+    week = data[week_offset].astype(np.int64) | data[week_offset + 1].astype(np.int64) << 8
+    ms = np.zeros(len(index), dtype=np.int64)
+    for byte in range(4):
+        ms |= data[ms_offset + byte].astype(np.int64) << (8 * byte)
+    ms = np.where(is_long, ms.astype(np.uint32).astype(np.int32), ms)  # LONG ms is signed
+    return week * rs6.gps_week_seconds + ms / 1000
+
+
+def _message_gps_times(frame_times, rows, message_id, messages):
+    time_fields = rs6.message_time_fields.get(message_id)
+    if time_fields is None:
+        return frame_times[rows]
+    week, seconds = time_fields
+    return messages[week].astype(np.float64) * rs6.gps_week_seconds + messages[seconds]
+
+
+def tss1_inputs(data, index, time_aligned=False, max_gap=None, initial=0.0):
+    # Arrays of TSS1 input values, one per binary frame.
+    # By default every value is the latest one received, as main.py would send it,
+    # and initial before the first one (NaN marks them for a caller that knows better).
+    # With time_aligned every value is interpolated to the GPS time of the frame
+    binary = np.flatnonzero(index["kind"] != header_kinds.index("INS_UPDATE"))
+    frames = index[binary]
+    frame_times = frame_gps_times(data, frames) if time_aligned else None
+
+    updates = {name: ([], [], []) for name in attitude_store.tss1_quantities}
+    for message_id, (rows, messages) in decode_message_groups(data, frames, rs6.tss1_message_ids).items():
+        times = _message_gps_times(frame_times, rows, message_id, messages) if time_aligned else None
+        for name, values in rs6.tss1_fields(message_id, messages.view(np.recarray)).items():
+            updates[name][0].append(rows)
+            updates[name][1].append(np.asarray(values, dtype=np.float64))
+            updates[name][2].append(times)
+
+    inputs = {}
+    for name, (rows, values, times) in updates.items():
+        if not rows:
+            inputs[name] = np.full(len(frames), initial, dtype=np.float64)
+            continue
+        rows = np.concatenate(rows)
+        values = np.concatenate(values)
+        if time_aligned:
+            times = np.concatenate(times)
+            order = np.argsort(times, kind="stable")
+            inputs[name] = attitude_store.interpolate_series(times[order], values[order], frame_times, max_gap)
+        else:
+            order = np.argsort(rows, kind="stable")
+            inputs[name] = _forward_fill(len(frames), rows[order], values[order], initial)
+    return inputs
+
+
+def convert_capture(input_path, output_path, time_aligned=False):
+    # Converts a recorded SPAN6 binary log into a TSS1 text file.
+    # Returns the number of sentences written, of frames dropped for a bad CRC and
+    # of sentences skipped because a value was out of the TSS1 range
+    mapped, data = open_capture(input_path)
+    try:
+        index, crc_errors = index_frames(mapped)
+        inputs = tss1_inputs(data, index, time_aligned)
+    finally:
+        del data
+        mapped.close()
+
+    records, in_range = tss1_batch.encode_tss1_batch(
+        inputs["hor_accel"], inputs["vert_accel"], inputs["heave"], inputs["roll"], inputs["pitch"])
+    records = records[in_range]
+    with open(output_path, "wb") as file:
+        file.write(records)
+    return len(records), crc_errors, int(np.count_nonzero(~in_range))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        written, crc_errors, out_of_range = convert_capture(sys.argv[1], sys.argv[2])
+        print(f"{written} TSS1 sentences written, {crc_errors} CRC errors, {out_of_range} out of range")
+    else:
+        mapped, data = open_capture(sys.argv[1])
+        index, crc_errors = index_frames(mapped)
+        print(f"{len(index)} frames, {crc_errors} CRC errors")
+        del data
+        mapped.close()
@@ -0,0 +1,190 @@
+import collections
+import json
+import os
+import threading
+import time
+
+# Counters and stage timings of the conversion loop.
+# Timings are perf_counter_ns differences kept in fixed power-of-two histograms,
+# so recording one costs a few integer operations and no allocation
+
+stages = ("read", "frame", "decode", "encode", "write")
+
+
+class Histogram:
+    """
+    Counts of nanosecond durations in fixed buckets: bucket k holds [2**(k-1), 2**k)
+    """
+
+    bucket_count = 40  # up to ~550 s
+
+    def __init__(self):
+        self.buckets = [0] * self.bucket_count
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.buckets[min(ns.bit_length(), self.bucket_count - 1)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, percentile):
+        # Upper bound in ns of the bucket holding the percentile, 0 when empty
+        if not self.count:
+            return 0
+        rank = percentile / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(1 << bucket, self.max_ns)
+        return self.max_ns
+
+    @property
+    def mean_ns(self):
+        return self.total_ns / self.count if self.count else 0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_us": self.mean_ns / 1e3,
+            "p50_us": self.percentile(50) / 1e3,
+            "p99_us": self.percentile(99) / 1e3,
+            "max_us": self.max_ns / 1e3,
+            "buckets": {f"<{1 << bucket}ns": count for bucket, count in enumerate(self.buckets) if count},
+        }
+
+    def reset(self):
+        self.__init__()
+
+
+def out_waiting(port):
+    # Bytes in the port's output buffer, None when the port does not report it.
+    # serial.SerialException is an OSError, so pyserial is not imported for this
+    try:
+        return port.out_waiting
+    except (AttributeError, OSError):
+        return None
+
+
+class ConverterMetrics:
+    """
+    Counters and per-stage timers of one SPAN6 -> TSS1 conversion loop.
+    CRC failures and resync bytes are read from the framer the metrics are attached to
+    """
+
+    def __init__(self, framer=None):
+        self.framer = framer
+        self.timers = {stage: Histogram() for stage in stages}
+        self.messages = collections.Counter()  # frames per message ID
+        self.ascii_records = 0
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.tx_sentences = 0
+        self.tx_overruns = 0  # writes the TX port did not take completely or that found it falling behind
+        self.tx_decimated = 0  # sentences dropped because the TX line could not carry them
+        self.range_errors = 0
+        self.started = time.monotonic()
+        self.first_tx = None  # monotonic time of the first sentence written
+        self.first_tx_written = threading.Event()  # set with first_tx, for waiting on it
+        self._tx_queued = 0  # bytes in the TX output buffer before the previous write
+
+    @property
+    def crc_failures(self):
+        return self.framer.crc_errors if self.framer is not None else 0
+
+    @property
+    def resync_bytes(self):
+        return self.framer.skipped_bytes if self.framer is not None else 0
+
+    def write(self, port, data):
+        # port.write(data), timed and counted. Overruns are short writes, write timeouts and, on a
+        # port with a blocking write, writes that find more than one write's worth of bytes still
+        # queued and more than the previous write found: the line carries less than is written
+        queued = out_waiting(port)
+        start = time.perf_counter_ns()
+        try:
+            written = port.write(data)
+        except OSError as error:
+            # only a serial port raises a write timeout, so pyserial is loaded once one did
+            import serial
+            if not isinstance(error, serial.SerialTimeoutException):
+                raise
+            written = 0
+        self.timers["write"].record(time.perf_counter_ns() - start)
+        if written is not None and written < len(data):
+            self.tx_overruns += 1
+        elif queued is not None and queued > len(data) and queued > self._tx_queued:
+            self.tx_overruns += 1
+        if queued is not None:
+            self._tx_queued = queued
+        self.tx_bytes += len(data) if written is None else written
+        self.tx_sentences += 1
+        if self.first_tx is None:
+            self.first_tx = time.monotonic()
+            self.first_tx_written.set()
+        return written
+
+    def as_dict(self):
+        return {
+            "uptime_s": time.monotonic() - self.started,
+            "first_tx_s": None if self.first_tx is None else self.first_tx - self.started,
+            "rx_bytes": self.rx_bytes,
+            "tx_bytes": self.tx_bytes,
+            "tx_sentences": self.tx_sentences,
+            "tx_overruns": self.tx_overruns,
+            "tx_decimated": self.tx_decimated,
+            "crc_failures": self.crc_failures,
+            "resync_bytes": self.resync_bytes,
+            "range_errors": self.range_errors,
+            "ascii_records": self.ascii_records,
+            "messages": {str(message_id): count for message_id, count in sorted(self.messages.items())},
+            "timers": {stage: timer.snapshot() for stage, timer in self.timers.items()},
+        }
+
+    def summary_line(self):
+        messages = " ".join(f"{message_id}:{count}" for message_id, count in sorted(self.messages.items()))
+        timers = " ".join(f"{stage}={timer.percentile(50) / 1e3:.0f}/{timer.percentile(99) / 1e3:.0f}us"
+                          for stage, timer in self.timers.items() if timer.count)
+        return (f"rx {self.rx_bytes} B, tx {self.tx_sentences} TSS1 ({self.tx_overruns} overruns, "
+                f"{self.tx_decimated} decimated), "
+                f"CRC fail {self.crc_failures}, resync {self.resync_bytes} B, msgs [{messages}], "
+                f"p50/p99 {timers}")
+
+    def write_stats_file(self, path):
+        # JSON snapshot, replaced atomically so readers never see half a file
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.as_dict(), file, indent=2)
+        os.replace(temporary, path)
+
+
+class MetricsReporter:
+    """
+    Prints a summary line and/or rewrites a stats file every interval seconds.
+    Call poll() from the conversion loop, it only reads the clock in between
+    """
+
+    def __init__(self, metrics, interval=5.0, stats_path=None, output=print):
+        self.metrics = metrics
+        self.interval = interval
+        self.stats_path = stats_path
+        self.output = output
+        self._next = time.monotonic() + interval
+
+    def poll(self):
+        now = time.monotonic()
+        if now < self._next:
+            return False
+        self._next = now + self.interval
+        self.report()
+        return True
+
+    def report(self):
+        if self.output is not None:
+            self.output(self.metrics.summary_line())
+        if self.stats_path:
+            self.metrics.write_stats_file(self.stats_path)
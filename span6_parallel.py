@@ -0,0 +1,153 @@
+import argparse
+import multiprocessing
+import os
+
+import numpy as np
+
+import attitude_store
+import span6_batch
+import span6_to_tss1 as rs6
+import tss1_batch
+
+# Multi-process version of span6_batch.convert_capture for big captures and directories of captures.
+# Files are cut at CRC-checked frame boundaries, every worker frames, decodes and encodes its own
+# piece and the pieces are stitched back in order, byte-identical to a sequential run.
+# Run: python span6_parallel.py capture.bin output.tss1 [--workers 8]
+#      python span6_parallel.py capture_dir output_dir
+
+default_chunk_size = 64 << 20
+
+
+def next_frame_boundary(buffer, offset, end=None):
+    # Offset of the first binary frame at or after offset whose CRC checks out, end if there is none
+    if end is None:
+        end = len(buffer)
+    while True:
+        offset = buffer.find(rs6.binary_sync, offset, end)
+        if offset == -1 or offset + 2 >= end:
+            return end
+        header = rs6.binary_sync_types.get(buffer[offset + 2])
+        if header is not None:
+            size = rs6.get_frame_size(buffer, header, offset, end)
+            if size and offset + size <= end and rs6.check_span6_crc(buffer, offset, size):
+                return offset
+        offset += 1
+
+
+def split_capture(path, chunk_size=default_chunk_size):
+    # [(path, start, end)] pieces of a capture file that can be converted independently
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    mapped, data = span6_batch.open_capture(path)
+    try:
+        bounds = [0]
+        for nominal in range(chunk_size, size, chunk_size):
+            boundary = next_frame_boundary(mapped, max(nominal, bounds[-1]))
+            if boundary > bounds[-1] and boundary < size:
+                bounds.append(boundary)
+    finally:
+        del data
+        mapped.close()
+    bounds.append(size)
+    return [(path, start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def convert_piece(task):
+    # Worker: TSS1 of one piece. The rows before every TSS1 input has been seen in the piece
+    # depend on earlier pieces, so they come back as raw inputs for the parent to finish.
+    path, start, end = task
+    mapped, data = span6_batch.open_capture(path)
+    try:
+        # the piece is read through the mapping, only the pages it covers are loaded
+        index, crc_errors = span6_batch.index_frames(mapped, start, end)
+        inputs = span6_batch.tss1_inputs(data[start:end], index, initial=np.nan)
+    finally:
+        del data
+        mapped.close()
+
+    count = len(next(iter(inputs.values())))
+    head = 0
+    last = {}
+    for name, values in inputs.items():
+        known = np.flatnonzero(~np.isnan(values))
+        head = max(head, int(known[0]) if len(known) else count)
+        last[name] = float(values[-1]) if count else np.nan
+    records, in_range = tss1_batch.encode_tss1_batch(**{name: values[head:] for name, values in inputs.items()})
+    return {
+        "head": {name: values[:head] for name, values in inputs.items()},
+        "records": records[in_range].tobytes(),
+        "out_of_range": int(np.count_nonzero(~in_range)),
+        "crc_errors": crc_errors,
+        "last": last,
+    }
+
+
+def _finish_head(head, carry):
+    # Encodes the leading rows of a piece with the values carried over from the pieces before
+    filled = {name: np.where(np.isnan(values), carry[name], values) for name, values in head.items()}
+    records, in_range = tss1_batch.encode_tss1_batch(**filled)
+    return records[in_range].tobytes(), int(np.count_nonzero(~in_range))
+
+
+def convert_files(jobs, workers=None, chunk_size=default_chunk_size):
+    # Converts [(input_path, output_path)] with a process pool.
+    # Returns {input_path: (written, crc_errors, out_of_range)} like span6_batch.convert_capture
+    tasks = []
+    for input_path, output_path in jobs:
+        pieces = split_capture(input_path, chunk_size)
+        tasks.extend(pieces)
+    results = {}
+    outputs = {}
+    carry = {}
+    with multiprocessing.Pool(workers) as pool:
+        # imap keeps the task order, so the pieces of a file arrive one after the other
+        for (path, start, _), piece in zip(tasks, pool.imap(convert_piece, tasks)):
+            if start == 0:
+                output_path = dict(jobs)[path]
+                outputs[path] = open(output_path, "wb")
+                results[path] = [0, 0, 0]
+                carry = {name: 0.0 for name in attitude_store.tss1_quantities}
+            head, head_out_of_range = _finish_head(piece["head"], carry)
+            file = outputs[path]
+            file.write(head)
+            file.write(piece["records"])
+            result = results[path]
+            result[0] += (len(head) + len(piece["records"])) // rs6.tss1_size
+            result[1] += piece["crc_errors"]
+            result[2] += head_out_of_range + piece["out_of_range"]
+            for name, value in piece["last"].items():
+                if not np.isnan(value):
+                    carry[name] = value
+    for path, file in outputs.items():
+        file.close()
+    for input_path, output_path in jobs:
+        if input_path not in results:
+            # an empty capture still gets its (empty) output file
+            open(output_path, "wb").close()
+            results[input_path] = [0, 0, 0]
+    return {path: tuple(result) for path, result in results.items()}
+
+
+def collect_jobs(input_path, output_path, extension=".tss1"):
+    # One job for a file, one per file (sorted) for a directory
+    if not os.path.isdir(input_path):
+        return [(input_path, output_path)]
+    os.makedirs(output_path, exist_ok=True)
+    names = sorted(name for name in os.listdir(input_path) if os.path.isfile(os.path.join(input_path, name)))
+    return [(os.path.join(input_path, name), os.path.join(output_path, os.path.splitext(name)[0] + extension))
+            for name in names]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="parallel SPAN6 capture -> TSS1 conversion")
+    parser.add_argument("input", help="capture file or directory of captures")
+    parser.add_argument("output", help="TSS1 file or directory")
+    parser.add_argument("--workers", type=int, help="processes, all cores by default")
+    parser.add_argument("--chunk-mb", type=float, default=default_chunk_size / (1 << 20))
+    args = parser.parse_args()
+
+    jobs = collect_jobs(args.input, args.output)
+    results = convert_files(jobs, args.workers, int(args.chunk_mb * (1 << 20)))
+    for input_path, (written, crc_errors, out_of_range) in results.items():
+        print(f"{input_path}: {written} TSS1 sentences written, {crc_errors} CRC errors, {out_of_range} out of range")
@@ -0,0 +1,488 @@
+import argparse
+import collections
+import queue
+import threading
+import time
+
+import output_encoders
+import span6_metrics
+import span6_stream
+import span6_to_tss1 as rs6
+
+# Threaded converter: RX reader -> decoder -> TX writer
+# Run: python span6_pipeline.py [--output-rate 10]
+
+
+class LatestCell:
+    """
+    Single-slot handoff between one producer and one consumer.
+    The consumer always gets the newest value, values it did not take in time are overwritten
+    """
+
+    def __init__(self):
+        self._item = (0, None)  # (sequence, value), replaced as a whole
+        self._event = threading.Event()
+        self._taken = 0
+        self.overwritten = 0
+
+    def put(self, value):
+        # Returns the value this one overwrote before the consumer took it, otherwise None
+        previous_sequence, previous = self._item
+        overwritten = None
+        if previous_sequence > self._taken:
+            self.overwritten += 1
+            overwritten = previous
+        self._item = (previous_sequence + 1, value)
+        self._event.set()
+        return overwritten
+
+    def get(self, timeout=None):
+        # Newest value not returned before, None on timeout
+        while self._event.wait(timeout):
+            self._event.clear()
+            sequence, value = self._item
+            if sequence != self._taken:
+                self._taken = sequence
+                return value
+        return None
+
+
+def latency_percentiles(samples_ns, percentiles=(50, 90, 99, 100)):
+    # {"p50": ms, ...} of latency samples in nanoseconds
+    samples = sorted(samples_ns)
+    if not samples:
+        return {}
+    result = {}
+    for percentile in percentiles:
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        result[f"p{percentile}"] = samples[index] / 1e6
+    return result
+
+
+def max_tss1_rate(baud, bits_per_byte=10, size=rs6.tss1_size):
+    # Sentences (of size bytes) per second a serial line can carry, 8N1 by default
+    return baud / (bits_per_byte * size)
+
+
+class Tss1Writer:
+    """
+    Writes TSS1 sentences no faster than the TX line can carry them.
+    A sentence offered while the line is busy waits as the newest one and replaces the
+    one waiting before it (counted as decimated), so the output never falls behind the input.
+    The line is busy until 1/rate after the last sentence or while more than max_queue
+    bytes sit in the port's output buffer (out_waiting, when the port reports it)
+    """
+
+    def __init__(self, port, baud=None, headroom=0.95, max_queue=rs6.tss1_size, metrics=None, size=rs6.tss1_size):
+        self.port = port
+        self.baud = baud
+        self.max_rate = max_tss1_rate(baud, size=size) * headroom if baud else None
+        self.interval = 1 / self.max_rate if self.max_rate else 0.0
+        self.max_queue = max_queue
+        self.metrics = metrics
+        self.offered = 0
+        self.sent = 0
+        self.decimated = 0  # sentences replaced by a newer one before they could be sent
+        self.backpressure = 0  # times a sentence waited for the output buffer to drain
+        self._pending = None
+        self._next_time = 0.0
+
+    @property
+    def decimation(self):
+        # fraction of the offered sentences that were not sent
+        return self.decimated / self.offered if self.offered else 0.0
+
+    def queued_bytes(self):
+        return span6_metrics.out_waiting(self.port) or 0
+
+    def delay(self, now=None):
+        # Seconds until the line can take the next sentence
+        now = time.monotonic() if now is None else now
+        wait = self._next_time - now
+        if self.baud and self.max_queue is not None:
+            excess = self.queued_bytes() - self.max_queue
+            if excess > 0:
+                self.backpressure += 1
+                wait = max(wait, excess * 10 / self.baud)
+        return max(wait, 0.0)
+
+    def write(self, sentence, now=None):
+        # Offers a sentence, returns True when it went out right away
+        self.offered += 1
+        if self._pending is not None:
+            self.skip()
+        self._pending = sentence
+        return self.poll(now)
+
+    def poll(self, now=None):
+        # Sends the waiting sentence if the line is free, call it regularly
+        if self._pending is None:
+            return False
+        now = time.monotonic() if now is None else now
+        if self.delay(now) > 0:
+            return False
+        sentence, self._pending = self._pending, None
+        self.send(sentence, now)
+        return True
+
+    def take_newest(self, item, newer):
+        # For a TX thread that blocks instead of polling: waits until the line is free and returns
+        # (item to send, item given up or None). newer() returns what arrived during the wait or None;
+        # the newest of the two is offered for sending, the other one counts as decimated.
+        # The caller passes the returned item's sentence to send()
+        dropped = None
+        wait = self.delay()
+        if wait > 0:
+            time.sleep(wait)
+            newest = newer()
+            if newest is not None:
+                self.offered += 1
+                self.skip()
+                dropped, item = item, newest
+        self.offered += 1
+        return item, dropped
+
+    def send(self, sentence, now=None):
+        # Writes at once, the caller has checked delay()
+        now = time.monotonic() if now is None else now
+        if self.metrics is None:
+            self.port.write(sentence)
+        else:
+            self.metrics.write(self.port, sentence)
+        self.sent += 1
+        # an idle line does not save up sentences for a burst later
+        self._next_time = max(self._next_time, now) + self.interval
+
+    def skip(self):
+        # counts a sentence dropped in favour of a newer one
+        self.decimated += 1
+        if self.metrics is not None:
+            self.metrics.tx_decimated += 1
+
+    def summary(self):
+        rate = f"{self.max_rate:.1f} Hz" if self.max_rate else "unlimited"
+        return (f"TX {self.sent}/{self.offered} sentences (max {rate}), decimated {self.decimated} "
+                f"({self.decimation:.1%}), buffer waits {self.backpressure}")
+
+
+class Tss1Scheduler:
+    """
+    Sends a TSS1 sentence every 1/rate seconds on absolute monotonic deadlines.
+    state_source(now_ns) returns (state_time_ns, fields) of the state to send or None.
+    Deadlines that passed while the thread was held up are counted and skipped, not sent in a burst.
+    encoder (an output_encoders.OutputEncoder) replaces TSS1 with another output format
+    """
+
+    def __init__(self, port, rate, state_source, baud=None, samples=4096, metrics=None, encoder=None):
+        self.encoder = encoder or output_encoders.Tss1Encoder()
+        size = self.encoder.size
+        if rate <= 0:
+            raise RuntimeError("TSS1 output rate must be positive")
+        if baud is not None and rate > max_tss1_rate(baud, size=size):
+            raise RuntimeError(f"{rate} Hz {self.encoder.name} does not fit into {baud} baud "
+                               f"(max {max_tss1_rate(baud, size=size):.1f} Hz)")
+        self.port = port
+        self.rate = rate
+        self.period_ns = int(round(1e9 / rate))
+        self.state_source = state_source
+        self.metrics = metrics
+        self.sent = 0
+        self.missed_deadlines = 0
+        self.no_state = 0  # deadlines with nothing to send yet
+        self.range_errors = 0
+        self.lateness_ns = collections.deque(maxlen=samples)  # send time - deadline
+        self.ages_ns = collections.deque(maxlen=samples)  # send time - state time
+
+    def run(self, stop_event):
+        period = self.period_ns
+        deadline = time.monotonic_ns() + period
+        while not stop_event.is_set():
+            now = time.monotonic_ns()
+            if now < deadline:
+                time.sleep((deadline - now) / 1e9)
+                now = time.monotonic_ns()
+            late = now - deadline
+            if late >= period:
+                missed = late // period
+                self.missed_deadlines += missed
+                deadline += missed * period
+                late -= missed * period
+            self.lateness_ns.append(late)
+            self.send(now)
+            deadline += period
+
+    def send(self, now_ns):
+        state = self.state_source(now_ns)
+        if state is None:
+            self.no_state += 1
+            return
+        state_ns, fields = state
+        try:
+            # written on this thread, so the encoder's own buffer can go out as it is
+            sentence = self.encoder.encode_view(fields)
+        except RuntimeError:
+            self.range_errors += 1
+            return
+        if self.metrics is None:
+            self.port.write(sentence)
+        else:
+            self.metrics.write(self.port, sentence)
+        self.sent += 1
+        self.ages_ns.append(time.monotonic_ns() - state_ns)
+
+
+class ConverterPipeline:
+    """
+    Converts SPAN6 from rx_port into TSS1 on tx_port with three threads.
+    The reader blocks on the port and queues chunks, the decoder frames and converts them,
+    the writer owns the TX port and always sends the newest sentence.
+    With output_rate the writer sends the newest state on a fixed clock instead of per frame.
+    With time_aligned the values are interpolated to their newest common GPS time.
+    With raw_stream (a raw_imu.RawImuStream) the accelerations come from filtered RAWIMUSXB.
+    With message_ids only those messages are decoded, frames of other messages produce no sentence.
+    With encoder (an output_encoders.OutputEncoder) the output is that format instead of TSS1.
+    With trace (a latency_trace.LatencyTracer) every sentence is logged with the arrival, GPS,
+    decode, encode and TX times of its frame.
+    With feed (an attitude_feed.AttitudeFeedWriter) every decoded state is also published to shared memory
+    """
+
+    def __init__(self, rx_port, tx_port, rx_queue_size=256, latency_samples=4096,
+                 output_rate=None, tx_baud=None, time_aligned=False, raw_stream=None, message_ids=None,
+                 encoder=None, trace=None, feed=None):
+        if trace is not None and output_rate:
+            raise RuntimeError("Latency tracing needs one sentence per frame, not a fixed output rate")
+        self.rx_port = rx_port
+        self.tx_port = tx_port
+        self.framer = rs6.Span6Framer()
+        self.metrics = span6_metrics.ConverterMetrics(self.framer)
+        self.encoder = encoder or output_encoders.Tss1Encoder()
+        self.attitude = span6_stream.AttitudeState(time_aligned, "heading" in self.encoder.fields, raw_stream)
+        self.fields = self.attitude.fields
+        self.latencies_ns = collections.deque(maxlen=latency_samples)  # rx -> tx per sentence
+        self.sentences_sent = 0
+        self.range_errors = 0
+        self.error = None  # exception that stopped a thread
+        self.state = None  # (arrival_ns, fields) after the latest frame
+        self.trace = trace
+        self.feed = feed
+        self.message_ids = None if message_ids is None else frozenset(message_ids)
+        self.writer = Tss1Writer(tx_port, tx_baud, max_queue=self.encoder.size, metrics=self.metrics,
+                                 size=self.encoder.size)
+        self.scheduler = None
+        if output_rate:
+            self.scheduler = Tss1Scheduler(tx_port, output_rate, self.latest_state, baud=tx_baud,
+                                           samples=latency_samples, metrics=self.metrics, encoder=self.encoder)
+
+        self._chunks = queue.Queue(rx_queue_size)
+        self._latest = LatestCell()
+        self._stop = threading.Event()
+        self._decoder_done = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, args=(self._rx_loop,), name="span6-rx", daemon=True),
+            threading.Thread(target=self._run, args=(self._decode_loop,), name="span6-decode", daemon=True),
+            threading.Thread(target=self._run, name="tss1-tx", daemon=True,
+                             args=(self._tx_loop if self.scheduler is None else self._scheduled_tx_loop,)),
+        ]
+
+    @property
+    def sentences_skipped(self):
+        # sentences replaced by a newer one before the writer could send them
+        return self._latest.overwritten + self.writer.decimated
+
+    def latest_state(self, now_ns=None):
+        return self.state
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        for thread in self._threads:
+            if thread.ident is not None:  # a pipeline that was never started has nothing to join
+                thread.join(timeout)
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self, loop):
+        try:
+            loop()
+        except Exception as error:
+            self.error = error
+            self._stop.set()
+            self._decoder_done.set()
+
+    def _queue_chunk(self, item, timeout=0.1):
+        # Queues an item for the decoder, waiting while the queue is full.
+        # False once the decoder has finished: it takes nothing more and the item is dropped
+        chunks = self._chunks
+        decoder_done = self._decoder_done
+        while not decoder_done.is_set():
+            try:
+                chunks.put(item, timeout=timeout)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _rx_loop(self):
+        port = self.rx_port
+        metrics = self.metrics
+        read_timer = metrics.timers["read"]
+        clock = time.perf_counter_ns
+        try:
+            while not self._stop.is_set():
+                # blocks for up to the port timeout when there is nothing to read
+                start = clock()
+                chunk = port.read(port.in_waiting or 1)
+                if chunk:
+                    read_timer.record(clock() - start)
+                    metrics.rx_bytes += len(chunk)
+                    if not self._queue_chunk((time.monotonic_ns(), chunk)):
+                        break
+        finally:
+            self._queue_chunk(None)
+
+    def _decode_loop(self):
+        framer = self.framer
+        attitude = self.attitude
+        update = attitude.update
+        fields = attitude.fields
+        latest = self._latest
+        enabled = self.message_ids
+        encoder = self.encoder
+        trace = self.trace
+        tag = None
+        feed = self.feed
+        if trace is not None:
+            import latency_trace
+            frame_tag = latency_trace.frame_tag
+        metrics = self.metrics
+        timers = metrics.timers
+        clock = time.perf_counter_ns
+        try:
+            while True:
+                item = self._chunks.get()
+                if item is None:
+                    break
+                arrival_ns, chunk = item
+                framer.feed(chunk)
+                start = clock()
+                for header, header_rec, header_len, frame in framer:
+                    now = clock()
+                    timers["frame"].record(now - start)
+                    start = now
+                    if header == "INS_UPDATE":
+                        metrics.ascii_records += 1
+                        continue
+                    message_id = header_rec.message_id
+                    metrics.messages[message_id] += 1
+                    if enabled is not None and message_id not in enabled:
+                        continue
+                    if trace is not None:
+                        tag = frame_tag(arrival_ns, header, header_rec)
+                    if update(header_rec, frame, header_len):
+                        self.state = (arrival_ns, dict(fields))
+                        if feed is not None:
+                            feed.publish(fields, attitude.gps_time(header_rec), attitude.ins_status,
+                                         message_id, arrival_ns)
+                        now = clock()
+                        timers["decode"].record(now - start)
+                        start = now
+                    if self.scheduler is not None:
+                        continue
+                    if tag is not None:
+                        tag[3] = time.monotonic_ns()
+                    try:
+                        sentence = encoder.encode(fields)
+                    except RuntimeError:
+                        self.range_errors += 1
+                        metrics.range_errors += 1
+                        continue
+                    finally:
+                        now = clock()
+                        timers["encode"].record(now - start)
+                        start = now
+                    if tag is not None:
+                        tag[4] = time.monotonic_ns()
+                    overwritten = latest.put((arrival_ns, sentence, tag))
+                    if overwritten is not None and trace is not None:
+                        # never reached the TX thread, a drop all the same
+                        trace.skipped(overwritten[2], time.monotonic_ns())
+        finally:
+            self._decoder_done.set()
+
+    def _tx_loop(self):
+        writer = self.writer
+        latest = self._latest
+        latencies = self.latencies_ns
+        trace = self.trace
+
+        def newer():
+            return latest.get(timeout=0)
+
+        while True:
+            item = latest.get(timeout=0.1)
+            if item is None:
+                if self._decoder_done.is_set():
+                    break
+                continue
+            # wait for the TX line, then send whatever is newest by then
+            item, dropped = writer.take_newest(item, newer)
+            if dropped is not None and trace is not None:
+                trace.skipped(dropped[2], time.monotonic_ns())
+            arrival_ns, sentence, tag = item
+            writer.send(sentence)
+            now = time.monotonic_ns()
+            latencies.append(now - arrival_ns)
+            self.sentences_sent += 1
+            if trace is not None:
+                trace.sent(tag, now)
+
+    def _scheduled_tx_loop(self):
+        self.scheduler.run(self._decoder_done)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="threaded SPAN6 -> TSS1 converter")
+    parser.add_argument("--output-rate", type=float, default=0.0,
+                        help="TSS1 sentences per second, 0 sends one per SPAN frame")
+    args = parser.parse_args()
+
+    port_list = rs6.get_com_list()
+
+    print('Please, pick RX COM (that receives attitude data)')
+    com_rx = rs6.serial_open(rs6.pick_comport(port_list), rs6.pick_baud_rate())
+    print("Please, pick TX COM (that will transmit TSS1)")
+    com_tx = rs6.serial_open(rs6.pick_comport(port_list), rs6.pick_baud_rate())
+
+    pipeline = ConverterPipeline(com_rx, com_tx, output_rate=args.output_rate, tx_baud=com_tx.baudrate).start()
+    try:
+        while pipeline.is_running():
+            time.sleep(5)
+            if pipeline.scheduler is None:
+                print(f"sent {pipeline.sentences_sent}, skipped {pipeline.sentences_skipped}, "
+                      f"rx->tx latency ms {latency_percentiles(pipeline.latencies_ns)}")
+                print(pipeline.writer.summary())
+            else:
+                scheduler = pipeline.scheduler
+                print(f"sent {scheduler.sent}, missed deadlines {scheduler.missed_deadlines}, "
+                      f"lateness ms {latency_percentiles(scheduler.lateness_ns)}, "
+                      f"state age ms {latency_percentiles(scheduler.ages_ns)}")
+            print(pipeline.metrics.summary_line())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+        rs6.serial_close(com_rx)
+        rs6.serial_close(com_tx)
+    if pipeline.error is not None:
+        print(pipeline.error)
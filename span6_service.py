@@ -0,0 +1,161 @@
+import time
+
+started = time.monotonic()  # taken before the other imports, for the time to the first TSS1
+
+import argparse
+import json
+import signal
+import sys
+
+import output_encoders
+import span6_metrics
+import span6_pipeline
+
+# Headless SPAN6 -> TSS1 converter for unattended starts, e.g. from a service after a power cycle.
+# Ports and options come from flags and/or a JSON config file: nothing is asked and no ports are
+# enumerated, the converter streams as soon as both ports open. Flags override the config file.
+# Run: python span6_service.py --rx /dev/ttyS0 --rx-baud 115200 --tx /dev/ttyS1 --tx-baud 9600
+#      python span6_service.py --config converter.json
+# converter.json: {"rx": "/dev/ttyS0", "rx_baud": 115200, "tx": "/dev/ttyS1", "tx_baud": 9600,
+#                  "messages": [1465, 813, 1708], "output_rate": 0, "stats_file": "/var/run/tss1.json"}
+# "output_format": "em3000" sends the binary EM1000/EM3000 attitude datagram instead of TSS1,
+# "feed": "tss1_attitude" publishes every state to shared memory for attitude_feed.AttitudeFeedReader
+
+default_config = {
+    "rx": None,
+    "rx_baud": 115200,
+    "tx": None,
+    "tx_baud": 9600,
+    "messages": None,  # message IDs to decode, every TSS1 input message by default
+    "output_rate": 0.0,  # TSS1 Hz on a fixed clock, 0 for one sentence per frame
+    "output_format": "tss1",  # a name in output_encoders.output_encoders
+    "stats_interval": 60.0,  # seconds between summary lines, 0 for none
+    "stats_file": None,
+    "open_retry": 0.05,  # seconds between attempts to open a port that is not there yet
+    "feed": None,  # shared-memory attitude feed name, none by default
+    "feed_capacity": 1024,  # states kept in the feed
+}
+
+
+def load_config(path=None, overrides=None):
+    # default_config updated with the config file and then with the non-None overrides
+    config = dict(default_config)
+    if path:
+        with open(path) as file:
+            loaded = json.load(file)
+        unknown = sorted(set(loaded) - set(default_config))
+        if unknown:
+            raise RuntimeError(f"Unknown config keys {unknown} in {path}")
+        config.update(loaded)
+    config.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    if not config["rx"] or not config["tx"]:
+        raise RuntimeError("RX and TX ports are required, from --rx/--tx or the config file")
+    output_encoders.get_encoder(config["output_format"])  # unknown names fail here, not in the service
+    if config["messages"] is not None:
+        config["messages"] = [int(message_id) for message_id in config["messages"]]
+    return config
+
+
+def open_port(name, baud, retry=0.05, stop=None):
+    # Opens a serial port, waiting for it to appear (USB adapters enumerate late after a power cycle).
+    # None when stop() turns true first
+    import serial
+    while True:
+        try:
+            return serial.Serial(name, baud, timeout=0.01)
+        except serial.SerialException:
+            if stop is not None and stop():
+                return None
+            time.sleep(retry)
+
+
+class ConverterService:
+    """
+    Runs a ConverterPipeline with the ports and options of a config until stopped,
+    reporting the time from process start to the first TSS1 sentence
+    """
+
+    def __init__(self, config, started=started, output=print):
+        self.config = config
+        self.started = started
+        self.output = output
+        self.first_tss1 = None  # seconds from start to the first sentence written
+        self.pipeline = None
+        self._stopping = False
+
+    def stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        config = self.config
+        rx_port = tx_port = feed = pipeline = reporter = None
+        try:
+            rx_port = open_port(config["rx"], config["rx_baud"], config["open_retry"], lambda: self._stopping)
+            if rx_port is None:
+                return
+            tx_port = open_port(config["tx"], config["tx_baud"], config["open_retry"], lambda: self._stopping)
+            if tx_port is None:
+                return
+            if config["feed"]:
+                import attitude_feed
+                feed = attitude_feed.AttitudeFeedWriter(config["feed"], config["feed_capacity"])
+            pipeline = self.pipeline = span6_pipeline.ConverterPipeline(
+                rx_port, tx_port, output_rate=config["output_rate"] or None, tx_baud=config["tx_baud"],
+                message_ids=config["messages"], encoder=output_encoders.get_encoder(config["output_format"]),
+                feed=feed)
+            metrics = pipeline.metrics
+            if config["stats_interval"]:
+                reporter = span6_metrics.MetricsReporter(metrics, config["stats_interval"], config["stats_file"],
+                                                         self.output)
+            pipeline.start()
+            while pipeline.is_running() and not self._stopping:
+                if self.first_tss1 is None:
+                    # woken by the first write itself, not by polling for it
+                    if metrics.first_tx_written.wait(0.2):
+                        self.first_tss1 = metrics.first_tx - self.started
+                        self.output(f"first TSS1 {self.first_tss1 * 1e3:.1f} ms after start")
+                    continue
+                time.sleep(0.2)
+                if reporter is not None:
+                    reporter.poll()
+        finally:
+            # also when stopped while opening the ports or when the feed or the pipeline could not be set up
+            if pipeline is not None:
+                pipeline.stop()
+            for port in (rx_port, tx_port):
+                if port is not None:
+                    port.close()
+            if feed is not None:
+                feed.close()
+            if reporter is not None:
+                reporter.report()
+        if pipeline.error is not None:
+            raise RuntimeError(f"Converter stopped: {pipeline.error}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="headless SPAN6 -> TSS1 converter")
+    parser.add_argument("--config", help="JSON file with any of: " + ", ".join(default_config))
+    parser.add_argument("--rx", help="port receiving SPAN6")
+    parser.add_argument("--rx-baud", type=int)
+    parser.add_argument("--tx", help="port transmitting TSS1")
+    parser.add_argument("--tx-baud", type=int)
+    parser.add_argument("--messages", type=lambda text: [int(item) for item in text.split(",")],
+                        help="comma-separated message IDs to decode")
+    parser.add_argument("--output-rate", type=float, help="TSS1 Hz, 0 for one sentence per frame")
+    parser.add_argument("--output-format", choices=sorted(output_encoders.output_encoders))
+    parser.add_argument("--stats-interval", type=float)
+    parser.add_argument("--stats-file")
+    parser.add_argument("--feed", help="shared-memory attitude feed name")
+    args = parser.parse_args()
+
+    overrides = {key: value for key, value in vars(args).items() if key != "config"}
+    service = ConverterService(load_config(args.config, overrides))
+    signal.signal(signal.SIGTERM, service.stop)
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as error:
+        print(error)
+        sys.exit(1)
@@ -0,0 +1,348 @@
+import argparse
+import os
+import socket
+import time
+
+import output_encoders
+import span6_metrics
+import span6_to_tss1 as rs6
+
+# Streaming conversion as a chain of generators:
+#   bytes source -> frames -> decoded records -> attitude states -> encoded sentences -> sink
+# The same stages run over a serial port, a file, a socket or a buffer in memory; only the source
+# and the sink differ. Every stage takes and yields batches (lists): a source chunk gives one
+# batch of frames and each later stage turns a batch into the next one in a single generator
+# step, so the Python call overhead is paid per batch, not per frame. Nothing runs ahead of the
+# sink: a stage only works when the stage after it asks for its next batch.
+# An empty batch is an idle tick (a read that timed out) and is passed on, so a sink on a live
+# port still gets control to poll; rebatch() regroups batches anywhere in the chain.
+# Run: python span6_stream.py capture.bin output.tss1 [--chunk-size 65536] [--batch-size 256]
+
+default_chunk_size = 1 << 16
+
+
+##############################
+###  Sources
+##############################
+
+def port_chunks(port, stop=None):
+    # Chunks read from a serial port: what is waiting, or the first byte to arrive within the
+    # port timeout (b"" when none does). Runs until stop() returns True
+    while stop is None or not stop():
+        yield port.read(port.in_waiting or 1)
+
+
+def file_chunks(file, chunk_size=default_chunk_size):
+    # Chunks of a binary file object or of the file at a path, until its end
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as opened:
+            yield from file_chunks(opened, chunk_size)
+        return
+    read = file.read
+    chunk = read(chunk_size)
+    while chunk:
+        yield chunk
+        chunk = read(chunk_size)
+
+
+def socket_chunks(sock, chunk_size=default_chunk_size):
+    # Chunks received from a connected socket until the peer closes it; b"" on a socket timeout
+    while True:
+        try:
+            chunk = sock.recv(chunk_size)
+        except socket.timeout:
+            yield b""
+            continue
+        if not chunk:
+            return
+        yield chunk
+
+
+def buffer_chunks(buffer, chunk_size=default_chunk_size):
+    # Zero-copy slices of a bytes-like object, e.g. a capture in memory or a mmap
+    view = memoryview(buffer).cast("B")
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+##############################
+###  Attitude state
+##############################
+
+class AttitudeState:
+    """
+    Latest value of every TSS1 input of one SPAN6 stream, updated frame by frame. The stages below,
+    span6_pipeline.ConverterPipeline and span6_async.StreamConverter all update their fields here.
+    heading adds the INS azimuth, fields are the starting values.
+    With time_aligned the values are interpolated to their newest common GPS time.
+    With raw_stream (a raw_imu.RawImuStream) the accelerations come from filtered RAWIMUSXB
+    """
+
+    def __init__(self, time_aligned=False, heading=False, raw_stream=None, fields=None):
+        if raw_stream is not None and time_aligned:
+            raise RuntimeError("RAWIMUSXB accelerations are not available time aligned")
+        if fields is None:
+            fields = dict(hor_accel=0, vert_accel=0, heave=0, roll=0, pitch=0)
+        self.fields = dict(fields)
+        if heading:
+            self.fields.setdefault("heading", 0.0)
+        self.heading = heading
+        self.store = None
+        if time_aligned:
+            # NumPy is only loaded for the options that need it
+            import attitude_store
+            self.store = attitude_store.AttitudeStore()
+        self.raw_stream = raw_stream
+        self.raw_id = raw_stream.message_id if raw_stream is not None else None
+        self.ins_status = -1  # from the latest attitude message
+        self.message = None  # latest decoded message, None after a RAWIMUSXB update
+
+    def update(self, header_record, frame, header_length):
+        # Updates the fields with a LONG/SHORT frame. True when they changed
+        message_id = header_record.message_id
+        if message_id == self.raw_id:
+            accelerations = self.raw_stream.feed(frame, header_length)
+            if accelerations is None:
+                return False
+            self.fields.update(accelerations)
+            self.message = None
+            return True
+        if message_id not in rs6.tss1_message_ids:
+            return False
+        return self.update_message(message_id, rs6.decode_span6_message(frame, header_length, message_id),
+                                   header_record)
+
+    def update_message(self, message_id, message, header_record):
+        # Updates the fields with a decoded message record. True when they changed
+        if message is None:
+            return False
+        fields = self.fields
+        if self.heading:
+            fields.update(output_encoders.heading_fields(message_id, message))
+        if message_id in rs6.attitude_message_ids:
+            status = getattr(message, "ins_status", None)
+            self.ins_status = message.status if status is None else status
+        values = rs6.tss1_fields(message_id, message)
+        if self.raw_stream is not None:
+            fields.update((name, value) for name, value in values.items() if name not in ("hor_accel", "vert_accel"))
+        elif self.store is None:
+            fields.update(values)
+        else:
+            self.store.update(message_id, message, header_record)
+            aligned = self.store.aligned_fields()
+            if aligned is not None:
+                fields.update(aligned[1])
+        self.message = message
+        return True
+
+    def gps_time(self, header_record):
+        # GPS time of the latest update: the message's own time when it has one, else its header's
+        if self.message is None:
+            return rs6.header_gps_time(header_record)
+        return rs6.message_gps_time(header_record.message_id, self.message, header_record)
+
+
+##############################
+###  Stages
+##############################
+
+def read_frames(chunks, framer=None, batch_size=None, metrics=None):
+    # Batches of Span6Frame. Without batch_size a batch holds the frames completed by one chunk;
+    # with it frames are collected over chunks until there are batch_size of them.
+    # An empty chunk flushes the collected frames. Chunks larger than the framer's free space
+    # are fed in pieces, so no size overflows the framer buffer
+    if framer is None:
+        framer = rs6.Span6Framer()
+    batch = []
+    for chunk in chunks:
+        size = len(chunk)
+        if metrics is not None:
+            metrics.rx_bytes += size
+        if size <= framer.capacity - len(framer):
+            framer.feed(chunk)
+            batch.extend(framer)
+        else:
+            view = memoryview(chunk).cast("B")
+            start = 0
+            while start < size:
+                end = start + max(framer.capacity - len(framer), 1)
+                framer.feed(view[start:end])
+                batch.extend(framer)
+                start = end
+        if batch_size is None or len(batch) >= batch_size or not size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def decode_records(frame_batches, message_ids=None, metrics=None):
+    # Batches of (header_record, message_id, message) for the LONG/SHORT frames. message is the
+    # decoded record of a TSS1 input message, None for the others.
+    # With message_ids, like ConverterPipeline, frames of other messages are counted and dropped:
+    # they produce no state and no sentence. INS_UPDATE records are counted and dropped
+    enabled = None if message_ids is None else frozenset(message_ids)
+    decode = rs6.decode_span6_message
+    decoded = rs6.tss1_message_ids
+    for frames in frame_batches:
+        records = []
+        append = records.append
+        for header, header_rec, header_len, frame in frames:
+            if header == "INS_UPDATE":
+                if metrics is not None:
+                    metrics.ascii_records += 1
+                continue
+            message_id = header_rec.message_id
+            if metrics is not None:
+                metrics.messages[message_id] += 1
+            if enabled is not None and message_id not in enabled:
+                continue
+            append((header_rec, message_id,
+                    decode(frame, header_len, message_id) if message_id in decoded else None))
+        yield records
+
+
+def attitude_states(record_batches, time_aligned=False, heading=False, fields=None):
+    # Batches of attitude states, one per record: a dict with the latest value of every TSS1 input
+    # (see AttitudeState), like the serial loop sends
+    state = AttitudeState(time_aligned, heading, fields=fields)
+    update = state.update_message
+    fields = state.fields
+    for records in record_batches:
+        states = []
+        append = states.append
+        for header_rec, message_id, msg in records:
+            update(message_id, msg, header_rec)
+            append(fields.copy())
+        yield states
+
+
+def encode_sentences(state_batches, encoder=None, metrics=None):
+    # Batches of encoded sentences (bytes), by default TSS1.
+    # A state out of the encoder's range has no sentence and is counted as a range error
+    if encoder is None:
+        encoder = output_encoders.get_encoder()
+    encode = encoder.encode
+    for states in state_batches:
+        sentences = []
+        append = sentences.append
+        for state in states:
+            try:
+                append(encode(state))
+            except RuntimeError:
+                if metrics is not None:
+                    metrics.range_errors += 1
+        yield sentences
+
+
+def rebatch(batches, size):
+    # Regroups any batch stream into batches of at least size items. An empty batch flushes
+    pending = []
+    for batch in batches:
+        pending.extend(batch)
+        if len(pending) >= size or not batch:
+            yield pending
+            pending = []
+    if pending:
+        yield pending
+
+
+def unbatch(batches):
+    # The items of a batch stream one by one, idle ticks vanish
+    for batch in batches:
+        yield from batch
+
+
+def convert_stream(chunks, output_format="tss1", framer=None, batch_size=None, time_aligned=False,
+                   message_ids=None, metrics=None):
+    # The chain from a chunk source to sentence batches, ready for a sink
+    encoder = output_encoders.get_encoder(output_format)
+    frames = read_frames(chunks, framer, batch_size, metrics)
+    records = decode_records(frames, message_ids, metrics)
+    states = attitude_states(records, time_aligned, heading="heading" in encoder.fields)
+    return encode_sentences(states, encoder, metrics)
+
+
+##############################
+###  Sinks
+##############################
+
+def write_sink(sentence_batches, output, poll=None, metrics=None):
+    # Writes every non-empty batch with one write() call: a file, a serial port, a socket file.
+    # poll() is called after every batch, idle ticks included. Returns the sentences written
+    sentences = 0
+    for batch in sentence_batches:
+        if batch:
+            data = b"".join(batch)
+            output.write(data)
+            sentences += len(batch)
+            if metrics is not None:
+                metrics.tx_bytes += len(data)
+                metrics.tx_sentences += len(batch)
+        if poll is not None:
+            poll()
+    return sentences
+
+
+def socket_sink(sentence_batches, sock):
+    # Sends every non-empty batch with one sendall(). Returns the sentences sent
+    sentences = 0
+    for batch in sentence_batches:
+        if batch:
+            sock.sendall(b"".join(batch))
+            sentences += len(batch)
+    return sentences
+
+
+def paced_sink(sentence_batches, writer, poll=None):
+    # Offers every sentence to a span6_pipeline.Tss1Writer, which keeps only the newest one while
+    # the TX line is busy, and polls it on every batch. Returns the sentences offered
+    sentences = 0
+    for batch in sentence_batches:
+        for sentence in batch:
+            writer.write(sentence)
+        sentences += len(batch)
+        writer.poll()
+        if poll is not None:
+            poll()
+    return sentences
+
+
+def collect(sentence_batches):
+    # All sentences of a finite stream as one bytes object
+    return b"".join(unbatch(sentence_batches))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SPAN6 -> TSS1 conversion of a capture or a TCP stream")
+    parser.add_argument("input", help="SPAN6 capture, or host:port with --tcp")
+    parser.add_argument("output", help="file the sentences are written to")
+    parser.add_argument("--tcp", action="store_true", help="read from a TCP server instead of a file")
+    parser.add_argument("--chunk-size", type=int, default=default_chunk_size, help="bytes per read")
+    parser.add_argument("--batch-size", type=int, help="frames per batch, default the frames of one read")
+    parser.add_argument("--output-format", default="tss1", choices=sorted(output_encoders.output_encoders))
+    parser.add_argument("--time-aligned", action="store_true", help="interpolate to a common GPS time")
+    args = parser.parse_args()
+
+    framer = rs6.Span6Framer()
+    metrics = span6_metrics.ConverterMetrics(framer)
+    connection = None
+    if args.tcp:
+        host, port = args.input.rsplit(":", 1)
+        connection = socket.create_connection((host, int(port)))
+        chunks = socket_chunks(connection, args.chunk_size)
+    else:
+        chunks = file_chunks(args.input, args.chunk_size)
+
+    start = time.perf_counter()
+    try:
+        with open(args.output, "wb") as output:
+            batches = convert_stream(chunks, args.output_format, framer, args.batch_size, args.time_aligned,
+                                     metrics=metrics)
+            count = write_sink(batches, output, metrics=metrics)
+    finally:
+        if connection is not None:
+            connection.close()
+    elapsed = time.perf_counter() - start
+    print(f"{count} sentences, {framer.crc_errors} CRC errors, {metrics.range_errors} out of range, "
+          f"{metrics.rx_bytes / 1e6 / elapsed:.1f} MB/s")
@@ -0,0 +1,159 @@
+import math
+import random
+import struct
+
+import span6_to_tss1 as rs6
+
+# Synthetic SPAN6 streams built from the DataBlock layouts, for benchmarks and load tests
+
+default_rates = {1465: 50, 1708: 50, 813: 100, 1462: 200}  # Hz per message ID
+default_headers = {1465: "LONG", 1708: "LONG", 813: "SHORT", 1462: "SHORT"}  # "S" logs use the short header
+# "ASCII" and "SHORT_ASCII" write a message as an ASCII log with a '#' or '%' header instead
+ascii_rate = 1  # Hz of INS_UPDATE records
+
+start_week = 2200
+start_seconds = 302400.0  # seconds of week
+
+
+def make_frame(header, message_id, body, week=start_week, ms=0, sequence=0):
+    # LONG/SHORT frame around a message body (without CRC), with a valid CRC
+    if header == "LONG":
+        head = struct.pack('<3sBHBBHHBBHiIHH', rs6.long_start, rs6.header_long.size, message_id,
+                           0, 0, len(body), sequence, 0, 180, week, ms, 0, 0, 0)
+    else:
+        head = struct.pack('<3sBHHI', rs6.short_start, len(body), message_id, week, ms)
+    frame = head + body
+    return frame + struct.pack('<I', rs6.calculate_block_crc32(frame))
+
+
+def make_ascii_log(header, message_id, body, week=start_week, ms=0, sequence=0):
+    # ASCII log of a message body (without CRC) with a valid CRC, header is "ASCII" or "SHORT_ASCII"
+    name = rs6.ascii_message_names.get(message_id)
+    if name is None:
+        raise RuntimeError(f"Message {message_id} has no ASCII layout")
+    block = rs6.messages_by_id[message_id]
+    tokens = []
+    for value, field, (type_name, _) in zip(block.unpack_from(body + bytes(4)), block._names, block._sizes):
+        if field == "CRC":
+            continue
+        if field in rs6.ascii_enums:
+            names = {number: key for key, number in rs6.ascii_enums[field].items()}
+            tokens.append(names.get(value, str(value)))
+        elif type_name == rs6.elemT.c8:
+            tokens.append(f"{int.from_bytes(value, 'little'):0{2 * len(value)}x}")
+        else:
+            tokens.append(repr(value))
+    if header == "SHORT_ASCII":
+        content = f"{name}A,{week},{ms / 1000:.3f};{','.join(tokens)}"
+        sync = "%"
+    else:
+        content = f"{name}A,COM1,{sequence},80.0,FINESTEERING,{week},{ms / 1000:.3f},00000000,0000,0;{','.join(tokens)}"
+        sync = "#"
+    return f"{sync}{content}*{rs6.calculate_block_crc32(content.encode()):08x}\r\n".encode()
+
+
+def pack_message(message_id, **fields):
+    # Message body in the DataBlock layout of message_id, missing fields are zero
+    block = rs6.messages_by_id[message_id]
+    values = []
+    for name, (type_name, count) in zip(block._names, block._sizes):
+        if name == "CRC":
+            continue
+        default = bytes(count) if type_name == rs6.elemT.c8 else 0
+        values.append(fields.get(name, default))
+    return block._struct.pack(*values, 0)[:-4]
+
+
+def motion(time):
+    # Ship-like motion: roll/pitch in degrees, heave in metres, accelerations in m/s^2
+    roll_w, pitch_w, heave_w = 2 * math.pi / 8, 2 * math.pi / 6, 2 * math.pi / 9
+    return {
+        "roll": 4.0 * math.sin(roll_w * time),
+        "pitch": 2.0 * math.sin(pitch_w * time + 1.0),
+        "heave": 0.8 * math.sin(heave_w * time),
+        "roll_rate": math.radians(4.0 * roll_w * math.cos(roll_w * time)),
+        "pitch_rate": math.radians(2.0 * pitch_w * math.cos(pitch_w * time + 1.0)),
+        "lateral_acc": 0.3 * math.sin(roll_w * time),
+        "longitudinal_acc": 0.2 * math.sin(pitch_w * time),
+        "vertical_acc": -0.8 * heave_w ** 2 * math.sin(heave_w * time),
+    }
+
+
+def make_message(message_id, time, week=start_week):
+    # Body of a message describing the motion at time seconds from the stream start
+    state = motion(time)
+    seconds = start_seconds + time
+    if message_id == 1465:
+        return pack_message(1465, ins_status=3, pos_type=56, lat=54.3, long=10.1, heihgt=42.0,
+                            north_vel=2.0, east_vel=0.5, roll=state["roll"], pitch=state["pitch"],
+                            azimuth=87.0, roll_std=0.01, pitch_std=0.01, azimuth_std=0.05)
+    if message_id == 1708:
+        return pack_message(1708, heave=state["heave"], heave_std=0.05)
+    if message_id == 1382:
+        return pack_message(1382, week=week, secs_into_week=seconds, heave=state["heave"])
+    if message_id == 813:
+        rate = rs6.imu_rate
+        return pack_message(813, week=week, seconds=seconds,
+                            pitch_rate=state["pitch_rate"] / rate, roll_rate=state["roll_rate"] / rate,
+                            lateral_acc=state["lateral_acc"] / rate,
+                            longitudinal_acc=state["longitudinal_acc"] / rate,
+                            vertical_acc=state["vertical_acc"] / rate)
+    if message_id == 1462:
+        # ISA100C counts: 2e-8 m/s and 1e-9 rad per sample at 200 Hz, z includes gravity, y is reversed
+        accel_count, gyro_count, rate = 2.0e-8, 1.0e-9, 200
+        return pack_message(1462, imu_info=b'\x00', imu_type=b'\x1a', gnss_week=week, gnss_week_seconds=seconds,
+                            imu_status=0x77,
+                            z_accel=int(round((state["vertical_acc"] + 9.80665) / rate / accel_count)),
+                            y_accel=-int(round(state["longitudinal_acc"] / rate / accel_count)),
+                            x_accel=int(round(state["lateral_acc"] / rate / accel_count)),
+                            z_gyro=0, y_gyro=-int(round(state["pitch_rate"] / rate / gyro_count)),
+                            x_gyro=int(round(state["roll_rate"] / rate / gyro_count)))
+    return pack_message(message_id)
+
+
+def make_insupdate(time, week=start_week):
+    return (f"<INSUPDATE COM1 0 80.0 FINESTEERING {week} {start_seconds + time:.3f} 00000000 0000 0\r\n"
+            f"<     INS_SOLUTION_GOOD 4 0 0 0 0 0\r\n").encode()
+
+
+def generate_stream(duration=10.0, rates=None, headers=None, ascii_records=True,
+                    garbage_probability=0.0, max_garbage=32, seed=0):
+    # Bytes of a SPAN6 port capture lasting duration seconds.
+    # garbage_probability is the chance of random bytes being inserted before a frame
+    rng = random.Random(seed)
+    rates = default_rates if rates is None else rates
+    headers = default_headers if headers is None else headers
+
+    events = []
+    for message_id, rate in rates.items():
+        count = int(duration * rate)
+        events.extend((index / rate, message_id) for index in range(count))
+    if ascii_records:
+        events.extend((index / ascii_rate, None) for index in range(int(duration * ascii_rate)))
+    events.sort(key=lambda event: (event[0], event[1] is None, event[1] or 0))
+
+    parts = []
+    for sequence, (time, message_id) in enumerate(events):
+        if garbage_probability and rng.random() < garbage_probability:
+            parts.append(bytes(rng.randrange(256) for _ in range(rng.randrange(1, max_garbage + 1))))
+        if message_id is None:
+            parts.append(make_insupdate(time))
+            continue
+        seconds = start_seconds + time
+        header = headers.get(message_id, "LONG")
+        make = make_ascii_log if header in ("ASCII", "SHORT_ASCII") else make_frame
+        parts.append(make(header, message_id, make_message(message_id, time),
+                          week=start_week, ms=int(round(seconds * 1000)), sequence=sequence & 0xFFFF))
+    return b''.join(parts)
+
+
+def split_chunks(stream, min_size=1, max_size=256, seed=0):
+    # The stream cut into random pieces, like successive serial port reads
+    rng = random.Random(seed)
+    chunks = []
+    position = 0
+    while position < len(stream):
+        size = rng.randint(min_size, max_size)
+        chunks.append(stream[position:position + size])
+        position += size
+    return chunks
@@ -2,13 +2,18 @@ import struct
 from collections import namedtuple
 
 import math
-import serial
-import serial.tools.list_ports
+import re
+import zlib
 
 # TSS1 string example
 # ':00FFCA -0003F-0325    0319'
 # '<CR><LF> = 0x0D0x0A' # newline character
 
+tss1_size = 27  # bytes, including <CR><LF>
+tss1_hor_accel_lsb = 0.0383  # m/s^2
+tss1_vert_accel_lsb = 0.000625  # m/s^2
+tss1_angle_lsb = 0.01  # m for heave, deg for roll and pitch
+
 def create_tss1(hor_accel: float, vert_accel: float, heave: float, roll: float, pitch: float, status_f='F'):
     
     # "Эти проверки нужно перенести из функции TSS1 в другую часть программы"
@@ -16,17 +21,17 @@ def create_tss1(hor_accel: float, vert_accel: float, heave: float, roll: float,
         raise RuntimeError('Horizontal accel is wrong')
     if vert_accel > 20.47 or vert_accel < -20.48:
         raise RuntimeError('Vertical accel is wrong')
-    if heave > 99.99 or hor_accel < -99.99:
+    if heave > 99.99 or heave < -99.99:
         raise RuntimeError('Heave is wrong')
-    if roll > 99.99 or hor_accel < -99.99:
+    if roll > 99.99 or roll < -99.99:
         raise RuntimeError('Roll is wrong')
-    if pitch > 99.99 or hor_accel < -99.99:
+    if pitch > 99.99 or pitch < -99.99:
         raise RuntimeError('pitch is wrong')
 
     hor_accel_b = ''  # two byte hex, 0 to 9.81 m/s^2
-    hor_acc_lsb = 0.0383  # m/s^2
+    hor_acc_lsb = tss1_hor_accel_lsb  # m/s^2
     vert_accel_b = ''  # two byte hex, -20.48 to 20.47 m/s^2
-    vert_accel_lsb = 0.000625  # m/s^2
+    vert_accel_lsb = tss1_vert_accel_lsb  # m/s^2
     
     heave_b = int()  # four digit integer, -99.99 to 99.99 m
     heave_b_polarity = ' '  # space if positive, minus sign (-) if negative
@@ -39,12 +44,11 @@ def create_tss1(hor_accel: float, vert_accel: float, heave: float, roll: float,
     pitch_b = int()  # four digit integer, -99.99 to 99.99 deg
     pitch_b_polarity = ' '  # space if positive, minus sign (-) if negative
     
-    if hor_accel >= 9.771:
-        hor_accel_b = struct.pack('B', int(hor_accel/hor_acc_lsb)).hex().upper()
-    else:
-        hor_accel_b = struct.pack('B', int(round(hor_accel/hor_acc_lsb))).hex().upper()
+    # 9.81 m/s^2 is slightly above 255 LSB, the top of the range saturates
+    hor_accel_b = struct.pack('B', min(int(round(hor_accel/hor_acc_lsb)), 255)).hex().upper()
     
-    vert_accel_b = struct.pack('h',int(round(vert_accel/vert_accel_lsb))).hex().upper()
+    # Hex digits are written most significant first
+    vert_accel_b = struct.pack('>h',int(round(vert_accel/vert_accel_lsb))).hex().upper()
     
     if heave < 0:
         heave_b_polarity = '-'
@@ -68,7 +72,7 @@ def create_tss1(hor_accel: float, vert_accel: float, heave: float, roll: float,
         pitch_b = round(pitch*100)
     
     
-    tss1_message = f':{hor_accel_b}{vert_accel_b} {heave_b_polarity}{heave_b:04d}{status_flag}{roll_b_polarity}{roll_b:04d} {pitch_b_polarity}{pitch_b:04d}\n'
+    tss1_message = f':{hor_accel_b}{vert_accel_b} {heave_b_polarity}{heave_b:04d}{status_flag}{roll_b_polarity}{roll_b:04d} {pitch_b_polarity}{pitch_b:04d}\r\n'
     
     return tss1_message
 
@@ -116,16 +120,35 @@ map_size_to_fmt = dict(
 
 class DataBlock:
     """
-    Reads fixed-size blocks of structured binary data, according to a specified format
+    Reads fixed-size blocks of structured binary data, according to a specified format.
+    The struct, record type and decoder are built on first use, so unused layouts cost nothing at import
     """
 
     _byte_order_fmt = "<"
+    _built_attributes = ("_struct", "_np_types", "_record_type", "unpack_from")
 
-    def __init__(self, elements):
+    def __init__(self, elements, name="Record"):
+        self._name = name
         self._sizes = self._util_take_sizes(elements)
         self._names = self._util_take_names(elements)
+
+    def __getattr__(self, attribute):
+        # only called for attributes that are not set yet
+        if attribute == "_dtype":
+            # NumPy is only loaded by the array code that asks for it
+            import numpy as np
+            self._dtype = np.dtype(self.numpy_types)
+            return self._dtype
+        if attribute not in self._built_attributes:
+            raise AttributeError(attribute)
+        self._build()
+        return getattr(self, attribute)
+
+    def _build(self):
         self._struct = self._util_create_struct(self._sizes)
         self._np_types = self._util_create_np_types(self._names, self._sizes)
+        self._record_type = self._util_create_record_type(self._name, self._names)
+        self.unpack_from = self._util_create_unpack_from(self._struct, self._record_type)
 
     @property
     def size(self):
@@ -135,6 +158,15 @@ class DataBlock:
     def numpy_types(self):
         return self._np_types
 
+    @property
+    def record_type(self):
+        return self._record_type
+
+    @property
+    def dtype(self):
+        # numpy.dtype of numpy_types, built once
+        return self._dtype
+
     @staticmethod
     def _util_take_names(elements) -> tuple:
         return tuple(name for name, *_ in elements)
@@ -153,20 +185,40 @@ class DataBlock:
     def _util_create_struct(cls, sizes) -> struct.Struct:
         fmts = [cls._byte_order_fmt]
         for type_name, count in sizes:
-            count = "" if count == 1 else str(count)
             fmt, *_ = map_size_to_fmt[type_name]
+            if type_name == elemT.c8 and count > 1:
+                fmt = "s"  # one bytes value instead of count separate characters
+            count = "" if count == 1 else str(count)
             fmts.append(str(count) + fmt)
         return struct.Struct("".join(fmts))
 
+    @staticmethod
+    def _util_field_name(idx, name):
+        # Padding elements have no name; the record type and the NumPy dtype name them alike
+        return f"reserved{idx}" if name is None else name
+
     @classmethod
-    def _util_create_np_types(cls, names, sizes):
-        def f_name_fixer(idx, name):
-            return f"__reserved{idx}__" if name is None else name
+    def _util_create_record_type(cls, name, names):
+        fields = [cls._util_field_name(idx, field) for idx, field in enumerate(names)]
+        return namedtuple(name, fields)
+
+    @staticmethod
+    def _util_create_unpack_from(block_struct, record_type):
+        # Decodes a record in place, buffer can be bytes, bytearray, memoryview or mmap
+        unpack_from = block_struct.unpack_from
+        make = record_type._make
+
+        def f_unpack_from(buffer, offset=0):
+            return make(unpack_from(buffer, offset))
 
+        return f_unpack_from
+
+    @classmethod
+    def _util_create_np_types(cls, names, sizes):
         bom = cls._byte_order_fmt
         types = []
         for idx, (name, (type_name, count)) in enumerate(zip(names, sizes)):
-            name = f_name_fixer(idx, name)
+            name = cls._util_field_name(idx, name)
             _, fmt, *_ = map_size_to_fmt[type_name]
             type_spec = [name, f"{bom}{fmt}"]
             if count > 1:
@@ -210,7 +262,8 @@ header_long = DataBlock(
         elemD_("receiver_status", elemT.u32),
         elemD_("reserved", elemT.u16),
         elemD_("receiver_SW_version", elemT.u16)
-    )
+    ),
+    name="LongHeader",
 )
 
 header_short = DataBlock(
@@ -222,7 +275,8 @@ header_short = DataBlock(
         elemD_("message_id", elemT.u16),
         elemD_("week_number", elemT.u16),
         elemD_("msec_from_week", elemT.u32)
-    )
+    ),
+    name="ShortHeader",
 )
 
 rawimusxb_message = DataBlock(  # ID 1462
@@ -244,8 +298,9 @@ rawimusxb_message = DataBlock(  # ID 1462
     # a positive value implies a negative right-handed rotation
     #about the y-axis marked on the IMU
     elemD_("x_gyro", elemT.i32),
-    elemD_("CRC", elemT.c8, 4),
-    )
+    elemD_("CRC", elemT.u32),
+    ),
+    name="RAWIMUSXB",
 )
 
 insattx_message = DataBlock(  # ID 1457
@@ -260,8 +315,9 @@ insattx_message = DataBlock(  # ID 1457
         elemD_("azimuth_std", elemT.f32),
         elemD_("exl_sol_stat", elemT.c8, 4),
         elemD_("time_sinse_upd", elemT.u16),
-        elemD_("CRC", elemT.c8, 4)
-    )
+        elemD_("CRC", elemT.u32)
+    ),
+    name="INSATTX",
 )
 
 insatts_message = DataBlock(  # ID 319
@@ -272,8 +328,9 @@ insatts_message = DataBlock(  # ID 319
         elemD_("pitch", elemT.f64),
         elemD_("azimuth", elemT.f64),
         elemD_("status", elemT.i32),
-        elemD_("CRC", elemT.c8, 4)
-    )
+        elemD_("CRC", elemT.u32)
+    ),
+    name="INSATTS",
 )
 
 inspvax_message = DataBlock(  # ID 1465
@@ -301,8 +358,9 @@ inspvax_message = DataBlock(  # ID 1465
         elemD_("azimuth_std", elemT.f32),
         elemD_("ext_sol_stat", elemT.c8, 4),
         elemD_("time_since_upd", elemT.u16),
-        elemD_("CRC", elemT.c8, 4),
-    )
+        elemD_("CRC", elemT.u32),
+    ),
+    name="INSPVAX",
 )
 
 inspvas_message = DataBlock(  # ID 508
@@ -319,8 +377,9 @@ inspvas_message = DataBlock(  # ID 508
         elemD_("pitch", elemT.f64),
         elemD_("azimuth", elemT.f64),
         elemD_("status", elemT.i32),
-        elemD_("CRC", elemT.c8, 4),
-    )
+        elemD_("CRC", elemT.u32),
+    ),
+    name="INSPVAS",
 ) 
 
 corrimudatas_message = DataBlock(  # ID 813
@@ -333,16 +392,18 @@ corrimudatas_message = DataBlock(  # ID 813
         elemD_("lateral_acc", elemT.f64),
         elemD_("longitudinal_acc", elemT.f64),
         elemD_("vertical_acc", elemT.f64),
-        elemD_("CRC", elemT.c8, 4),
-    )
+        elemD_("CRC", elemT.u32),
+    ),
+    name="CORRIMUDATAS",
 ) 
 
 syncheave_message = DataBlock(  # ID 1708
     (
         elemD_("heave", elemT.f64),
         elemD_("heave_std", elemT.f64),
-        elemD_("CRC", elemT.c8, 4),
-    )
+        elemD_("CRC", elemT.u32),
+    ),
+    name="SYNCHEAVE",
 ) 
 
 heave_message = DataBlock(  # ID 1382
@@ -350,21 +411,100 @@ heave_message = DataBlock(  # ID 1382
         elemD_("week", elemT.u32),
         elemD_("secs_into_week", elemT.f64),
         elemD_("heave", elemT.f64),
-        elemD_("CRC", elemT.c8, 4),
-    )
+        elemD_("CRC", elemT.u32),
+    ),
+    name="HEAVE",
 ) 
 
+insupdate_message = DataBlock(  # ID 757
+    (
+        elemD_("solution_type", elemT.i32),
+        elemD_("reserved1", elemT.i32),
+        elemD_("phase_updates", elemT.i32),
+        elemD_("reserved2", elemT.i32),
+        elemD_("position_updates", elemT.i32),
+        elemD_("reserved3", elemT.i32),
+        elemD_("zupt_updates", elemT.i32),
+        elemD_("wheel_status", elemT.i32),
+        elemD_("heading_update", elemT.i32),
+        elemD_("CRC", elemT.u32),
+    ),
+    name="INSUPDATE",
+)
+
 
 messages_dict = {"1462": rawimusxb_message, "1457": insattx_message,
                  "319": insatts_message, "1465": inspvax_message,
                  "508": inspvas_message, "1708": syncheave_message,
-                 "1382": heave_message, "813": corrimudatas_message}
+                 "1382": heave_message, "813": corrimudatas_message,
+                 "757": insupdate_message}
+
+
+messages_by_id = {int(message_id): message for message_id, message in messages_dict.items()}
+message_decoders = {}  # filled on the first use of a message ID
+header_decoders = {"LONG": header_long.unpack_from, "SHORT": header_short.unpack_from}
 
 
 long_start = bytes.fromhex('AA 44 12')
 short_start = bytes.fromhex('AA 44 13')
 ascii_usb_info = bytes.fromhex('3C 49 4E')
 
+binary_sync = long_start[:2]
+binary_sync_types = {long_start[2]: "LONG", short_start[2]: "SHORT"}
+_ascii_run = re.compile(rb'[\x00-\x7f]*')
+_ascii_log_line = re.compile(rb'\n[#%]')  # an ASCII log starting on the next line
+
+##############################
+###  CRC-32
+##############################
+CRC32_POLYNOMIAL = 0xEDB88320
+
+
+def _crc32_value(i):
+    crc = i
+    for _ in range(8):
+        if crc & 1:
+            crc = (crc >> 1) ^ CRC32_POLYNOMIAL
+        else:
+            crc >>= 1
+    return crc
+
+
+crc32_table = tuple(_crc32_value(i) for i in range(256))
+
+
+def calculate_block_crc32(data, crc=0):
+    # NovAtel CRC-32 (reflected 0xEDB88320, initial value 0, no final xor)
+    table = crc32_table
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+# zlib.crc32 uses the same table but starts from 0xFFFFFFFF and inverts the result.
+# CRC is linear, so xor-ing with the zlib CRC of as many zero bytes cancels both:
+# calculate_block_crc32(data) == zlib.crc32(data) ^ zlib.crc32(bytes(len(data)))
+_crc32_zero_fix = {}
+
+
+def span6_crc32(buffer, start=0, end=None):
+    if end is None:
+        end = len(buffer)
+    length = end - start
+    fix = _crc32_zero_fix.get(length)
+    if fix is None:
+        fix = _crc32_zero_fix[length] = zlib.crc32(bytes(length))
+    with memoryview(buffer) as view:
+        return zlib.crc32(view[start:end]) ^ fix
+
+
+def check_span6_crc(buffer, offset, size):
+    # size is the full frame size, the last 4 bytes are the little-endian CRC
+    crc_offset = offset + size - 4
+    expected = buffer[crc_offset] | buffer[crc_offset + 1] << 8 | buffer[crc_offset + 2] << 16 | buffer[crc_offset + 3] << 24
+    return span6_crc32(buffer, offset, crc_offset) == expected
+
+
 ##############################
 
 def check_header_type(buffer):
@@ -385,36 +525,116 @@ def check_header_type(buffer):
         
     return header
 
-def find_header(buffer):
-    offset = 0
-    
-    loop = True
-    while loop:
-        header = check_header_type(buffer[offset:offset+3])
-        
-        if header == "UNKN":
-            offset += 1
-        else:
-            loop = False
-    
-    return header, offset
+def find_header(buffer, start=0, end=None):
+    # Returns the first header type and its offset in buffer[start:end].
+    # If there is none, returns "OVER" and the offset of the last two bytes,
+    # which may still be the beginning of a sync pattern
+    if end is None:
+        end = len(buffer)
+
+    offset = buffer.find(binary_sync, start, end)
+    while offset != -1 and offset + 2 < end:
+        header = binary_sync_types.get(buffer[offset + 2])
+        if header is not None:
+            break
+        offset = buffer.find(binary_sync, offset + 1, end)
+    else:
+        offset = -1
 
+    # The ASCII record is searched only before the binary one
+    ascii_offset = buffer.find(ascii_usb_info, start, end if offset == -1 else offset)
+    if ascii_offset != -1:
+        return "INS_UPDATE", ascii_offset
+    if offset != -1:
+        return header, offset
+    return "OVER", max(end - 2, start)
 
-def get_insupdate_size(buffer, offset):
 
-    loop = True
-    header_size = 0
+def find_headers(buffer, start=0, end=None):
+    # Returns (header, offset) of every sync pattern in buffer[start:end], in order
+    if end is None:
+        end = len(buffer)
 
-    # Scan insupdate length
-    while loop:
-        try:
-            buffer[offset + header_size:offset + header_size+1].decode(encoding='utf-8', errors='strict')
-        except:
-            loop = False
-        else:
-            header_size += 1
-    
-    return header_size
+    headers = []
+    offset = buffer.find(binary_sync, start, end)
+    while offset != -1 and offset + 2 < end:
+        header = binary_sync_types.get(buffer[offset + 2])
+        if header is not None:
+            headers.append((header, offset))
+        offset = buffer.find(binary_sync, offset + 2, end)
+
+    ascii_headers = []
+    offset = buffer.find(ascii_usb_info, start, end)
+    while offset != -1:
+        ascii_headers.append(("INS_UPDATE", offset))
+        offset = buffer.find(ascii_usb_info, offset + 3, end)
+
+    if ascii_headers:
+        headers = sorted(headers + ascii_headers, key=lambda item: item[1])
+    return headers
+
+
+def get_insupdate_size(buffer, offset, end=None, scanned=0):
+    # The record lasts until the first non-ASCII byte, the next "<IN" record or a line
+    # holding an ASCII log. scanned is the length already checked by a previous call on the same record
+    if end is None:
+        end = len(buffer)
+
+    run_end = _ascii_run.match(buffer, offset + scanned, end).end()
+    next_record = buffer.find(ascii_usb_info, max(offset + 1, offset + scanned - 2), run_end)
+    if next_record != -1:
+        run_end = next_record
+    next_log = _ascii_log_line.search(buffer, max(offset, offset + scanned - 1), run_end)
+    if next_log is not None:
+        run_end = next_log.start() + 1
+    return run_end - offset
+
+
+def get_frame_size(buffer, header, offset, end=None):
+    # Returns the full size of the frame (header + message + CRC) at offset.
+    # None if buffer[:end] is too short to tell the size, 0 for a false sync
+    if end is None:
+        end = len(buffer)
+    available = end - offset
+
+    if header == "LONG":
+        if available < 10:
+            return None
+        if buffer[offset + 3] != header_long.size:
+            return 0
+        return header_long.size + (buffer[offset + 8] | buffer[offset + 9] << 8) + 4
+    elif header == "SHORT":
+        if available < 4:
+            return None
+        return header_short.size + buffer[offset + 3] + 4
+    else:
+        size = get_insupdate_size(buffer, offset, end)
+        return None if size >= available else size
+
+
+def split_span6_frames(buffer, start=0, end=None, headers=None):
+    # Returns (header, offset, size) of every complete frame in buffer[start:end]
+    # and the offset where unconsumed data begins.
+    # Sync patterns found inside an accepted frame are ignored
+    if end is None:
+        end = len(buffer)
+    if headers is None:
+        headers = find_headers(buffer, start, end)
+
+    frames = []
+    position = start
+    for header, offset in headers:
+        if offset < position:
+            continue
+        size = get_frame_size(buffer, header, offset, end)
+        if size is None or size > end - offset:
+            return frames, offset
+        if size == 0:
+            continue
+        frames.append((header, offset, size))
+        position = offset + size
+
+    return frames, max(position, end - 2)
 
 
 def read_span6_header(buffer, header, offset):
@@ -422,17 +642,12 @@ def read_span6_header(buffer, header, offset):
     header_dict = {}
     
     if header == "LONG":
-        header_length = 28
-        header_array = header_long._struct.unpack(buffer[offset:offset+header_long.size])
-        for num, name in enumerate(header_long._names):
-            header_dict[name] = header_array[num]
+        header_length = header_long.size
+        header_dict = header_long.unpack_from(buffer, offset)._asdict()
             
     elif header == "SHORT":
-        header_length = 12
-        header_array = header_short._struct.unpack(buffer[offset:offset+header_short.size])
-        
-        for num, name in enumerate(header_short._names):
-            header_dict[name] = header_array[num]
+        header_length = header_short.size
+        header_dict = header_short.unpack_from(buffer, offset)._asdict()
             
     elif header == "INS_UPDATE":
         header_length = get_insupdate_size(buffer, offset)
@@ -447,21 +662,523 @@ def read_span6_header(buffer, header, offset):
 
 
 def read_span6_message(buffer, offset, message_id, verbose=False):
-    message = messages_dict[str(message_id)]
-    message_array = message._struct.unpack(buffer[offset:offset+message.size])
-    message_data = {}
-    
-    for num, name in enumerate(message._names):
-        message_data[name] = message_array[num]
-    
+    message_data = messages_by_id[int(message_id)].unpack_from(buffer, offset)._asdict()
     
     if verbose:
-        for num, name in enumerate(message._names):
-            print(f'{name} : {message_array[num]}')
+        for name, value in message_data.items():
+            print(f'{name} : {value}')
             
     return message_data
 
 
+def decode_span6_header(buffer, header, offset=0):
+    # LONG/SHORT header record decoded in place, no slice copies
+    return header_decoders[header](buffer, offset)
+
+
+def decode_span6_message(buffer, offset, message_id, end=None):
+    # Message record decoded in place. The message runs to end, by default the end of buffer
+    # (a frame). None for a message ID without a layout or a message of another length than
+    # its layout, e.g. a log of another firmware version
+    decoder = message_decoders.get(message_id)
+    if decoder is None:
+        message = messages_by_id.get(message_id)
+        if message is None:
+            return None
+        decoder = message_decoders[message_id] = (message.size, message.unpack_from)
+    size, unpack_from = decoder
+    if (len(buffer) if end is None else end) - offset != size:
+        return None
+    return unpack_from(buffer, offset)
+
+
+##############################
+###  SPAN6 -> TSS1 values
+##############################
+imu_rate = 100  # Hz, CORRIMUDATAS values are increments per IMU sample
+
+attitude_message_ids = (1465, 1457, 319, 508)  # INSPVAX, INSATTX, INSATTS, INSPVAS
+accel_message_ids = (813,)  # CORRIMUDATAS
+heave_message_ids = (1708, 1382)  # SYNCHEAVE, HEAVE
+tss1_message_ids = attitude_message_ids + accel_message_ids + heave_message_ids
+
+
+gps_week_seconds = 604800
+
+# Messages that carry their own GPS time: (week field, seconds-of-week field)
+message_time_fields = {
+    1462: ("gnss_week", "gnss_week_seconds"),
+    319: ("week", "secs_into_week"),
+    508: ("week", "seconds"),
+    813: ("week", "seconds"),
+    1382: ("week", "secs_into_week"),
+}
+
+
+def header_gps_time(header_record):
+    # GPS seconds since the GPS epoch from a LONG or SHORT header record
+    if type(header_record) is header_long.record_type:
+        return header_record.week * gps_week_seconds + header_record.ms / 1000
+    return header_record.week_number * gps_week_seconds + header_record.msec_from_week / 1000
+
+
+def message_gps_time(message_id, message, header_record):
+    # The message's own GPS time if it has one, otherwise the header time
+    time_fields = message_time_fields.get(message_id)
+    if time_fields is None:
+        return header_gps_time(header_record)
+    week, seconds = time_fields
+    return getattr(message, week) * gps_week_seconds + getattr(message, seconds)
+
+
+def tss1_fields(message_id, message):
+    # TSS1 input values carried by a decoded message.
+    # Works on a message record and on a NumPy record array of messages alike
+    if message_id in attitude_message_ids:
+        return {"roll": message.roll, "pitch": message.pitch}
+    if message_id in accel_message_ids:
+        return {
+            "hor_accel": (message.lateral_acc ** 2 + message.longitudinal_acc ** 2) ** 0.5 * imu_rate,
+            "vert_accel": message.vertical_acc * imu_rate,
+        }
+    if message_id in heave_message_ids:
+        return {"heave": message.heave}
+    return {}
+
+
+##############################
+###  ASCII logs
+##############################
+# '#INSPVAXA,COM1,0,80.0,FINESTEERING,2200,302400.000,00000000,0000,0;<fields>*<crc>\r\n'
+# '%CORRIMUDATASA,2200,302400.000;<fields>*<crc>\r\n' for the logs with a short header.
+# The CRC is the NovAtel CRC-32 of everything between the sync character and '*', in hex.
+# The fields are decoded into the records of the binary layouts, so the rest of the
+# program does not need to know which format a log came in
+
+ascii_message_ids = {"INSPVAX": 1465, "INSATTX": 1457, "INSATTS": 319, "INSPVAS": 508,
+                     "CORRIMUDATAS": 813, "SYNCHEAVE": 1708, "HEAVE": 1382, "INSUPDATE": 757}
+ascii_message_names = {message_id: name for name, message_id in ascii_message_ids.items()}
+
+ascii_time_status = {"UNKNOWN": 20, "APPROXIMATE": 60, "COARSEADJUSTING": 80, "COARSE": 100,
+                     "COARSESTEERING": 120, "FREEWHEELING": 130, "FINEADJUSTING": 140, "FINE": 160,
+                     "FINEBACKUPSTEERING": 170, "FINESTEERING": 180, "SATTIME": 200}
+ascii_port_addresses = {"COM1": 0x20, "COM2": 0x40, "COM3": 0x60, "SPECIAL": 0xA0, "THISPORT": 0xC0, "FILE": 0xE0}
+
+ins_status_values = {"INS_INACTIVE": 0, "INS_ALIGNING": 1, "INS_HIGH_VARIANCE": 2, "INS_SOLUTION_GOOD": 3,
+                     "INS_SOLUTION_FREE": 6, "INS_ALIGNMENT_COMPLETE": 7, "DETERMINING_ORIENTATION": 8,
+                     "WAITING_INITIALPOS": 9, "WAITING_AZIMUTH": 10, "INITIALIZING_BIASES": 11,
+                     "MOTION_DETECT": 12, "WAITING_ALIGNMENTORIENTATION": 14}
+position_type_values = {"NONE": 0, "FIXEDPOS": 1, "FIXEDHEIGHT": 2, "DOPPLER_VELOCITY": 8, "SINGLE": 16,
+                        "PSRDIFF": 17, "WAAS": 18, "PROPAGATED": 19, "L1_FLOAT": 32, "NARROW_FLOAT": 34,
+                        "L1_INT": 48, "WIDE_INT": 49, "NARROW_INT": 50, "RTK_DIRECT_INS": 51, "INS_SBAS": 52,
+                        "INS_PSRSP": 53, "INS_PSRDIFF": 54, "INS_RTKFLOAT": 55, "INS_RTKFIXED": 56,
+                        "PPP_CONVERGING": 68, "PPP": 69, "OPERATIONAL": 70, "WARNING": 71, "OUT_OF_BOUNDS": 72,
+                        "INS_PPP_CONVERGING": 73, "INS_PPP": 74, "PPP_BASIC_CONVERGING": 77, "PPP_BASIC": 78,
+                        "INS_PPP_BASIC_CONVERGING": 79, "INS_PPP_BASIC": 80}
+update_status_values = {"INACTIVE": 0, "ACTIVE": 1, "USED": 2, "UNSYNCED": 3, "BAD_MISC": 4, "HIGH_ROTATION": 5}
+
+# Enumerated fields are names in ASCII logs, a name missing from its table decodes as -1
+ascii_enums = {
+    "ins_status": ins_status_values,
+    "status": ins_status_values,
+    "solution_type": ins_status_values,
+    "pos_type": position_type_values,
+    "wheel_status": update_status_values,
+    "heading_update": update_status_values,
+}
+
+ascii_record_pattern = re.compile(rb'[#%][A-Z][^#%*\r\n]*\*[0-9a-fA-F]{8}\r\n')
+_ascii_record_prefix = re.compile(rb'[#%][A-Z][^#%*\r\n]*(?:\*[0-9a-fA-F]{0,8}\r?)?')
+_ascii_log_sync = re.compile(rb'[#%][A-Z]')
+max_ascii_record = 2048  # bytes, longer unterminated text is garbage
+_ascii_record_tail = 11  # '*', 8 hex digits, CR LF
+
+
+def _ascii_field_parsers(block):
+    # One bytes -> value function per field of a layout, the CRC excluded
+    parsers = []
+    for name, (type_name, count) in zip(block._names, block._sizes):
+        if name == "CRC":
+            continue
+        if name in ascii_enums:
+            table = {key.encode(): value for key, value in ascii_enums[name].items()}
+            parsers.append(lambda token, table=table: table.get(token, -1))
+        elif type_name == elemT.c8:
+            # a hex ULONG such as the extended solution status, kept as its little-endian bytes
+            parsers.append(lambda token, count=count: int(token, 16).to_bytes(count, "little"))
+        elif type_name in (elemT.f32, elemT.f64):
+            parsers.append(float)
+        else:
+            parsers.append(int)
+    return tuple(parsers)
+
+
+ascii_field_parsers = {message_id: _ascii_field_parsers(messages_by_id[message_id])
+                       for message_id in ascii_message_names}
+ascii_log_ids = {f"{name}A".encode(): message_id for name, message_id in ascii_message_ids.items()}
+_ascii_time_status = {key.encode(): value for key, value in ascii_time_status.items()}
+_ascii_port_addresses = {key.encode(): value for key, value in ascii_port_addresses.items()}
+
+
+def check_ascii_crc(buffer, offset, size):
+    # size is the full record size up to and including CR LF
+    crc_offset = offset + size - _ascii_record_tail
+    return span6_crc32(buffer, offset + 1, crc_offset) == int(bytes(buffer[crc_offset + 1:crc_offset + 9]), 16)
+
+
+def decode_ascii_record(buffer, offset, size):
+    # (header record, message ID, message record) of the ASCII log at offset, in the binary layouts.
+    # The header is the LONG/SHORT header of the equivalent binary frame (message type 0x20 marks
+    # ASCII in the LONG one) and the message CRC field holds the ASCII CRC.
+    # None for a log without a layout, in the other header format than message_headers registers
+    # or with malformed fields; the CRC is not checked here
+    crc_offset = offset + size - _ascii_record_tail
+    head, separator, body = bytes(buffer[offset + 1:crc_offset]).partition(b";")
+    head = head.split(b",")
+    message_id = ascii_log_ids.get(head[0])
+    if not separator or message_id is None:
+        return None
+    block = messages_by_id[message_id]
+    parsers = ascii_field_parsers[message_id]
+    tokens = body.split(b",")
+    if len(tokens) != len(parsers):
+        return None
+    try:
+        values = [parse(token) for parse, token in zip(parsers, tokens)]
+        values.append(int(bytes(buffer[crc_offset + 1:crc_offset + 9]), 16))
+        header = message_headers[message_id]
+        if buffer[offset] == 0x23 and len(head) == 10 and header == "LONG":  # '#'
+            port, sequence, idle, time_status, week, seconds, receiver_status, reserved, version = head[1:]
+            header_record = header_long.record_type(
+                long_start[:1], long_start[1:2], long_start[2:], header_long.size, message_id, b"\x20",
+                _ascii_port_addresses.get(port, 0), block.size - 4, int(sequence), int(round(float(idle) * 2)),
+                _ascii_time_status.get(time_status, 0), int(week), int(round(float(seconds) * 1000)),
+                int(receiver_status, 16), int(reserved, 16), int(version))
+        elif buffer[offset] == 0x25 and len(head) == 3 and header == "SHORT":  # '%'
+            week, seconds = head[1:]
+            header_record = header_short.record_type(
+                short_start[:1], short_start[1:2], short_start[2:], block.size - 4, message_id,
+                int(week), int(round(float(seconds) * 1000)))
+        else:
+            return None
+    except ValueError:
+        return None
+    return header_record, message_id, block.record_type._make(values)
+
+
+def encode_binary_frame(header_record, message_id, message):
+    # Binary frame with the content of a header and message record pair and its own CRC
+    header_block = header_long if type(header_record) is header_long.record_type else header_short
+    frame = bytearray(header_block._struct.pack(*header_record) + messages_by_id[message_id]._struct.pack(*message))
+    frame[-4:] = span6_crc32(frame, 0, len(frame) - 4).to_bytes(4, "little")
+    return bytes(frame)
+
+
+##############################
+###  Message layouts
+##############################
+# More logs are declared in a spec table instead of a module-level DataBlock each:
+# a 'NAME ID LONG|SHORT [ascii]' line and one 'field type' line per field, type an elemT name;
+# c8 takes an optional [count] and is then one bytes value. 'ascii' also decodes the NAMEA ASCII log (the fields must be numbers or
+# ascii_enums names). A layout with week and seconds fields gets them as its GPS time.
+# The same format can be loaded from a file with load_layouts()
+
+layout_spec = """
+BESTPOS     42      LONG
+    sol_status          i32
+    pos_type            i32
+    lat                 f64
+    long                f64
+    height              f64
+    undulation          f32
+    datum_id            i32
+    lat_std             f32
+    long_std            f32
+    height_std          f32
+    stn_id              c8[4]
+    diff_age            f32
+    sol_age             f32
+    svs                 u8
+    soln_svs            u8
+    soln_l1_svs         u8
+    soln_multi_svs      u8
+    reserved            u8
+    ext_sol_stat        u8
+    galileo_beidou_mask u8
+    gps_glonass_mask    u8
+    CRC                 u32
+
+INSPVA      507     LONG    ascii
+    week                u32
+    seconds             f64
+    lat                 f64
+    long                f64
+    height              f64
+    north_vel           f64
+    east_vel            f64
+    up_vel              f64
+    roll                f64
+    pitch               f64
+    azimuth             f64
+    status              i32
+    CRC                 u32
+
+INSATTQS    2264    SHORT   ascii
+    week                u32
+    seconds             f64
+    quaternion_w        f64
+    quaternion_x        f64
+    quaternion_y        f64
+    quaternion_z        f64
+    status              i32
+    CRC                 u32
+"""
+
+# message ID -> "LONG" or "SHORT", the header the log comes with. Frames of a registered log with
+# the other header are dropped by the framer and the batch decoder
+message_headers = {1462: "SHORT", 1457: "LONG", 319: "SHORT", 1465: "LONG", 508: "SHORT",
+                   1708: "LONG", 1382: "LONG", 813: "SHORT", 757: "LONG"}
+_layout_line = re.compile(r'(\w+)\s+(\d+)\s+(LONG|SHORT)(\s+ascii)?$')
+_field_line = re.compile(r'(\w+)\s+(\w+)(?:\[(\d+)\])?$')
+
+
+def parse_layout_spec(text):
+    # [(name, message ID, header, ascii, elements)] of a layout spec, '#' starts a comment
+    layouts = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        layout = _layout_line.match(line)
+        field = _field_line.match(line)
+        if layout is not None:
+            name, message_id, header, ascii_log = layout.groups()
+            layouts.append((name, int(message_id), header, ascii_log is not None, []))
+        elif (field is not None and layouts and field.group(2) in elemT._fields
+              and (field.group(3) is None or field.group(2) == elemT.c8)):
+            # other arrays would unpack to one value per element, not one per field
+            name, type_name, count = field.groups()
+            layouts[-1][4].append(elemD_(name, getattr(elemT, type_name), int(count or 1)))
+        else:
+            raise RuntimeError(f"Layout spec line {number} is not understood: {line!r}")
+    return layouts
+
+
+def register_layout(name, message_id, elements, header="LONG", ascii_log=False):
+    # Adds a message layout under its ID, replacing an earlier one. Returns its DataBlock
+    block = DataBlock(elements, name=name)
+    messages_dict[str(message_id)] = block
+    messages_by_id[message_id] = block
+    message_headers[message_id] = header
+    message_decoders.pop(message_id, None)
+    if "week" in block._names and "seconds" in block._names:
+        message_time_fields[message_id] = ("week", "seconds")
+    if ascii_log:
+        ascii_message_ids[name] = message_id
+        ascii_message_names[message_id] = name
+        ascii_log_ids[f"{name}A".encode()] = message_id
+        ascii_field_parsers[message_id] = _ascii_field_parsers(block)
+    return block
+
+
+def register_layouts(text):
+    # Registers the layouts of a spec, returns their message IDs
+    layouts = parse_layout_spec(text)
+    for name, message_id, header, ascii_log, elements in layouts:
+        register_layout(name, message_id, elements, header, ascii_log)
+    return [message_id for _, message_id, *_ in layouts]
+
+
+def load_layouts(path):
+    # Registers the layouts of a spec file, returns their message IDs
+    with open(path) as file:
+        return register_layouts(file.read())
+
+
+register_layouts(layout_spec)
+
+
+##############################
+###  SPAN6 Stream Framer
+##############################
+Span6Frame = namedtuple("Span6Frame", ["header", "header_record", "header_length", "data"])
+
+
+class Span6Framer:
+    """
+    Splits a raw SPAN6 byte stream into complete LONG/SHORT/INS_UPDATE frames.
+    Chunks are copied into a fixed-capacity buffer, partial frames are kept until
+    the next chunk arrives and garbage between frames is skipped.
+    Frames with a wrong CRC are counted and dropped.
+    With ascii_logs, ASCII logs with a known layout come out as the equivalent LONG/SHORT frame
+    """
+
+    def __init__(self, capacity=16384, check_crc=True, ascii_logs=True):
+        self.check_crc = check_crc
+        self.ascii_logs = ascii_logs
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._start = 0  # first byte that is not yet emitted or skipped
+        self._end = 0  # end of valid data
+        self._ascii_scanned = 0  # length of the INS_UPDATE record checked so far
+        self.frame_count = 0
+        self.skipped_bytes = 0  # garbage dropped while searching for a header
+        self.dropped_bytes = 0  # data lost because the buffer was full
+        self.crc_errors = 0  # frames dropped because of a CRC mismatch
+        self.unknown_logs = 0  # CRC-checked ASCII logs dropped for having no layout
+        self.header_mismatches = 0  # CRC-checked frames of a log registered with the other header
+
+    @property
+    def capacity(self):
+        return len(self._buf)
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __iter__(self):
+        frame = self._next_frame()
+        while frame is not None:
+            yield frame
+            frame = self._next_frame()
+
+    def feed(self, chunk):
+        size = len(chunk)
+        if size == 0:
+            return
+        if self._end + size > self.capacity:
+            self._compact()
+        if self._end + size > self.capacity:
+            # Buffer is full: keep the newest bytes, the framer resyncs on them
+            if size >= self.capacity:
+                self.dropped_bytes += self._end - self._start + size - self.capacity
+                chunk = chunk[size - self.capacity:]
+                size = self.capacity
+                self._start = self._end = 0
+            else:
+                overflow = self._end + size - self.capacity
+                self.dropped_bytes += overflow
+                self._start += overflow
+                self._compact()
+            self._ascii_scanned = 0
+        self._buf[self._end:self._end + size] = chunk
+        self._end += size
+
+    def reset(self):
+        self._start = self._end = 0
+        self._ascii_scanned = 0
+
+    def _compact(self):
+        remaining = self._end - self._start
+        if self._start > 0:
+            self._buf[:remaining] = self._buf[self._start:self._end]
+        self._start = 0
+        self._end = remaining
+
+    def _skip(self, count):
+        self._start += count
+        self.skipped_bytes += count
+        self._ascii_scanned = 0
+
+    def _emit(self, header, header_length, size):
+        header_record = None
+        if header != "INS_UPDATE":
+            header_record = decode_span6_header(self._buf, header, self._start)
+        data = bytes(self._view[self._start:self._start + size])
+        self._start += size
+        self._ascii_scanned = 0
+        if self._start == self._end:
+            self._start = self._end = 0
+        self.frame_count += 1
+        return Span6Frame(header, header_record, header_length, data)
+
+    def _consume(self, size):
+        self._start += size
+        self._ascii_scanned = 0
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _next_ascii_log(self, pending):
+        # Frame of the ASCII log at the start, None if it is not complete yet.
+        # pending tells that no other header follows, so an unterminated record may still be arriving.
+        # Returns False after skipping a false sync or a log that was dropped
+        buffer = self._buf
+        start = self._start
+        match = ascii_record_pattern.match(buffer, start, self._end)
+        if match is None:
+            partial = _ascii_record_prefix.match(buffer, start, self._end).end()
+            if pending and partial == self._end and partial - start < max_ascii_record:
+                return None
+            self._skip(1)
+            return False
+        size = match.end() - start
+        if self.check_crc and not check_ascii_crc(buffer, start, size):
+            self.crc_errors += 1
+            self._skip(1)
+            return False
+        decoded = decode_ascii_record(buffer, start, size)
+        self._consume(size)
+        if decoded is None:
+            self.unknown_logs += 1
+            return False
+        header_record, message_id, message = decoded
+        header = "LONG" if type(header_record) is header_long.record_type else "SHORT"
+        header_length = header_long.size if header == "LONG" else header_short.size
+        self.frame_count += 1
+        return Span6Frame(header, header_record, header_length, encode_binary_frame(*decoded))
+
+    def _next_frame(self):
+        buffer = self._buf
+        while True:
+            header, offset = find_header(buffer, self._start, self._end)
+            if self.ascii_logs and offset > self._start:
+                # like INS_UPDATE records, ASCII logs are searched only before the binary header
+                sync = _ascii_log_sync.search(buffer, self._start, self._end if header == "OVER" else offset)
+                if sync is not None:
+                    pending = header == "OVER"
+                    header, offset = "ASCII", sync.start()
+            if offset > self._start:
+                # bytes before the offset were checked and are not a header start
+                self._skip(offset - self._start)
+            if header == "OVER":
+                return None
+
+            if header == "ASCII":
+                frame = self._next_ascii_log(pending)
+                if frame is False:
+                    continue
+                return frame
+
+            start = self._start
+            available = self._end - start
+
+            if header == "INS_UPDATE":
+                size = get_insupdate_size(buffer, start, self._end, self._ascii_scanned)
+                if size >= available:
+                    self._ascii_scanned = size
+                    return None
+                return self._emit(header, size, size)
+
+            size = get_frame_size(buffer, header, start, self._end)
+            if size == 0 or (size is not None and size > self.capacity):
+                self._skip(1)  # false sync
+                continue
+            if size is None or size > available:
+                return None
+            if self.check_crc and not check_span6_crc(buffer, start, size):
+                # corrupted frame or a sync pattern inside garbage
+                self.crc_errors += 1
+                self._skip(1)
+                continue
+            message_id = buffer[start + 4] | buffer[start + 5] << 8
+            if message_headers.get(message_id, header) != header:
+                # the log's layout is registered for the other header, it does not describe this frame
+                self.header_mismatches += 1
+                self._consume(size)
+                continue
+            header_length = header_long.size if header == "LONG" else header_short.size
+            return self._emit(header, header_length, size)
+
+
 def rad_to_deg(rad):
     return rad*180/math.pi
 
@@ -470,11 +1187,14 @@ def rad_to_deg(rad):
 ##### COMport block
     
 def get_com_list():
+    # port enumeration is only needed interactively, its import is left until then
+    import serial.tools.list_ports
     global port_list
     port_list = serial.tools.list_ports.comports()
     return port_list
 
 def serial_open(port_name, baud):
+    import serial
     port = serial.Serial(port_name, baud, timeout=0.01)
     if port.isOpen():
         print(port_name, " open success")
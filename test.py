@@ -22,10 +22,10 @@ def decode_tss1(tss1_message):
     hor_acc_lsb = 0.0383  # m/s^2
     vert_accel_lsb = 0.000625  # m/s^2
     hor_accel_b = (struct.unpack('B', bytes.fromhex(tss1_message[1:3]))[0])*hor_acc_lsb
-    vert_accel_b = (struct.unpack('h', bytes.fromhex(tss1_message[3:8]))[0])*vert_accel_lsb
+    vert_accel_b = (struct.unpack('>h', bytes.fromhex(tss1_message[3:7]))[0])*vert_accel_lsb
     
     print(tss1_message[1:3])
-    print(tss1_message[3:8])
+    print(tss1_message[3:7])
     print(f'horr: {hor_accel_b} vert: {vert_accel_b}')
 
 def test_tss1():
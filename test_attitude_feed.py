@@ -0,0 +1,75 @@
+import threading
+import uuid
+from multiprocessing import shared_memory
+
+import pytest
+
+import attitude_feed
+
+
+@pytest.fixture
+def feed_name():
+    return f"test_feed_{uuid.uuid4().hex[:12]}"
+
+
+def state(roll):
+    return dict(hor_accel=1.0, vert_accel=-9.81, heave=-0.42, roll=roll, pitch=-3.5)
+
+
+def test_reader_sees_newest_states(feed_name):
+    with attitude_feed.AttitudeFeedWriter(feed_name, capacity=4) as writer:
+        for index in range(6):
+            writer.publish(state(float(index)), gps_time=302400.0 + index, status=3, message_id=319)
+        with attitude_feed.AttitudeFeedReader(feed_name) as reader:
+            assert reader.count == 6
+            records = reader.snapshot(10)
+            assert records["roll"].tolist() == [2.0, 3.0, 4.0, 5.0]
+            assert records["sequence"].tolist() == [6, 8, 10, 12]
+            newest = reader.latest_state()
+            assert (newest["roll"], newest["gps_time"], newest["status"], newest["message_id"]) == (5.0, 302405.0, 3, 319)
+            assert newest["heading"] != newest["heading"]  # NaN, not decoded
+
+
+def test_stale_feed_is_replaced(feed_name):
+    stale = attitude_feed.AttitudeFeedWriter(feed_name, capacity=4)
+    stale.publish(state(1.0))
+    # a converter that died: its segment is left, nothing publishes into it
+    stale._buffer.release()
+    stale._buffer = None
+    stale._memory.close()
+    with attitude_feed.AttitudeFeedWriter(feed_name, capacity=8, takeover_wait=0.01) as writer:
+        with attitude_feed.AttitudeFeedReader(feed_name) as reader:
+            assert (reader.capacity, reader.count) == (8, 0)
+        writer.publish(state(2.0))
+
+
+def test_live_feed_is_refused(feed_name):
+    with attitude_feed.AttitudeFeedWriter(feed_name, capacity=4) as live:
+        stop = threading.Event()
+
+        def publish():
+            while not stop.is_set():
+                live.publish(state(1.0))
+                stop.wait(0.001)
+
+        thread = threading.Thread(target=publish)
+        thread.start()
+        try:
+            with pytest.raises(RuntimeError, match="still being published"):
+                attitude_feed.AttitudeFeedWriter(feed_name, capacity=4, takeover_wait=0.05)
+        finally:
+            stop.set()
+            thread.join()
+        with attitude_feed.AttitudeFeedReader(feed_name) as reader:
+            assert reader.count == live.count
+
+
+def test_other_segment_is_refused(feed_name):
+    other = shared_memory.SharedMemory(feed_name, create=True, size=4096)
+    try:
+        with pytest.raises(RuntimeError, match="not an attitude feed"):
+            attitude_feed.AttitudeFeedWriter(feed_name, takeover_wait=0.01)
+        assert bytes(other.buf[:8]) == bytes(8)
+    finally:
+        other.close()
+        other.unlink()
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import attitude_store
+import span6_to_tss1 as rs6
+
+
+def test_buffer_interpolates_and_clamps():
+    series = attitude_store.TimeSeriesBuffer(capacity=8)
+    for time, value in [(1.0, 10.0), (2.0, 20.0), (4.0, 0.0)]:
+        series.append(time, value)
+    assert series.interpolate(1.5) == 15.0
+    assert series.interpolate(3.0) == 10.0
+    assert (series.interpolate(0.0), series.interpolate(9.0)) == (10.0, 0.0)
+    assert series.interpolate(3.0, max_gap=1.5) is None
+    assert attitude_store.TimeSeriesBuffer().interpolate(1.0) is None
+
+
+def test_buffer_keeps_the_newest_samples_in_order():
+    series = attitude_store.TimeSeriesBuffer(capacity=4)
+    for time in range(10):
+        series.append(float(time), float(time) * 2)
+    series.append(3.0, 0.0)
+    assert series.out_of_order == 1
+    times, values = series.arrays()
+    assert times.tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert values.tolist() == [12.0, 14.0, 16.0, 18.0]
+    assert series.bisect(7.5) == 2
+
+
+def test_batch_interpolation_matches_buffer():
+    times = np.array([0.0, 0.01, 0.02, 0.5, 0.51])
+    values = np.array([1.0, 2.0, 4.0, 8.0, 0.0])
+    epochs = np.linspace(-0.1, 0.6, 36)
+    series = attitude_store.TimeSeriesBuffer()
+    for time, value in zip(times, values):
+        series.append(time, value)
+    expected = [np.nan if value is None else value for value in (series.interpolate(epoch, 0.1) for epoch in epochs)]
+    assert attitude_store.interpolate_series(times, values, epochs, max_gap=0.1) == pytest.approx(expected, nan_ok=True)
+
+
+def test_store_aligns_to_the_newest_common_epoch(known_frames):
+    store = attitude_store.AttitudeStore()
+    # SYNCHEAVE at 302400.000 s, INSATTS at 302400.010 s and CORRIMUDATAS at 302400.020 s
+    for name, header in (("SYNCHEAVE", "LONG"), ("INSATTS", "SHORT"), ("CORRIMUDATAS", "SHORT")):
+        frame = known_frames[name]
+        header_record = rs6.decode_span6_header(frame, header)
+        header_length = rs6.header_long.size if header == "LONG" else rs6.header_short.size
+        message = rs6.decode_span6_message(frame, header_length, header_record.message_id)
+        assert store.aligned_fields() is None  # until every quantity has a sample
+        store.update(header_record.message_id, message, header_record)
+    epoch, fields = store.aligned_fields()
+    assert epoch == pytest.approx(2200 * rs6.gps_week_seconds + 302400.0)
+    assert fields == pytest.approx(dict(hor_accel=5.0, vert_accel=-9.81, heave=-0.42, roll=1.25, pitch=-3.5))
@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+
+import latency_trace
+import span6_pipeline
+from test_span6_pipeline import CapturePort, ChunkPort, wait_for
+
+
+def test_trace_round_trip(tmp_path):
+    path = tmp_path / "trace.bin"
+    with latency_trace.LatencyTracer(path) as tracer:
+        tracer.reference(302400.0, 1_000_000_000)
+        tracer.sent((1_002_000_000, 302400.0, 1708, 1_002_100_000, 1_002_200_000), 1_003_000_000)
+        tracer.skipped((1_004_000_000, 302400.01, 319, 1_004_100_000, 1_004_200_000), 1_005_000_000)
+    records = latency_trace.read_trace(path)
+    assert records["kind"].tolist() == [2, 0, 1]
+    assert records["message_id"].tolist() == [0, 1708, 319]
+    assert records[1][["decode_ns", "encode_ns", "tx_ns"]].tolist() == (100_000, 200_000, 1_000_000)
+    report = latency_trace.analyze_trace(records)
+    assert (report["sentences"], report["skipped"], report["references"]) == (1, 1, 1)
+    # the frame of GPS 302400.0 s was sent 3 ms after that second's reference edge
+    assert report["age_ms"]["max"] == 3.0
+
+
+def test_references_from_another_thread_are_kept(tmp_path):
+    # the TX thread and a PPS thread add records while the buffer is flushed every few records
+    path = tmp_path / "trace.bin"
+    count = 5000
+    tracer = latency_trace.LatencyTracer(path, flush_size=latency_trace.trace_dtype.itemsize * 7)
+
+    def pps():
+        for second in range(count):
+            tracer.reference(float(second), second)
+
+    thread = threading.Thread(target=pps)
+    thread.start()
+    for index in range(count):
+        tracer.sent((index, float(index), 813, index, index), index)
+    thread.join()
+    tracer.close()
+    records = latency_trace.read_trace(path)
+    assert tracer.records == len(records) == 2 * count
+    for kind in ("SENT", "REFERENCE"):
+        selected = records[records["kind"] == latency_trace.trace_kinds.index(kind)]
+        assert np.array_equal(selected["arrival_ns"], np.arange(count))
+
+
+class GatedPort(CapturePort):
+    """
+    TX port whose writes block until the gate opens
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+
+    def write(self, data):
+        self.gate.wait()
+        return super().write(data)
+
+
+def test_sentences_overwritten_before_tx_are_traced(known_frames, tmp_path):
+    # while the TX thread is stuck in a write, the decoder replaces the sentences waiting for it
+    path = tmp_path / "trace.bin"
+    count = 20
+    tx = GatedPort()
+    tracer = latency_trace.LatencyTracer(path)
+    pipeline = span6_pipeline.ConverterPipeline(ChunkPort([known_frames["SYNCHEAVE"] * count]), tx, trace=tracer)
+    pipeline.start()
+    try:
+        assert wait_for(lambda: pipeline.metrics.messages[1708] == count)
+        tx.gate.set()
+        assert wait_for(lambda: pipeline.sentences_sent + pipeline.sentences_skipped == count)
+    finally:
+        tx.gate.set()
+        pipeline.stop()
+        tracer.close()
+    records = latency_trace.read_trace(path)
+    kinds = records["kind"].tolist()
+    skipped = kinds.count(latency_trace.trace_kinds.index("SKIPPED"))
+    assert pipeline._latest.overwritten > 0
+    assert skipped == pipeline.sentences_skipped
+    assert kinds.count(latency_trace.trace_kinds.index("SENT")) == pipeline.sentences_sent == count - skipped
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+import output_encoders
+import span6_to_tss1 as rs6
+
+known_fields = dict(hor_accel=5.0, vert_accel=-9.81, heave=-0.42, roll=1.25, pitch=-3.5, heading=87.0)
+
+
+def sample_fields():
+    # in-range values on and between LSB steps, both signs, and the top of every TSS1 range
+    return {
+        "hor_accel": np.array([0.0, 1.0, 0.0383 * 100.5, 9.81, 4.2]),
+        "vert_accel": np.array([0.0, -9.81, 0.000625 * 7.5, 20.47, -20.48]),
+        "heave": np.array([0.0, -0.42, 0.005, 99.99, -99.99]),
+        "roll": np.array([0.0, 1.25, -0.004, -99.99, 12.345]),
+        "pitch": np.array([0.0, -3.5, 45.0, 99.99, -0.015]),
+        "heading": np.array([0.0, 87.0, 359.996, -90.0, 720.5]),
+    }
+
+
+def rows(fields):
+    return [{name: float(values[row]) for name, values in fields.items()} for row in range(len(fields["roll"]))]
+
+
+##############################
+###  TSS1
+##############################
+
+def test_tss1_encoder_matches_create_tss1():
+    encoder = output_encoders.Tss1Encoder()
+    fields = sample_fields()
+    records, in_range = encoder.encode_batch(fields)
+    assert in_range.all()
+    for row, values in enumerate(rows(fields)):
+        expected = rs6.create_tss1(**{name: values[name] for name in encoder.fields}).encode()
+        assert encoder.encode(values) == expected
+        assert bytes(encoder.encode_view(values)) == expected
+        assert records[row].tobytes() == expected
+
+
+def test_tss1_encoder_known_sentence():
+    encoder = output_encoders.get_encoder("tss1")
+    assert encoder.encode(known_fields) == b":83C2B0 -0042F 0125 -0350\r\n"
+    assert encoder.encode(known_fields, status_f="U")[13:14] == b"U"
+    buffer = bytearray(b"#" * (2 * encoder.size))
+    encoder.encode_into(buffer, encoder.size, known_fields)
+    assert buffer == b"#" * encoder.size + b":83C2B0 -0042F 0125 -0350\r\n"
+
+
+@pytest.mark.parametrize("name, value", [("hor_accel", -0.1), ("vert_accel", 20.5), ("heave", 100.0),
+                                         ("roll", -100.0), ("pitch", 100.0)])
+def test_tss1_encoder_rejects_out_of_range(name, value):
+    with pytest.raises(RuntimeError):
+        output_encoders.Tss1Encoder().encode(dict(known_fields, **{name: value}))
+
+
+##############################
+###  EM3000
+##############################
+
+def test_em3000_known_datagram():
+    encoder = output_encoders.get_encoder("em3000")
+    # status 0x90, sync 0x90, roll 125, pitch -350, heave -42, heading 8700, least significant byte first
+    assert encoder.encode(known_fields) == b"\x90\x90\x7d\x00\xa2\xfe\xd6\xff\xfc\x21"
+    assert encoder.encode(known_fields, status_f="U")[:2] == b"\xa0\x90"
+    assert encoder.encode(known_fields, status_f=b"h")[:2] == b"\x91\x90"
+    assert encoder.encode(dict(known_fields, heading=-90.0))[8:] == (27000).to_bytes(2, "little")
+    without_heading = {name: value for name, value in known_fields.items() if name != "heading"}
+    assert encoder.encode(without_heading)[8:] == b"\x00\x00"
+
+
+def test_em3000_batch_matches_single():
+    encoder = output_encoders.Em3000Encoder()
+    fields = sample_fields()
+    status = np.array([b"F", b"f", b"U", b"G", b"?"], dtype="S1")
+    records, in_range = encoder.encode_batch(fields, status_f=status)
+    assert in_range.all()
+    for row, values in enumerate(rows(fields)):
+        assert records[row].tobytes() == encoder.encode(values, status_f=status[row])
+    out = bytearray(len(status) * encoder.size)
+    encoder.encode_batch(fields, out=out)
+    assert bytes(out) == b"".join(encoder.encode(values) for values in rows(fields))
+
+
+def test_em3000_batch_flags_out_of_range():
+    fields = sample_fields()
+    fields["roll"][1] = 400.0
+    fields["heave"][2] = np.nan
+    records, in_range = output_encoders.Em3000Encoder().encode_batch(fields)
+    assert in_range.tolist() == [True, False, False, True, True]
+    assert records[1, 2:4].view("<i2")[0] == 32767
+    with pytest.raises(RuntimeError):
+        output_encoders.Em3000Encoder().encode(dict(known_fields, roll=400.0))
+
+
+##############################
+###  Heading and registry
+##############################
+
+def test_heading_fields(known_frames):
+    frame = known_frames["INSATTS"]
+    message = rs6.decode_span6_message(frame, rs6.header_short.size, 319)
+    assert output_encoders.heading_fields(319, message) == {"heading": 87.0}
+    corrimu = known_frames["CORRIMUDATAS"]
+    assert output_encoders.heading_fields(813, rs6.decode_span6_message(corrimu, rs6.header_short.size, 813)) == {}
+
+
+def test_registry(monkeypatch):
+    monkeypatch.setattr(output_encoders, "output_encoders", dict(output_encoders.output_encoders))
+    assert sorted(output_encoders.output_encoders) == ["em3000", "tss1"]
+    assert isinstance(output_encoders.get_encoder(), output_encoders.Tss1Encoder)
+    assert output_encoders.get_encoder() is not output_encoders.get_encoder()
+    with pytest.raises(RuntimeError, match="known: tss1, em3000"):
+        output_encoders.get_encoder("nmea")
+
+    @output_encoders.register_encoder
+    class HeaveEncoder(output_encoders.OutputEncoder):
+        name = "heave"
+        size = 2
+        fields = ("heave",)
+
+        def encode_into(self, buffer, offset, fields, status_f="F"):
+            buffer[offset:offset + 2] = round(fields["heave"] * 100).to_bytes(2, "little", signed=True)
+
+    assert HeaveEncoder.name == "heave"
+    assert output_encoders.get_encoder("heave").encode(known_fields) == b"\xd6\xff"
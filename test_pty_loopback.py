@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+import pty_loopback
+import span6_synthetic
+
+
+def test_match_sentences_skips_dropped_ones():
+    expected = [b"a", b"b", b"b", b"c", b"d"]
+    received = [(1, b"b"), (2, b"x"), (3, b"c"), (4, b"b"), (5, b"d")]
+    matches, unexpected = pty_loopback.match_sentences(expected, received)
+    # the b after c cannot belong to an earlier frame any more
+    assert matches == [(1, 0), (3, 2), (4, 4)]
+    assert unexpected == 2
+
+
+def test_capture_splits_sentences():
+    capture = pty_loopback.Tss1Capture(fd=-1)
+    capture._split(b":000000  0000F 0000  0000\r\nnoise\r\n:0000", 7)
+    assert capture.sentences == [(7, b":000000  0000F 0000  0000\r\n")]
+    assert capture.garbage_bytes == len(b"noise\r\n")
+    assert capture._buffer == b":0000"
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux") or not hasattr(os, "openpty"), reason="needs Linux ptys")
+def test_loopback_delivers_every_frame():
+    stream = span6_synthetic.generate_stream(0.5, rates={1465: 20, 1708: 20, 813: 20})
+    report = pty_loopback.run_loopback(stream, baud=115200, drain=0.2)
+    assert report["error"] is None
+    assert (report["crc_errors"], report["skipped_bytes"], report["garbage_bytes"]) == (0, 0, 0)
+    assert report["frames"] == 30
+    assert report["lost_frames"] == 0
+    assert report["sentences_received"] + report["sentences_skipped"] == report["frames"]
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import raw_imu
+import span6_to_tss1 as rs6
+
+
+def recursion(decimator, block, state):
+    # The biquad sample by sample in transposed direct form II
+    b0, b1, b2 = decimator.b
+    a1, a2 = decimator.a
+    s1, s2 = state
+    output = np.empty_like(block)
+    for index, sample in enumerate(block):
+        output[index] = b0 * sample + s1
+        s1, s2 = b1 * sample - a1 * output[index] + s2, b2 * sample - a2 * output[index]
+    return output
+
+
+def noisy_samples(count=1500):
+    rng = np.random.default_rng(7)
+    return rng.normal(size=(count, 3)) + np.array([0.1, -0.2, 9.8])
+
+
+@pytest.mark.parametrize("blocks", [[1500], [1, 7, 255, 256, 257, 600, 124], [40] * 37 + [20]])
+def test_biquad_matches_recursion_in_any_blocks(blocks):
+    samples = noisy_samples()
+    decimator = raw_imu.BiquadDecimator(20, 200, factor=4)
+    state = (samples[0] * (1 - decimator.b[0]), samples[0] * (decimator.b[2] - decimator.a[1]))
+    expected = recursion(decimator, samples, state)
+
+    outputs, positions, offset = [], [], 0
+    for size in blocks:
+        output, kept = decimator.process(samples[offset:offset + size])
+        outputs.append(output)
+        positions.append(kept + offset)
+        offset += size
+    positions = np.concatenate(positions)
+    assert np.array_equal(positions, np.arange(0, len(samples), 4))
+    assert np.allclose(np.concatenate(outputs), expected[positions], rtol=0, atol=1e-12)
+
+
+def test_biquad_passes_dc_and_stops_nyquist():
+    decimator = raw_imu.BiquadDecimator(10, 200)
+    constant, _ = decimator.process(np.full((300, 3), 9.8))
+    assert np.allclose(constant, 9.8)
+    alternating = np.tile([[1.0], [-1.0]], (300, 3))
+    output, _ = raw_imu.BiquadDecimator(10, 200).process(alternating)
+    assert np.abs(output[-100:]).max() < 1e-3
+
+
+def test_fir_decimator_block_sizes_do_not_matter():
+    samples = noisy_samples()
+    taps = raw_imu.lowpass_taps(20, 200)
+    whole, whole_positions = raw_imu.FirDecimator(taps, 4).process(samples)
+    decimator = raw_imu.FirDecimator(taps, 4)
+    parts = [decimator.process(samples[start:start + 33])[0] for start in range(0, len(samples), 33)]
+    assert np.allclose(np.concatenate(parts), whole)
+    assert len(whole_positions) == len(samples) // 4
+
+
+def rawimusxb_records(count, y_accel=0):
+    # ISA100C: 2e-8 m/s per count at 200 Hz, z counts 1 g
+    records = np.zeros(count, dtype=rs6.rawimusxb_message.dtype)
+    records["imu_type"] = 26
+    records["gnss_week"] = 2200
+    records["gnss_week_seconds"] = 302400 + np.arange(count) / 200
+    records["z_accel"] = round(raw_imu.standard_gravity / 200 / 2e-8)
+    records["y_accel"] = y_accel
+    return records
+
+
+def test_scale_raw_imu_flips_y():
+    times, accel, gyro = raw_imu.scale_raw_imu(rawimusxb_records(2, y_accel=500))
+    assert times[1] - times[0] == pytest.approx(0.005, abs=1e-6)
+    assert accel[0, 1] == pytest.approx(-500 * 2e-8 * 200)
+    assert accel[0, 2] == pytest.approx(raw_imu.standard_gravity, abs=1e-5)
+    assert not gyro.any()
+
+
+def test_unknown_imu_type_needs_a_scale():
+    records = rawimusxb_records(1)
+    records["imu_type"] = 99
+    with pytest.raises(RuntimeError):
+        raw_imu.scale_raw_imu(records)
+
+
+def test_raw_imu_stream_gives_tss1_accelerations():
+    stream = raw_imu.RawImuStream(block_size=10, output_rate=50, kind="iir")
+    records = rawimusxb_records(10)
+    header = bytes(rs6.header_short.size)
+    results = [stream.feed(header + record.tobytes(), rs6.header_short.size) for record in records]
+    assert results[:9] == [None] * 9
+    assert results[9]["hor_accel"] == pytest.approx(0.0, abs=1e-9)
+    assert results[9]["vert_accel"] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_raw_imu_stream_drops_frames_of_another_length():
+    stream = raw_imu.RawImuStream(block_size=2, output_rate=50, kind="iir")
+    frame = bytes(rs6.header_short.size) + rawimusxb_records(1).tobytes()
+    assert stream.feed(frame[:-4], rs6.header_short.size) is None
+    assert stream.feed(frame + bytes(4), rs6.header_short.size) is None
+    assert stream.length_errors == 2
+    assert stream.feed(frame, rs6.header_short.size) is None
+    assert stream.feed(frame, rs6.header_short.size) is not None
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+import span6_archive
+import span6_batch
+import span6_synthetic
+import span6_to_tss1 as rs6
+from test_span6_to_tss1 import short_frame
+
+
+@pytest.fixture(scope="module")
+def stream():
+    return span6_synthetic.generate_stream(2.0, garbage_probability=0.05)
+
+
+def batch_inputs(stream):
+    index, _ = span6_batch.index_frames(stream)
+    return span6_batch.tss1_inputs(np.frombuffer(stream, dtype=np.uint8), index)
+
+
+def test_messages_are_stored_as_received(known_frames, tmp_path):
+    with span6_archive.ArchiveWriter(tmp_path) as writer:
+        assert writer.append_capture(known_frames["SYNCHEAVE"] + known_frames["INSATTS"]) == 0
+    archive = span6_archive.Archive(tmp_path)
+    assert archive.message_ids == [319, 1708]
+    times, records = archive.messages(1708)
+    assert records.tobytes() == known_frames["SYNCHEAVE"][rs6.header_long.size:]
+    assert times.tolist() == [2200 * rs6.gps_week_seconds + 302400.0]
+    assert archive.frames["message_id"].tolist() == [1708, 319]
+
+
+def test_archive_replays_the_capture(stream, tmp_path):
+    with span6_archive.ArchiveWriter(tmp_path) as writer:
+        writer.append_capture(stream)
+    archive = span6_archive.Archive(tmp_path)
+    expected = batch_inputs(stream)
+    inputs = archive.tss1_inputs()
+    for name, values in expected.items():
+        assert np.array_equal(inputs[name], values)
+
+
+def test_window_matches_the_capture_slice(stream, tmp_path):
+    with span6_archive.ArchiveWriter(tmp_path) as writer:
+        writer.append_capture(stream)
+    archive = span6_archive.Archive(tmp_path)
+    start = 2200 * rs6.gps_week_seconds + span6_synthetic.start_seconds + 0.5
+    window = archive.frame_window(start, start + 1.0)
+    assert 0 < window.start < window.stop < len(archive.frames)
+    expected = batch_inputs(stream)
+    inputs = archive.tss1_inputs(start, start + 1.0)
+    for name, values in expected.items():
+        assert np.array_equal(inputs[name], values[window])
+
+
+def test_frame_by_frame_equals_capture_import(stream, tmp_path):
+    with span6_archive.ArchiveWriter(tmp_path / "capture") as writer:
+        writer.append_capture(stream)
+    framer = rs6.Span6Framer(capacity=1 << 16)
+    with span6_archive.ArchiveWriter(tmp_path / "frames") as writer:
+        for chunk in span6_synthetic.split_chunks(stream):
+            framer.feed(chunk)
+            for frame in framer:
+                if frame.header != "INS_UPDATE":
+                    writer.append_frame(frame.header_record, frame.header_length, frame.data)
+    imported, recorded = span6_archive.Archive(tmp_path / "capture"), span6_archive.Archive(tmp_path / "frames")
+    assert recorded.message_ids == imported.message_ids
+    assert recorded.frames.tobytes() == imported.frames.tobytes()
+    for message_id in imported.message_ids:
+        assert recorded.messages(message_id)[1].tobytes() == imported.messages(message_id)[1].tobytes()
+
+
+def test_capture_import_drops_mismatched_header_frames(known_frames, tmp_path):
+    buffer = known_frames["SYNCHEAVE"] + short_frame(known_frames["SYNCHEAVE"]) + known_frames["INSATTS"]
+    with span6_archive.ArchiveWriter(tmp_path / "capture") as writer:
+        writer.append_capture(buffer)
+    framer = rs6.Span6Framer()
+    framer.feed(buffer)
+    with span6_archive.ArchiveWriter(tmp_path / "frames") as writer:
+        for frame in framer:
+            writer.append_frame(frame.header_record, frame.header_length, frame.data)
+    assert framer.header_mismatches == 1
+    imported, recorded = span6_archive.Archive(tmp_path / "capture"), span6_archive.Archive(tmp_path / "frames")
+    assert imported.frames["message_id"].tolist() == [1708, 319]
+    assert recorded.frames.tobytes() == imported.frames.tobytes()
+    assert len(imported.tss1_inputs()["heave"]) == 2
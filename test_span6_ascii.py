@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import span6_ascii
+import span6_batch
+import span6_stream
+import span6_synthetic
+import span6_to_tss1 as rs6
+import tss1_verify
+
+# The known INSATTS frame of conftest.py as a SHORT ASCII log, CRC included
+insatts_ascii = (b"%INSATTSA,2200,302400.010;2200,302400.010000000,1.250000000,-3.500000000,87.000000000,"
+                 b"INS_SOLUTION_GOOD*0f157f3a\r\n")
+
+rates = {1465: 50, 1708: 50, 813: 100}
+ascii_headers = {1465: "ASCII", 1708: "ASCII", 813: "SHORT_ASCII"}
+
+synchave_head = b"#SYNCHEAVEA,COM1,2,80.0,FINESTEERING,2200,302400.000,00000000,0000,0"
+
+
+def ascii_log(head, body):
+    # ASCII log with its CRC, head starts with the sync character
+    content = head[1:] + b";" + body
+    return head[:1] + content + b"*%08x\r\n" % rs6.span6_crc32(content)
+
+
+def test_ascii_log_decodes_like_the_binary_frame(known_frames):
+    header_record, message_id, message = rs6.decode_ascii_record(insatts_ascii, 0, len(insatts_ascii))
+    binary = rs6.decode_span6_message(known_frames["INSATTS"], rs6.header_short.size, 319)
+    assert header_record == rs6.decode_span6_header(known_frames["INSATTS"], "SHORT")
+    assert message_id == 319
+    assert message[:-1] == binary[:-1]
+    assert message.CRC == 0x0F157F3A
+    assert rs6.check_ascii_crc(insatts_ascii, 0, len(insatts_ascii))
+
+
+def test_framer_turns_ascii_logs_into_binary_frames(known_frames):
+    framer = rs6.Span6Framer()
+    corrupted = insatts_ascii.replace(b"1.25", b"1.35")
+    unknown = b"#BESTGNSSPOSA,COM1,0,80.0,FINESTEERING,2200,302400.000,00000000,0000,0;1*"
+    unknown += b"%08x\r\n" % rs6.span6_crc32(unknown[1:-1])
+    framer.feed(corrupted + unknown + insatts_ascii + known_frames["SYNCHEAVE"])
+    frames = list(framer)
+    assert [frame.data for frame in frames] == [known_frames["INSATTS"], known_frames["SYNCHEAVE"]]
+    assert (framer.crc_errors, framer.unknown_logs) == (1, 1)
+
+
+def test_block_decoder_matches_log_by_log():
+    capture = span6_synthetic.generate_stream(1.0, rates=rates, headers=ascii_headers, ascii_records=False)
+    lines = capture.split(b"\r\n")
+    lines[5] = lines[5].replace(b",", b";", 1)  # no longer matches its CRC
+    capture = b"\r\n".join(lines)
+    count, decoded, crc_errors = span6_ascii.decode_block(capture)
+    assert (count, crc_errors) == (199, 1)
+    assert sorted(decoded) == [813, 1465, 1708]
+    valid = [(sync, content, crc) for sync, content, crc in span6_ascii._record.findall(capture)
+             if rs6.check_ascii_crc(sync + content + b"*" + crc + b"\r\n", 0, len(content) + 12)]
+    for message_id, (rows, times, messages) in decoded.items():
+        name = rs6.ascii_message_names[message_id].encode() + b"A,"
+        slow_rows, slow_times, slow_messages = span6_ascii._decode_records(
+            message_id, [(row, *record) for row, record in enumerate(valid) if record[1].startswith(name)])
+        assert np.array_equal(rows, slow_rows)
+        assert np.array_equal(times, slow_times)
+        assert messages.tobytes() == slow_messages.tobytes()
+
+
+@pytest.mark.parametrize("block_size", [4096, span6_ascii.default_block_size])
+def test_ascii_capture_converts_like_binary(tmp_path, block_size):
+    binary = tmp_path / "binary.bin"
+    text = tmp_path / "ascii.txt"
+    binary.write_bytes(span6_synthetic.generate_stream(2.0, rates=rates, ascii_records=False))
+    text.write_bytes(span6_synthetic.generate_stream(2.0, rates=rates, headers=ascii_headers, ascii_records=False))
+    assert span6_batch.convert_capture(binary, tmp_path / "binary.tss1")[:2] == (400, 0)
+    assert span6_ascii.convert_ascii_capture(text, tmp_path / "ascii.tss1", block_size)[:2] == (400, 0)
+    assert (tmp_path / "ascii.tss1").read_bytes() == (tmp_path / "binary.tss1").read_bytes()
+
+
+def test_block_decoder_drops_logs_with_the_other_sync():
+    # SYNCHEAVE is registered with a LONG header, a '%' log of it is refused like by the framer
+    short_log = ascii_log(b"%SYNCHEAVEA,2200,302400.010", b"0.3,0.05")
+    assert span6_ascii.decode_block(short_log * 3)[1] == {}
+    capture = ascii_log(synchave_head, b"0.1,0.05") + short_log
+    _, decoded, crc_errors = span6_ascii.decode_block(capture)
+    rows, _, messages = decoded[1708]
+    assert (rows.tolist(), messages["heave"].tolist(), crc_errors) == ([0], [0.1], 0)
+    framer = rs6.Span6Framer()
+    framer.feed(capture)
+    assert [rs6.decode_span6_message(frame.data, frame.header_length, 1708).heave for frame in framer] == [0.1]
+
+
+def test_logs_that_do_not_decode_send_no_sentence(tmp_path):
+    # one sentence per decoded log, like the stream: no layout and a missing field give none
+    unknown = ascii_log(b"#BESTGNSSPOSA,COM1,0,80.0,FINESTEERING,2200,302400.000,00000000,0000,0", b"1")
+    undecodable = ascii_log(synchave_head, b"0.2")
+    capture = (ascii_log(synchave_head, b"0.1,0.05") + unknown + insatts_ascii + undecodable
+               + ascii_log(synchave_head, b"0.3,0.05"))
+    count, decoded, _ = span6_ascii.decode_block(capture)
+    assert (count, decoded[1708][0].tolist(), decoded[319][0].tolist()) == (3, [0, 2], [1])
+    source = tmp_path / "ascii.txt"
+    output = tmp_path / "ascii.tss1"
+    source.write_bytes(capture)
+    assert span6_ascii.convert_ascii_capture(source, output) == (3, 0, 0)
+    stream = span6_stream.collect(span6_stream.convert_stream(span6_stream.buffer_chunks(capture, 31)))
+    assert output.read_bytes() == stream
+    assert tss1_verify.verify_tss1(source, output, ascii_logs=True)["ok"]
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+import span6_async
+
+sentences = [b":000000 -0042F 0000  0000\r\n", b":000000 -0042F 0125 -0350\r\n", b":83C2B0 -0042F 0125 -0350\r\n"]
+
+
+class ListOutput:
+    """
+    Output collecting the sentences it is sent
+    """
+
+    def __init__(self):
+        self.sentences = []
+        self.closed = False
+
+    async def start(self, loop):
+        pass
+
+    def send(self, sentence):
+        self.sentences.append(sentence)
+
+    def close(self):
+        self.closed = True
+
+
+def known_stream(known_frames):
+    return known_frames["SYNCHEAVE"] + known_frames["INSATTS"] + known_frames["CORRIMUDATAS"]
+
+
+def test_converter_sends_a_sentence_per_frame(known_frames):
+    converter = span6_async.StreamConverter("ins1")
+    stream = known_stream(known_frames)
+    assert converter.feed(stream[:60]) == sentences[:1]
+    assert converter.feed(stream[60:]) == sentences[1:]
+    assert converter.metrics.messages == {1708: 1, 319: 1, 813: 1}
+
+
+def test_engine_routes_inputs_to_outputs(known_frames):
+    engine = span6_async.Span6Engine(read_size=32)
+    ends = []
+    for name in ("ins1", "ins2"):
+        read_end, write_end = os.pipe()
+        engine.add_input(name, read_end)
+        ends.append((read_end, write_end))
+    first, both = engine.add_output("first", ListOutput()), engine.add_output("both", ListOutput())
+    engine.route("ins1", "first", "both")
+    engine.route("ins2", "both")
+    stream = known_stream(known_frames)
+    for _, write_end in ends:
+        os.write(write_end, stream)
+        os.close(write_end)
+    try:
+        asyncio.run(asyncio.wait_for(engine.run(), 5.0))
+    finally:
+        for read_end, _ in ends:
+            os.close(read_end)
+    assert engine.closed_inputs == {"ins1", "ins2"}
+    assert first.sentences == sentences
+    assert sorted(both.sentences) == sorted(sentences * 2)
+    assert first.closed and both.closed
+
+
+def test_serial_output_keeps_only_the_newest_waiting_sentence():
+    read_end, write_end = os.pipe()
+    output = span6_async.SerialOutput(write_end)
+
+    async def send_while_full():
+        await output.start(asyncio.get_running_loop())
+        # fill the pipe so the first sentence is only partly written
+        while True:
+            try:
+                os.write(write_end, b"x" * 4096)
+            except BlockingIOError:
+                break
+        for sentence in sentences:
+            output.send(sentence)
+        drained = 0
+        while drained < 1 << 20 and (output._pending or output._next is not None):
+            drained += len(os.read(read_end, 1 << 16))
+            await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(asyncio.wait_for(send_while_full(), 5.0))
+    finally:
+        output.close()
+        os.close(read_end)
+        os.close(write_end)
+    assert (output.sent, output.skipped) == (2, 1)
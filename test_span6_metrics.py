@@ -0,0 +1,100 @@
+import json
+
+import serial
+
+import span6_metrics
+import span6_to_tss1 as rs6
+
+
+class QueuePort:
+    """
+    TX port whose output buffer holds the given byte counts before successive writes
+    """
+
+    def __init__(self, queued, accept=None):
+        self.queued = list(queued)
+        self.accept = accept  # bytes taken per write, all by default
+        self.writes = 0
+
+    @property
+    def out_waiting(self):
+        return self.queued[min(self.writes, len(self.queued) - 1)]
+
+    def write(self, data):
+        self.writes += 1
+        return len(data) if self.accept is None else min(self.accept, len(data))
+
+
+class TimeoutPort:
+    def write(self, data):
+        raise serial.SerialTimeoutException("Write timeout")
+
+
+def test_histogram_buckets_and_percentiles():
+    histogram = span6_metrics.Histogram()
+    for ns in [100, 100, 100, 5000]:
+        histogram.record(ns)
+    assert histogram.count == 4
+    assert histogram.buckets[7] == 3  # [64, 128)
+    assert histogram.buckets[13] == 1  # [4096, 8192)
+    assert histogram.percentile(50) == 128
+    assert histogram.percentile(100) == 5000
+    assert histogram.mean_ns == 1325
+
+
+def test_write_counts_bytes_and_sentences():
+    metrics = span6_metrics.ConverterMetrics()
+    metrics.write(QueuePort([0]), b"x" * rs6.tss1_size)
+    assert (metrics.tx_bytes, metrics.tx_sentences, metrics.tx_overruns) == (rs6.tss1_size, 1, 0)
+    assert metrics.timers["write"].count == 1
+
+
+def test_short_write_and_timeout_are_overruns():
+    metrics = span6_metrics.ConverterMetrics()
+    metrics.write(QueuePort([0], accept=10), b"x" * rs6.tss1_size)
+    metrics.write(TimeoutPort(), b"x" * rs6.tss1_size)
+    assert metrics.tx_overruns == 2
+    assert metrics.tx_bytes == 10
+
+
+def test_growing_output_buffer_is_an_overrun():
+    # a line at capacity leaves part of a sentence queued, one falling behind keeps growing
+    metrics = span6_metrics.ConverterMetrics()
+    port = QueuePort([0, 12, 0, 12, 40, 67, 67, 30])
+    for _ in range(8):
+        metrics.write(port, b"x" * rs6.tss1_size)
+    assert metrics.tx_overruns == 2
+
+
+def test_port_without_out_waiting():
+    class PlainPort:
+        def write(self, data):
+            return None
+
+    metrics = span6_metrics.ConverterMetrics()
+    metrics.write(PlainPort(), b"x" * rs6.tss1_size)
+    assert (metrics.tx_bytes, metrics.tx_overruns) == (rs6.tss1_size, 0)
+
+
+def test_stats_file_and_summary(tmp_path):
+    framer = rs6.Span6Framer()
+    metrics = span6_metrics.ConverterMetrics(framer)
+    metrics.messages[813] += 2
+    metrics.rx_bytes = 152
+    lines = []
+    reporter = span6_metrics.MetricsReporter(metrics, interval=0.0, stats_path=str(tmp_path / "stats.json"),
+                                             output=lines.append)
+    assert reporter.poll()
+    stats = json.loads((tmp_path / "stats.json").read_text())
+    assert stats["rx_bytes"] == 152
+    assert stats["messages"] == {"813": 2}
+    assert not (tmp_path / "stats.json.tmp").exists()
+    assert lines[0].startswith("rx 152 B, tx 0 TSS1 (0 overruns")
+
+
+def test_first_write_sets_first_tx_event():
+    metrics = span6_metrics.ConverterMetrics()
+    assert not metrics.first_tx_written.is_set()
+    metrics.write(QueuePort([0]), b"x" * rs6.tss1_size)
+    assert metrics.first_tx_written.wait(0)
+    assert metrics.first_tx is not None
@@ -0,0 +1,54 @@
+import numpy as np
+
+import span6_batch
+import span6_parallel
+
+
+def write_capture(path, known_frames, cycles=40):
+    # frames of every kind with garbage and an INS_UPDATE record between cycles
+    cycle = (known_frames["SYNCHEAVE"] + known_frames["INSATTS"] + b"\x00\x17"
+             + known_frames["CORRIMUDATAS"] + b"<INSUPDATE 0 0 0\r\n")
+    path.write_bytes(cycle * cycles)
+    return path
+
+
+def test_index_window_matches_slice(tmp_path, known_frames):
+    data = write_capture(tmp_path / "capture.bin", known_frames).read_bytes()
+    start, end = 61, 700
+    window, window_errors = span6_batch.index_frames(data, start, end)
+    piece, piece_errors = span6_batch.index_frames(data[start:end])
+    assert np.array_equal(window, piece)
+    assert window_errors == piece_errors
+
+
+def test_parallel_matches_serial(tmp_path, known_frames):
+    capture = write_capture(tmp_path / "capture.bin", known_frames)
+    serial_result = span6_batch.convert_capture(str(capture), str(tmp_path / "serial.tss1"))
+    # pieces of about 500 bytes start with every kind of frame and depend on the values before them
+    pieces = span6_parallel.split_capture(str(capture), chunk_size=500)
+    assert len(pieces) > 10
+    results = span6_parallel.convert_files([(str(capture), str(tmp_path / "parallel.tss1"))], workers=2,
+                                           chunk_size=500)
+    assert results[str(capture)] == serial_result
+    assert (tmp_path / "parallel.tss1").read_bytes() == (tmp_path / "serial.tss1").read_bytes()
+    assert serial_result[0] == 3 * 40
+
+
+def test_pieces_start_on_frames(tmp_path, known_frames):
+    capture = write_capture(tmp_path / "capture.bin", known_frames)
+    data = capture.read_bytes()
+    for _, start, end in span6_parallel.split_capture(str(capture), chunk_size=300):
+        assert start == 0 or data[start:start + 2] == b"\xaa\x44"
+    assert end == len(data)
+
+
+def test_directory_jobs(tmp_path, known_frames):
+    (tmp_path / "in").mkdir()
+    write_capture(tmp_path / "in" / "b.bin", known_frames, cycles=2)
+    (tmp_path / "in" / "a.bin").write_bytes(b"")
+    jobs = span6_parallel.collect_jobs(str(tmp_path / "in"), str(tmp_path / "out"))
+    assert [output for _, output in jobs] == [str(tmp_path / "out" / "a.tss1"), str(tmp_path / "out" / "b.tss1")]
+    results = span6_parallel.convert_files(jobs, workers=1)
+    assert results[str(tmp_path / "in" / "a.bin")] == (0, 0, 0)
+    assert results[str(tmp_path / "in" / "b.bin")][0] == 6
+    assert (tmp_path / "out" / "a.tss1").read_bytes() == b""
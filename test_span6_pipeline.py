@@ -0,0 +1,174 @@
+import threading
+import time
+
+import pytest
+
+import span6_pipeline
+import span6_to_tss1 as rs6
+
+
+class ChunkPort:
+    """
+    RX port returning the given chunks, then nothing within its timeout like an idle serial port.
+    With repeat it returns the chunks forever
+    """
+
+    def __init__(self, chunks, timeout=0.005, repeat=False):
+        self.chunks = list(chunks)
+        self.timeout = timeout
+        self.repeat = repeat
+        self.position = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[self.position]) if self.position < len(self.chunks) else 0
+
+    def read(self, size=1):
+        if self.position >= len(self.chunks):
+            time.sleep(self.timeout)
+            return b""
+        chunk = self.chunks[self.position]
+        self.position += 1
+        if self.repeat:
+            self.position %= len(self.chunks)
+        return chunk
+
+
+class CapturePort:
+    """
+    TX port collecting what is written
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            self.data += data
+        return len(data)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.002)
+    return True
+
+
+##############################
+###  ConverterPipeline
+##############################
+
+def test_pipeline_sends_newest_state(known_frames):
+    rx = ChunkPort([known_frames["SYNCHEAVE"] + known_frames["INSATTS"], known_frames["CORRIMUDATAS"]])
+    tx = CapturePort()
+    with span6_pipeline.ConverterPipeline(rx, tx) as pipeline:
+        assert wait_for(lambda: pipeline.sentences_sent + pipeline.sentences_skipped == 3)
+    assert pipeline.error is None
+    assert not pipeline.is_running()
+    # heave -0.42 m, roll 1.25 and pitch -3.5 deg, hor_accel 5.0 and vert_accel -9.81 m/s^2
+    assert bytes(tx.data[-rs6.tss1_size:]) == b":83C2B0 -0042F 0125 -0350\r\n"
+    assert pipeline.metrics.messages == {1708: 1, 319: 1, 813: 1}
+
+
+def test_pipeline_message_ids_filter_sentences(known_frames):
+    rx = ChunkPort([known_frames["SYNCHEAVE"], known_frames["INSATTS"]])
+    tx = CapturePort()
+    with span6_pipeline.ConverterPipeline(rx, tx, message_ids=[1708]) as pipeline:
+        assert wait_for(lambda: pipeline.metrics.messages[319] == 1 and pipeline.sentences_sent == 1)
+        time.sleep(0.02)
+    assert bytes(tx.data) == b":000000 -0042F 0000  0000\r\n"
+
+
+def test_pipeline_stops_when_decoder_dies(known_frames):
+    rx = ChunkPort([known_frames["SYNCHEAVE"]], repeat=True)
+    pipeline = span6_pipeline.ConverterPipeline(rx, CapturePort(), rx_queue_size=1)
+
+    def broken_feed(chunk):
+        raise ValueError("decoder failure")
+
+    pipeline.framer.feed = broken_feed
+    pipeline.start()
+    assert wait_for(lambda: pipeline.error is not None)
+    pipeline.stop(timeout=2.0)
+    assert not pipeline.is_running()
+    assert isinstance(pipeline.error, ValueError)
+
+
+##############################
+###  Tss1Scheduler
+##############################
+
+def test_scheduler_send_encodes_state():
+    tx = CapturePort()
+    states = [None, (time.monotonic_ns(), dict(hor_accel=1.0, vert_accel=-9.81, heave=-0.42, roll=1.25, pitch=-3.5)),
+              (time.monotonic_ns(), dict(hor_accel=1.0, vert_accel=0.0, heave=500.0, roll=0.0, pitch=0.0))]
+    scheduler = span6_pipeline.Tss1Scheduler(tx, 10, lambda now_ns: states.pop(0))
+    for _ in range(3):
+        scheduler.send(time.monotonic_ns())
+    assert bytes(tx.data) == b":1AC2B0 -0042F 0125 -0350\r\n"
+    assert (scheduler.sent, scheduler.no_state, scheduler.range_errors) == (1, 1, 1)
+
+
+def test_scheduler_keeps_its_rate():
+    tx = CapturePort()
+    state = (time.monotonic_ns(), dict(hor_accel=0.0, vert_accel=0.0, heave=0.0, roll=0.0, pitch=0.0))
+    scheduler = span6_pipeline.Tss1Scheduler(tx, 100, lambda now_ns: state)
+    stop = threading.Event()
+    thread = threading.Thread(target=scheduler.run, args=(stop,))
+    start = time.monotonic()
+    thread.start()
+    time.sleep(0.3)
+    stop.set()
+    thread.join()
+    elapsed = time.monotonic() - start
+    # one sentence per deadline passed, missed deadlines are skipped rather than sent late
+    assert scheduler.sent + scheduler.missed_deadlines == pytest.approx(elapsed * 100, abs=3)
+    assert len(tx.data) == scheduler.sent * rs6.tss1_size
+
+
+@pytest.mark.parametrize("rate, baud", [(0, None), (-1, None), (50, 9600)])
+def test_scheduler_rejects_rates(rate, baud):
+    # 9600 baud carries 35.6 sentences per second
+    with pytest.raises(RuntimeError):
+        span6_pipeline.Tss1Scheduler(CapturePort(), rate, lambda now_ns: None, baud=baud)
+
+
+##############################
+###  Tss1Writer
+##############################
+
+def test_writer_keeps_only_the_newest_sentence():
+    tx = CapturePort()
+    writer = span6_pipeline.Tss1Writer(tx, baud=9600, headroom=1.0)
+    interval = rs6.tss1_size * 10 / 9600
+    assert writer.write(b"a" * rs6.tss1_size, now=100.0)
+    assert not writer.write(b"b" * rs6.tss1_size, now=100.0)
+    assert not writer.write(b"c" * rs6.tss1_size, now=100.0 + interval / 2)
+    assert not writer.poll(now=100.0 + interval * 0.9)
+    assert writer.poll(now=100.0 + interval)
+    assert bytes(tx.data) == b"a" * rs6.tss1_size + b"c" * rs6.tss1_size
+    assert (writer.offered, writer.sent, writer.decimated) == (3, 2, 1)
+
+
+def test_writer_waits_for_the_output_buffer():
+    class BusyPort(CapturePort):
+        out_waiting = 200
+
+    writer = span6_pipeline.Tss1Writer(BusyPort(), baud=115200)
+    assert writer.delay(now=0.0) == pytest.approx((200 - rs6.tss1_size) * 10 / 115200)
+    assert writer.backpressure == 1
+
+
+def test_writer_take_newest():
+    tx = CapturePort()
+    writer = span6_pipeline.Tss1Writer(tx, baud=115200)
+    assert writer.take_newest("first", lambda: "unused") == ("first", None)
+    writer.send(b"x" * rs6.tss1_size)
+    # the line is busy now: what arrives during the wait replaces the item
+    assert writer.take_newest("second", lambda: "third") == ("third", "second")
+    assert writer.take_newest("fourth", lambda: None) == ("fourth", None)
+    assert (writer.offered, writer.decimated) == (4, 1)
@@ -0,0 +1,118 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import span6_service
+from test_span6_pipeline import CapturePort, ChunkPort, wait_for
+
+
+class ClosingPort(ChunkPort):
+    def close(self):
+        self.closed = True
+
+
+class ClosingCapturePort(CapturePort):
+    def close(self):
+        self.closed = True
+
+
+##############################
+###  Config
+##############################
+
+def test_flags_override_config_file(tmp_path):
+    path = tmp_path / "converter.json"
+    path.write_text(json.dumps({"rx": "/dev/ttyS0", "tx": "/dev/ttyS1", "tx_baud": 19200, "messages": ["813"]}))
+    config = span6_service.load_config(path, {"tx": "/dev/ttyUSB0", "rx_baud": None})
+    assert (config["rx"], config["tx"], config["tx_baud"]) == ("/dev/ttyS0", "/dev/ttyUSB0", 19200)
+    assert config["rx_baud"] == span6_service.default_config["rx_baud"]
+    assert config["messages"] == [813]
+
+
+def test_config_rejects_unknown_keys(tmp_path):
+    path = tmp_path / "converter.json"
+    path.write_text(json.dumps({"rx": "/dev/ttyS0", "tx": "/dev/ttyS1", "txbaud": 9600}))
+    with pytest.raises(RuntimeError, match="txbaud"):
+        span6_service.load_config(path)
+
+
+@pytest.mark.parametrize("overrides", [{"rx": "/dev/ttyS0"}, {"tx": "/dev/ttyS1"},
+                                       {"rx": "/dev/ttyS0", "tx": "/dev/ttyS1", "output_format": "nmea"}])
+def test_config_needs_ports_and_a_known_format(overrides):
+    with pytest.raises(RuntimeError):
+        span6_service.load_config(None, overrides)
+
+
+def test_service_modules_do_not_import_serial():
+    code = "import sys, span6_service; print('serial' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(span6_service.__file__)))
+    assert result.stdout.strip() == "False"
+
+
+##############################
+###  Service
+##############################
+
+def test_service_reports_first_tss1(known_frames, monkeypatch):
+    rx = ClosingPort([known_frames["SYNCHEAVE"]])
+    tx = ClosingCapturePort()
+    ports = {"rx": rx, "tx": tx}
+    monkeypatch.setattr(span6_service, "open_port", lambda name, *_: ports[name])
+    lines = []
+    config = span6_service.load_config(None, {"rx": "rx", "tx": "tx", "stats_interval": 0})
+    service = span6_service.ConverterService(config, output=lines.append)
+    runner = threading.Thread(target=service.run)
+    runner.start()
+    try:
+        assert wait_for(lambda: service.first_tss1 is not None)
+    finally:
+        service.stop()
+        runner.join(2.0)
+    assert not runner.is_alive()
+    assert lines[0].startswith("first TSS1 ")
+    assert service.first_tss1 == service.pipeline.metrics.first_tx - service.started
+    assert rx.closed and tx.closed
+
+
+def test_feed_is_closed_when_pipeline_setup_fails(monkeypatch):
+    import attitude_feed
+
+    rx = ClosingPort([])
+    tx = ClosingCapturePort()
+    ports = {"rx": rx, "tx": tx}
+    monkeypatch.setattr(span6_service, "open_port", lambda name, *_: ports[name])
+
+    def broken_pipeline(*args, **kwargs):
+        raise RuntimeError("no pipeline")
+
+    monkeypatch.setattr(span6_service.span6_pipeline, "ConverterPipeline", broken_pipeline)
+    name = f"test_service_feed_{os.getpid()}"
+    config = span6_service.load_config(None, {"rx": "rx", "tx": "tx", "feed": name, "stats_interval": 0})
+    with pytest.raises(RuntimeError, match="no pipeline"):
+        span6_service.ConverterService(config, output=lambda line: None).run()
+    assert rx.closed and tx.closed
+    with pytest.raises(FileNotFoundError):
+        attitude_feed.AttitudeFeedReader(name)
+
+
+def test_rx_port_is_closed_when_stopped_while_opening_tx(monkeypatch):
+    rx = ClosingPort([])
+    service = None
+
+    def open_port(name, *_):
+        if name == "rx":
+            return rx
+        service.stop()  # the TX port never appears before the stop request
+        return None
+
+    monkeypatch.setattr(span6_service, "open_port", open_port)
+    config = span6_service.load_config(None, {"rx": "rx", "tx": "tx", "stats_interval": 0})
+    service = span6_service.ConverterService(config, output=lambda line: None)
+    service.run()
+    assert rx.closed
+    assert service.pipeline is None
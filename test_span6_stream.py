@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+import span6_batch
+import span6_stream
+import span6_to_tss1 as rs6
+from test_span6_to_tss1 import resized_frame
+
+
+def capture(known_frames, cycles=3):
+    # The known frames repeated, with a bit of garbage between cycles
+    cycle = known_frames["SYNCHEAVE"] + known_frames["INSATTS"] + known_frames["CORRIMUDATAS"]
+    return (cycle + b"\x00\x13garbage") * cycles
+
+
+def stream_states(buffer, chunk_size=37, **options):
+    return list(span6_stream.unbatch(span6_stream.attitude_states(span6_stream.decode_records(
+        span6_stream.read_frames(span6_stream.buffer_chunks(buffer, chunk_size)), **options))))
+
+
+##############################
+###  AttitudeState
+##############################
+
+class FakeRawStream:
+    """
+    RAWIMUSXB stand-in: every second frame completes a block of accelerations
+    """
+
+    message_id = 1708  # SYNCHEAVE frames play RAWIMUSXB here
+
+    def __init__(self):
+        self.frames = 0
+
+    def feed(self, frame, header_length):
+        self.frames += 1
+        return {"hor_accel": 0.5, "vert_accel": -9.8} if self.frames % 2 == 0 else None
+
+
+def test_state_follows_messages(known_frames):
+    state = span6_stream.AttitudeState(heading=True)
+    for name in ("SYNCHEAVE", "INSATTS", "CORRIMUDATAS"):
+        frame = known_frames[name]
+        header = "LONG" if name == "SYNCHEAVE" else "SHORT"
+        header_record = rs6.decode_span6_header(frame, header)
+        assert state.update(header_record, frame, rs6.header_long.size if header == "LONG" else rs6.header_short.size)
+    assert state.fields == pytest.approx(dict(hor_accel=5.0, vert_accel=-9.81, heave=-0.42, roll=1.25, pitch=-3.5,
+                                              heading=87.0))
+    assert state.ins_status == 3
+    # CORRIMUDATAS carries its own time, 302400.02 s into GPS week 2200
+    assert state.gps_time(header_record) == pytest.approx(2200 * rs6.gps_week_seconds + 302400.02)
+
+
+def test_state_ignores_other_messages(known_frames):
+    state = span6_stream.AttitudeState()
+    frame = known_frames["SYNCHEAVE"]
+    header_record = rs6.decode_span6_header(frame, "LONG")._replace(message_id=1462)
+    assert not state.update(header_record, frame, rs6.header_long.size)
+    assert not state.update_message(1462, None, None)
+    assert state.fields == dict(hor_accel=0, vert_accel=0, heave=0, roll=0, pitch=0)
+
+
+def test_raw_stream_supplies_accelerations(known_frames):
+    raw = FakeRawStream()
+    state = span6_stream.AttitudeState(raw_stream=raw)
+    frame = known_frames["SYNCHEAVE"]
+    header_record = rs6.decode_span6_header(frame, "LONG")
+    assert not state.update(header_record, frame, rs6.header_long.size)
+    assert state.update(header_record, frame, rs6.header_long.size)
+    assert (state.fields["hor_accel"], state.fields["vert_accel"]) == (0.5, -9.8)
+    assert state.gps_time(header_record) == 2200 * rs6.gps_week_seconds + 302400.0
+    # CORRIMUDATAS no longer sets the accelerations
+    corrimu = known_frames["CORRIMUDATAS"]
+    assert state.update(rs6.decode_span6_header(corrimu, "SHORT"), corrimu, rs6.header_short.size)
+    assert (state.fields["hor_accel"], state.fields["vert_accel"]) == (0.5, -9.8)
+    with pytest.raises(RuntimeError):
+        span6_stream.AttitudeState(time_aligned=True, raw_stream=raw)
+
+
+##############################
+###  Stream
+##############################
+
+@pytest.mark.parametrize("chunk_size", [1, 37, 1 << 16])
+def test_stream_matches_batch(known_frames, chunk_size):
+    buffer = capture(known_frames)
+    states = stream_states(buffer, chunk_size)
+    index, crc_errors = span6_batch.index_frames(buffer)
+    inputs = span6_batch.tss1_inputs(np.frombuffer(buffer, dtype=np.uint8), index)
+    assert crc_errors == 0
+    for name, values in inputs.items():
+        assert [state[name] for state in states] == values.tolist()
+
+
+def test_stream_sentences(known_frames):
+    chunks = span6_stream.buffer_chunks(capture(known_frames, 1))
+    assert span6_stream.collect(span6_stream.convert_stream(chunks)) == (b":000000 -0042F 0000  0000\r\n"
+                                                                         b":000000 -0042F 0125 -0350\r\n"
+                                                                         b":83C2B0 -0042F 0125 -0350\r\n")
+
+
+def test_message_ids_drop_other_frames(known_frames):
+    # like ConverterPipeline: frames of other messages give no state and no sentence
+    states = stream_states(capture(known_frames, 2), message_ids=[319])
+    assert len(states) == 2
+    assert states[-1] == dict(hor_accel=0, vert_accel=0, heave=0, roll=1.25, pitch=-3.5)
+
+
+def test_frames_of_another_length_send_unchanged_state(known_frames, tmp_path):
+    # a CRC-valid INSATTS frame 8 bytes short is not decoded, by the stream and the batch alike
+    truncated = resized_frame(known_frames["INSATTS"], "SHORT", 8)
+    state = span6_stream.AttitudeState()
+    assert not state.update(rs6.decode_span6_header(truncated, "SHORT"), truncated, rs6.header_short.size)
+    buffer = known_frames["SYNCHEAVE"] + truncated + known_frames["CORRIMUDATAS"]
+    sentences = span6_stream.collect(span6_stream.convert_stream(span6_stream.buffer_chunks(buffer)))
+    assert sentences == (b":000000 -0042F 0000  0000\r\n"
+                         b":000000 -0042F 0000  0000\r\n"
+                         b":83C2B0 -0042F 0000  0000\r\n")
+    capture = tmp_path / "capture.bin"
+    capture.write_bytes(buffer)
+    assert span6_batch.convert_capture(capture, tmp_path / "capture.tss1") == (3, 0, 0)
+    assert (tmp_path / "capture.tss1").read_bytes() == sentences
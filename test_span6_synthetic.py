@@ -0,0 +1,54 @@
+import collections
+
+import pytest
+
+import span6_synthetic
+import span6_to_tss1 as rs6
+
+
+def frame_counts(stream, chunks=None):
+    framer = rs6.Span6Framer(capacity=1 << 16)
+    counts = collections.Counter()
+    for chunk in chunks or [stream]:
+        framer.feed(chunk)
+        for frame in framer:
+            counts[frame.header if frame.header == "INS_UPDATE" else frame.header_record.message_id] += 1
+    return counts, framer
+
+
+def test_stream_has_every_frame_at_its_rate():
+    stream = span6_synthetic.generate_stream(2.0)
+    counts, framer = frame_counts(stream, span6_synthetic.split_chunks(stream))
+    assert counts == {1465: 100, 1708: 100, 813: 200, 1462: 400, "INS_UPDATE": 2}
+    assert (framer.crc_errors, framer.skipped_bytes) == (0, 0)
+
+
+def test_garbage_costs_no_frames():
+    stream = span6_synthetic.generate_stream(1.0, garbage_probability=0.2, seed=4)
+    counts, framer = frame_counts(stream)
+    assert counts == {1465: 50, 1708: 50, 813: 100, 1462: 200, "INS_UPDATE": 1}
+    assert framer.skipped_bytes > 0
+
+
+def test_messages_follow_the_motion():
+    time = 0.25
+    body = span6_synthetic.make_message(1465, time)
+    frame = span6_synthetic.make_frame("LONG", 1465, body, ms=302400250)
+    message = rs6.decode_span6_message(frame, rs6.header_long.size, 1465)
+    motion = span6_synthetic.motion(time)
+    assert (message.roll, message.pitch) == (motion["roll"], motion["pitch"])
+    assert rs6.check_span6_crc(frame, 0, len(frame))
+
+
+@pytest.mark.parametrize("header", ["ASCII", "SHORT_ASCII"])
+def test_ascii_logs_decode_like_binary(header):
+    message_id = 508 if header == "SHORT_ASCII" else 1465
+    body = span6_synthetic.make_message(message_id, 0.5)
+    log = span6_synthetic.make_ascii_log(header, message_id, body, ms=302400500)
+    framer = rs6.Span6Framer()
+    framer.feed(log)
+    frames = list(framer)
+    assert len(frames) == 1
+    decoded = rs6.decode_span6_message(frames[0].data, frames[0].header_length, message_id)
+    expected = rs6.messages_by_id[message_id].unpack_from(body + bytes(4))
+    assert decoded[:-1] == pytest.approx(expected[:-1])
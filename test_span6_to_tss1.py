@@ -0,0 +1,312 @@
+import zlib
+
+import numpy as np
+import pytest
+
+import span6_batch
+import span6_to_tss1 as rs6
+
+
+def message_record(message_id, **values):
+    # Decoded message record with the given fields, the others zero
+    block = rs6.messages_by_id[message_id]
+    return block.record_type(**{name: values.get(name, 0) for name in block.record_type._fields})
+
+
+def short_frame(long_frame):
+    # The message of a LONG frame re-sent with a SHORT header
+    header = rs6.decode_span6_header(long_frame, "LONG")
+    block = rs6.messages_by_id[header.message_id]
+    message = rs6.decode_span6_message(long_frame, rs6.header_long.size, header.message_id)
+    short_header = rs6.header_short.record_type(rs6.short_start[:1], rs6.short_start[1:2], rs6.short_start[2:],
+                                                block.size - 4, header.message_id, header.week, header.ms)
+    return rs6.encode_binary_frame(short_header, header.message_id, message)
+
+
+def resized_frame(frame, header, cut):
+    # The frame with cut bytes less message, its header length field and CRC to match
+    header_block = rs6.header_long if header == "LONG" else rs6.header_short
+    header_record = rs6.decode_span6_header(frame, header)
+    resized = bytearray(header_block._struct.pack(*header_record._replace(message_length=header_record.message_length - cut))
+                        + frame[header_block.size:len(frame) - 4 - cut] + bytes(4))
+    resized[-4:] = rs6.span6_crc32(resized, 0, len(resized) - 4).to_bytes(4, "little")
+    return bytes(resized)
+
+
+##############################
+###  Record decoders
+##############################
+
+def test_padding_elements_have_one_name():
+    block = rs6.DataBlock((rs6.elemD_("status", rs6.elemT.u8), (None, (rs6.elemT.u8, 3)),
+                           rs6.elemD_("value", rs6.elemT.f32)), name="Padded")
+    assert block.record_type._fields == ("status", "reserved1", "value")
+    assert block.dtype.names == block.record_type._fields
+
+
+def test_message_decoder_reads_in_place(known_frames):
+    frame = known_frames["SYNCHEAVE"]
+    message = rs6.decode_span6_message(memoryview(frame), rs6.header_long.size, 1708)
+    assert (message.heave, message.heave_std) == (-0.42, 0.05)
+    assert message._asdict() == rs6.read_span6_message(frame, rs6.header_long.size, 1708)
+    assert rs6.decode_span6_message(frame, rs6.header_long.size, 9999) is None
+
+
+def test_message_of_another_length_is_not_decoded(known_frames):
+    frame = known_frames["SYNCHEAVE"]
+    truncated = resized_frame(frame, "LONG", 4)
+    assert rs6.check_span6_crc(truncated, 0, len(truncated))
+    assert rs6.decode_span6_message(truncated, rs6.header_long.size, 1708) is None
+    assert rs6.decode_span6_message(frame + b"\xaa\x44", rs6.header_long.size, 1708) is None
+    assert rs6.decode_span6_message(frame + b"\xaa\x44", rs6.header_long.size, 1708, len(frame)).heave == -0.42
+
+
+def test_header_decoder(known_frames):
+    header = rs6.decode_span6_header(known_frames["INSATTS"], "SHORT")
+    assert (header.message_id, header.message_length, header.week_number, header.msec_from_week) == (319, 40, 2200, 302400010)
+    assert header._asdict() == rs6.read_span6_header(known_frames["INSATTS"], "SHORT", 0)[0]
+
+
+def test_record_array_matches_record(known_frames):
+    frame = known_frames["CORRIMUDATAS"]
+    block = rs6.messages_by_id[813]
+    array = np.frombuffer(frame, dtype=block.dtype, count=1, offset=rs6.header_short.size)
+    record = rs6.decode_span6_message(frame, rs6.header_short.size, 813)
+    assert array.dtype.names == record._fields
+    assert array[0].tolist() == tuple(record)
+
+
+def test_layout_dtype_is_built_once():
+    block = rs6.messages_by_id[1462]
+    assert block.dtype is block.dtype
+    assert block.dtype.itemsize == block.size
+    assert span6_batch._block_view(np.zeros(0, np.uint8), np.zeros(0, np.int64), block).dtype is block.dtype
+
+
+@pytest.fixture
+def layout_registry(monkeypatch):
+    # Layouts registered by a test are gone after it
+    for name in ("messages_dict", "messages_by_id", "message_headers", "message_decoders", "message_time_fields",
+                 "ascii_message_ids", "ascii_message_names", "ascii_log_ids", "ascii_field_parsers"):
+        monkeypatch.setattr(rs6, name, dict(getattr(rs6, name)))
+
+
+def test_registered_layout_is_framed_and_decoded(layout_registry):
+    message_ids = rs6.register_layouts("""
+    # a user log
+    TESTLOG     4242    SHORT   ascii
+        week        u32
+        seconds     f64
+        value       f32
+        flags       c8[3]   # one bytes value
+        count       u8
+        CRC         u32
+    """)
+    assert message_ids == [4242]
+    block = rs6.messages_by_id[4242]
+    assert block.record_type._fields == ("week", "seconds", "value", "flags", "count", "CRC")
+    assert (rs6.message_headers[4242], rs6.ascii_log_ids[b"TESTLOGA"]) == ("SHORT", 4242)
+
+    header = rs6.header_short.record_type(rs6.short_start[:1], rs6.short_start[1:2], rs6.short_start[2:],
+                                          block.size - 4, 4242, 2200, 302400500)
+    message = block.record_type(2200, 302400.5, 1.5, b"abc", 7, 0)
+    framer = rs6.Span6Framer()
+    framer.feed(rs6.encode_binary_frame(header, 4242, message))
+    frame, = list(framer)
+    decoded = rs6.decode_span6_message(frame.data, frame.header_length, 4242)
+    assert (decoded.week, decoded.seconds, decoded.value, decoded.flags, decoded.count) == (2200, 302400.5, 1.5, b"abc", 7)
+    assert rs6.message_gps_time(4242, decoded, frame.header_record) == 2200 * rs6.gps_week_seconds + 302400.5
+
+
+def test_layout_spec_errors(layout_registry):
+    with pytest.raises(RuntimeError, match="line 1"):
+        rs6.parse_layout_spec("    week u32")
+    with pytest.raises(RuntimeError, match="line 3"):
+        rs6.parse_layout_spec("TESTLOG 4242 SHORT\n    week u32\n    value float\n")
+    with pytest.raises(RuntimeError, match="line 2"):
+        rs6.parse_layout_spec("TESTLOG 4242 SHORT\n    flags u8[3]\n")
+
+
+def test_framer_drops_log_with_other_header(known_frames):
+    framer = rs6.Span6Framer()
+    framer.feed(short_frame(known_frames["SYNCHEAVE"]) + known_frames["SYNCHEAVE"])
+    frames = list(framer)
+    assert [(frame.header, frame.header_record.message_id) for frame in frames] == [("LONG", 1708)]
+    assert (framer.header_mismatches, framer.crc_errors) == (1, 0)
+
+
+def test_batch_decoder_drops_log_with_other_header(known_frames):
+    buffer = known_frames["SYNCHEAVE"] + short_frame(known_frames["SYNCHEAVE"])
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    index, crc_errors = span6_batch.index_frames(buffer)
+    rows, messages = span6_batch.decode_messages(data, index, 1708)
+    assert (len(index), crc_errors, rows.tolist()) == (1, 0, [0])
+    assert messages["heave"].tolist() == [-0.42]
+
+
+##############################
+###  SPAN6 -> TSS1 values
+##############################
+
+@pytest.mark.parametrize("message_id", [1465, 1457, 319, 508])  # INSPVAX, INSATTX, INSATTS, INSPVAS
+def test_attitude_logs_give_roll_and_pitch(message_id):
+    message = message_record(message_id, roll=1.25, pitch=-3.5, north_vel=4.0, east_vel=3.0, up_vel=0.2)
+    assert rs6.tss1_fields(message_id, message) == {"roll": 1.25, "pitch": -3.5}
+
+
+def test_corrimudatas_gives_accelerations_per_second():
+    # increments per 100 Hz IMU sample: 0.03 and 0.04 m/s horizontal, -0.0981 m/s vertical
+    message = message_record(813, lateral_acc=0.03, longitudinal_acc=0.04, vertical_acc=-0.0981,
+                             roll_rate=0.5, pitch_rate=0.7)
+    fields = rs6.tss1_fields(813, message)
+    assert fields.keys() == {"hor_accel", "vert_accel"}
+    assert fields["hor_accel"] == pytest.approx(5.0)
+    assert fields["vert_accel"] == pytest.approx(-9.81)
+
+
+@pytest.mark.parametrize("message_id", [1708, 1382])  # SYNCHEAVE, HEAVE
+def test_heave_logs_give_heave(message_id):
+    assert rs6.tss1_fields(message_id, message_record(message_id, heave=-0.42)) == {"heave": -0.42}
+
+
+def test_other_logs_give_nothing():
+    assert rs6.tss1_fields(1462, message_record(1462)) == {}
+    assert 1462 not in rs6.tss1_message_ids
+
+
+##############################
+###  TSS1
+##############################
+
+def test_tss1_sentence_bytes():
+    sentence = rs6.create_tss1(hor_accel=1.0, vert_accel=-9.81, heave=-0.42, roll=1.25, pitch=-3.5)
+    assert sentence == ":1AC2B0 -0042F 0125 -0350\r\n"
+    assert len(sentence) == rs6.tss1_size
+
+
+def test_tss1_vertical_accel_is_most_significant_first():
+    # data/test.txt holds ':062089 -7455F-6015 -7916', sent by the old little-endian packing:
+    # -19.02 m/s^2 is 0x8920, TSS1 writes it as 8920
+    sentence = rs6.create_tss1(hor_accel=6 * 0.0383, vert_accel=-19.02, heave=-74.55, roll=-60.15, pitch=-79.16)
+    assert sentence == ":068920 -7455F-6015 -7916\r\n"
+
+
+def test_tss1_status_flag_and_zero():
+    assert rs6.create_tss1(0, 0, 0, 0, 0, status_f="H") == ":000000  0000H 0000  0000\r\n"
+
+
+def test_tss1_top_of_hor_accel_saturates():
+    assert rs6.create_tss1(9.81, 20.47, 99.99, 99.99, 99.99) == ":FF7FF0  9999F 9999  9999\r\n"
+
+
+@pytest.mark.parametrize("name", ["hor_accel", "vert_accel", "heave", "roll", "pitch"])
+def test_tss1_out_of_range_raises(name):
+    fields = dict(hor_accel=1.0, vert_accel=0.0, heave=0.0, roll=0.0, pitch=0.0)
+    fields[name] = -150.0
+    with pytest.raises(RuntimeError):
+        rs6.create_tss1(**fields)
+
+
+##############################
+###  Framer
+##############################
+
+def test_framer_keeps_partial_frames(known_frames):
+    stream = known_frames["SYNCHEAVE"] + known_frames["INSATTS"]
+    framer = rs6.Span6Framer()
+    completed = []
+    for position in range(len(stream)):
+        framer.feed(stream[position:position + 1])
+        completed.extend((position + 1, frame.data) for frame in framer)
+    assert completed == [(len(known_frames["SYNCHEAVE"]), known_frames["SYNCHEAVE"]),
+                         (len(stream), known_frames["INSATTS"])]
+    assert (framer.skipped_bytes, framer.crc_errors, len(framer)) == (0, 0, 0)
+
+
+def test_framer_resyncs_after_garbage_and_bad_frames(known_frames):
+    corrupted = bytearray(known_frames["INSATTS"])
+    corrupted[20] ^= 0xFF
+    false_sync = b"\xaa\x44\x12\x05"  # a LONG sync with a wrong header length
+    stream = b"noise" + false_sync + bytes(corrupted) + known_frames["CORRIMUDATAS"] + b"\x00" + known_frames["SYNCHEAVE"]
+    framer = rs6.Span6Framer()
+    framer.feed(stream)
+    assert [frame.data for frame in framer] == [known_frames["CORRIMUDATAS"], known_frames["SYNCHEAVE"]]
+    assert framer.crc_errors == 1
+    # everything but the two good frames was skipped, the corrupted frame one byte at a time
+    assert framer.skipped_bytes == len(stream) - len(known_frames["CORRIMUDATAS"]) - len(known_frames["SYNCHEAVE"])
+
+
+def test_framer_emits_ins_update_records(known_frames):
+    record = b"<INSUPDATE INS_SOLUTION_GOOD 12\r\n"
+    framer = rs6.Span6Framer()
+    framer.feed(record)
+    assert list(framer) == []  # the record may still go on
+    framer.feed(known_frames["SYNCHEAVE"])
+    frames = list(framer)
+    assert [(frame.header, frame.data) for frame in frames] == [("INS_UPDATE", record),
+                                                                ("LONG", known_frames["SYNCHEAVE"])]
+    assert frames[0].header_record is None
+
+
+def test_framer_buffer_is_bounded(known_frames):
+    frame = known_frames["INSATTS"]
+    framer = rs6.Span6Framer(capacity=4 * len(frame))
+    framer.feed(frame[:10])
+    framer.feed(frame * 6)
+    # the oldest bytes make room for the newest: the newest four frames are kept whole
+    assert framer.dropped_bytes == 10 + 2 * len(frame)
+    assert [item.data for item in framer] == [frame] * 4
+
+
+##############################
+###  CRC-32
+##############################
+
+def novatel_crc32(data):
+    # Reference: NovAtel's CRC is zlib's without the initial and final inversion
+    return zlib.crc32(data, 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+
+@pytest.mark.parametrize("data", [b"", b"\x00", b"123456789", bytes(range(256)) * 3])
+def test_crc_matches_reference(data):
+    assert rs6.calculate_block_crc32(data) == novatel_crc32(data)
+    assert rs6.span6_crc32(data) == novatel_crc32(data)
+
+
+def test_crc_of_known_frames(known_frames):
+    for frame in known_frames.values():
+        assert rs6.span6_crc32(frame, 0, len(frame) - 4) == int.from_bytes(frame[-4:], "little")
+        assert rs6.check_span6_crc(b"xx" + frame, 2, len(frame))
+
+
+def test_crc_detects_flipped_bits(known_frames):
+    frame = bytearray(known_frames["SYNCHEAVE"])
+    for position in (0, 20, len(frame) - 1):
+        frame[position] ^= 0x01
+        assert not rs6.check_span6_crc(frame, 0, len(frame))
+        frame[position] ^= 0x01
+
+
+##############################
+###  Sync search
+##############################
+
+def test_find_header_skips_other_sync_bytes(known_frames):
+    buffer = b"\xaa\x44\x99\xaa" + known_frames["INSATTS"]
+    assert rs6.find_header(buffer) == ("SHORT", 4)
+    assert rs6.find_header(b"x<INS" + buffer) == ("INS_UPDATE", 1)
+    assert rs6.find_header(buffer, 5) == ("OVER", len(buffer) - 2)
+    assert rs6.find_header(b"xx\xaa\x44") == ("OVER", 2)  # the sync may go on in the next chunk
+
+
+def test_find_headers_and_split_frames(known_frames):
+    buffer = known_frames["SYNCHEAVE"] + b"<INSUPDATE 1\r\n" + known_frames["INSATTS"] + known_frames["CORRIMUDATAS"][:20]
+    long_size, short_size = len(known_frames["SYNCHEAVE"]), len(known_frames["INSATTS"])
+    ascii_offset = long_size
+    short_offset = ascii_offset + 14
+    partial_offset = short_offset + short_size
+    assert rs6.find_headers(buffer) == [("LONG", 0), ("INS_UPDATE", ascii_offset), ("SHORT", short_offset),
+                                        ("SHORT", partial_offset)]
+    frames, rest = rs6.split_span6_frames(buffer)
+    assert frames == [("LONG", 0, long_size), ("INS_UPDATE", ascii_offset, 14), ("SHORT", short_offset, short_size)]
+    assert rest == partial_offset
@@ -0,0 +1,45 @@
+import numpy as np
+
+import span6_to_tss1 as rs6
+import tss1_batch
+
+
+def sample_inputs():
+    # in-range values on and between LSB steps, both signs, and the top of every range
+    return {
+        "hor_accel": np.array([0.0, 1.0, 0.0383 * 100.5, 9.81, 4.2]),
+        "vert_accel": np.array([0.0, -9.81, 0.000625 * 7.5, 20.47, -20.48]),
+        "heave": np.array([0.0, -0.42, 0.005, 99.99, -99.99]),
+        "roll": np.array([0.0, 1.25, -0.004, -99.99, 12.345]),
+        "pitch": np.array([0.0, -3.5, 45.0, 99.99, -0.015]),
+    }
+
+
+def test_batch_encoder_matches_create_tss1():
+    inputs = sample_inputs()
+    records, in_range = tss1_batch.encode_tss1_batch(**inputs)
+    assert in_range.all()
+    for row in range(len(in_range)):
+        expected = rs6.create_tss1(**{name: float(values[row]) for name, values in inputs.items()})
+        assert records[row].tobytes() == expected.encode()
+
+
+def test_batch_encoder_known_record():
+    records, _ = tss1_batch.encode_tss1_batch(
+        np.array([1.0]), np.array([-9.81]), np.array([-0.42]), np.array([1.25]), np.array([-3.5]))
+    assert records.tobytes() == b":1AC2B0 -0042F 0125 -0350\r\n"
+
+
+def test_batch_encoder_flags_out_of_range():
+    inputs = sample_inputs()
+    inputs["heave"][1] = 150.0
+    inputs["roll"][2] = np.nan
+    _, in_range = tss1_batch.encode_tss1_batch(**inputs)
+    assert in_range.tolist() == [True, False, False, True, True]
+
+
+def test_batch_encoder_writes_into_buffer():
+    out = bytearray(2 * rs6.tss1_size)
+    inputs = {name: values[:2] for name, values in sample_inputs().items()}
+    records, _ = tss1_batch.encode_tss1_batch(**inputs, out=out)
+    assert bytes(out) == records.tobytes()
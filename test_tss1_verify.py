@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+import span6_batch
+import tss1_batch
+import tss1_verify
+
+known_sentences = (b":000000 -0042F 0000  0000\r\n"
+                   b":000000 -0042F 0125 -0350\r\n"
+                   b":83C2B0 -0042F 0125 -0350\r\n")
+
+
+def write_capture(known_frames, tmp_path, cycles=2):
+    # The known frames as a source capture, converted by the offline converter
+    source = tmp_path / "capture.bin"
+    output = tmp_path / "capture.tss1"
+    source.write_bytes((known_frames["SYNCHEAVE"] + known_frames["INSATTS"] + known_frames["CORRIMUDATAS"]) * cycles)
+    span6_batch.convert_capture(source, output)
+    return source, output
+
+
+##############################
+###  Decoder
+##############################
+
+def test_decode_known_sentences():
+    records, offsets, odd_offsets, odd_lengths, tail = tss1_batch.split_tss1_lines(known_sentences)
+    assert (offsets.tolist(), len(odd_offsets), tail) == ([0, 27, 54], 0, 0)
+    fields, status, valid = tss1_batch.decode_tss1_batch(records)
+    assert valid.all()
+    assert status.tolist() == [b"F"] * 3
+    assert fields["hor_accel"].tolist() == [0, 0, 0x83]
+    assert fields["vert_accel"].tolist() == [0, 0, 0xC2B0 - 0x10000]
+    assert fields["heave"].tolist() == [-42] * 3
+    assert fields["roll"].tolist() == [0, 125, 125]
+    assert fields["pitch"].tolist() == [0, -350, -350]
+
+
+def test_decode_sentence_from_data_file():
+    # data/test.txt holds ':062089 -7455F-6015 -7916' with a bare LF
+    fields, status, valid = tss1_batch.decode_tss1_batch(np.frombuffer(b":062089 -7455F-6015 -7916\r\n", dtype=np.uint8))
+    assert valid.tolist() == [True]
+    assert [fields[name][0] for name in tss1_batch.tss1_fields] == [0x06, 0x2089, -7455, -6015, -7916]
+    _, _, odd_offsets, odd_lengths, _ = tss1_batch.split_tss1_lines(b":062089 -7455F-6015 -7916\n")
+    assert (odd_offsets.tolist(), odd_lengths.tolist()) == ([0], [26])
+
+
+def test_encode_decode_round_trip():
+    rng = np.random.default_rng(20)
+    inputs = {
+        "hor_accel": rng.uniform(0, 9.81, 500),
+        "vert_accel": rng.uniform(-20.48, 20.47, 500),
+        "heave": rng.uniform(-99.99, 99.99, 500),
+        "roll": rng.uniform(-99.99, 99.99, 500),
+        "pitch": rng.uniform(-99.99, 99.99, 500),
+    }
+    records, in_range = tss1_batch.encode_tss1_batch(**inputs)
+    assert in_range.all()
+    fields, _, valid = tss1_batch.decode_tss1_batch(records)
+    assert valid.all()
+    quantized = tss1_batch.quantize_tss1(*(inputs[name] for name in tss1_batch.tss1_fields))
+    for name, expected in zip(tss1_batch.tss1_fields, quantized):
+        assert np.array_equal(fields[name], expected)
+
+
+@pytest.mark.parametrize("column, value", [(0, b";"), (2, b"G"), (9, b"x"), (13, b"Q"), (19, b"+"), (26, b"\r")])
+def test_decode_flags_malformed_columns(column, value):
+    record = bytearray(known_sentences[54:])
+    record[column:column + 1] = value
+    _, _, valid = tss1_batch.decode_tss1_batch(np.frombuffer(bytes(record), dtype=np.uint8))
+    assert valid.tolist() == [False]
+
+
+def test_split_finds_odd_lines_and_tail():
+    data = known_sentences[:27] + b":0000\r\n" + known_sentences[27:] + b":83C2"
+    records, offsets, odd_offsets, odd_lengths, tail = tss1_batch.split_tss1_lines(data)
+    assert offsets.tolist() == [0, 34, 61]
+    assert records.tobytes() == known_sentences
+    assert (odd_offsets.tolist(), odd_lengths.tolist(), tail) == ([27], [7], 5)
+
+
+##############################
+###  Verify
+##############################
+
+def test_converter_output_verifies(known_frames, tmp_path):
+    source, output = write_capture(known_frames, tmp_path)
+    report = tss1_verify.verify_tss1(source, output)
+    assert report["ok"]
+    assert (report["lines"], report["valid"], report["expected"]) == (6, 6, 6)
+    assert report["status_flags"] == {"F": 6}
+    assert report["first_bad_offset"] is None
+    assert all(field["max_error_lsb"] <= 0.5 for field in report["fields"].values())
+
+
+def test_verify_reports_corrupted_and_changed_sentences(known_frames, tmp_path):
+    source, output = write_capture(known_frames, tmp_path)
+    data = bytearray(output.read_bytes())
+    data[27 + 9] = ord("x")  # heave digit of the second sentence
+    data[2 * 27 + 15:2 * 27 + 19] = b"0126"  # roll of the third one LSB off
+    output.write_bytes(bytes(data))
+    report = tss1_verify.verify_tss1(source, output)
+    assert not report["ok"]
+    assert (report["malformed"], report["first_bad_offset"]) == (1, 27)
+    assert report["fields"]["roll"] == {"max_error_lsb": pytest.approx(1.0), "out_of_tolerance": 1}
+    assert report["fields"]["pitch"]["out_of_tolerance"] == 0
+
+
+def test_verify_lossy_output(known_frames, tmp_path):
+    source, output = write_capture(known_frames, tmp_path)
+    sentences = output.read_bytes()
+    output.write_bytes(sentences[:27] + sentences[2 * 27:])  # the second sentence was skipped
+    assert tss1_verify.verify_tss1(source, output)["count_mismatch"] == -1
+    report = tss1_verify.verify_tss1(source, output, lossy=True)
+    assert report["ok"]
+    assert (report["matched"], report["unmatched"]) == (5, 0)
+    output.write_bytes(sentences + b":7F0000  0000F 0000  0000\r\n")
+    report = tss1_verify.verify_tss1(source, output, lossy=True)
+    assert (report["matched"], report["unmatched"], report["ok"]) == (6, 1, False)
+
+
+def test_align_keeps_order(known_frames, tmp_path):
+    expected = tss1_verify.expected_inputs(write_capture(known_frames, tmp_path)[0])
+    second, third = known_sentences[27:54], known_sentences[54:]
+    records, _, _, _, _ = tss1_batch.split_tss1_lines(second + third + third + second)
+    received, _, _ = tss1_batch.decode_tss1_batch(records)
+    # every row of the second cycle holds the third sentence's values, the second one never comes back
+    assert tss1_verify.align_sentences(received, expected).tolist() == [1, 2, 3, -1]
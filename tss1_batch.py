@@ -0,0 +1,171 @@
+import numpy as np
+
+import span6_to_tss1 as rs6
+
+# Array versions of create_tss1
+
+_hex_digits = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
+# ':XXVVVV SHHHHFSRRRR SPPPP<CR><LF>'
+_template = np.frombuffer(b":000000  0000F 0000  0000\r\n", dtype=np.uint8)
+assert len(_template) == rs6.tss1_size
+
+_hor_accel_column = 1
+_vert_accel_column = 3
+_heave_column = 8
+_status_column = 13
+_roll_column = 14
+_pitch_column = 20
+
+
+def tss1_in_range(hor_accel, vert_accel, heave, roll, pitch):
+    # Same limits as create_tss1, NaN is out of range
+    with np.errstate(invalid="ignore"):
+        return ((hor_accel >= 0) & (hor_accel <= 9.81)
+                & (vert_accel >= -20.48) & (vert_accel <= 20.47)
+                & (heave >= -99.99) & (heave <= 99.99)
+                & (roll >= -99.99) & (roll <= 99.99)
+                & (pitch >= -99.99) & (pitch <= 99.99))
+
+
+def quantize_tss1(hor_accel, vert_accel, heave, roll, pitch):
+    # Integer TSS1 fields, saturated to the representable range (NaN becomes 0)
+    def rint(values, scale, low, high):
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+        return np.clip(np.rint(values * scale), low, high).astype(np.int32)
+
+    angle_scale = 1 / rs6.tss1_angle_lsb
+    return (
+        rint(np.asarray(hor_accel, dtype=np.float64) / rs6.tss1_hor_accel_lsb, 1, 0, 255),
+        rint(np.asarray(vert_accel, dtype=np.float64) / rs6.tss1_vert_accel_lsb, 1, -32768, 32767),
+        rint(heave, angle_scale, -9999, 9999),
+        rint(roll, angle_scale, -9999, 9999),
+        rint(pitch, angle_scale, -9999, 9999),
+    )
+
+
+def _put_hex(records, column, values, digits):
+    for digit in range(digits):
+        shift = 4 * (digits - 1 - digit)
+        records[:, column + digit] = _hex_digits[(values >> shift) & 0xF]
+
+
+def _put_signed(records, column, values, raw_values):
+    # create_tss1 writes '-' for any negative value, also when it rounds to zero
+    with np.errstate(invalid="ignore"):
+        records[:, column] = np.where(raw_values < 0, ord("-"), ord(" "))
+    values = np.abs(values)
+    for digit in range(4):
+        records[:, column + 4 - digit] = ord("0") + values % 10
+        values = values // 10
+
+
+def encode_tss1_batch(hor_accel, vert_accel, heave, roll, pitch, status_f="F", out=None):
+    # Encodes arrays of values into fixed-width TSS1 records.
+    # Returns a (n, 27) uint8 array (write it or call .tobytes()) and the mask of
+    # records whose input was inside the create_tss1 limits; the others are saturated.
+    # In-range records are byte-identical to create_tss1
+    hor_accel = np.asarray(hor_accel, dtype=np.float64)
+    vert_accel = np.asarray(vert_accel, dtype=np.float64)
+    heave = np.asarray(heave, dtype=np.float64)
+    roll = np.asarray(roll, dtype=np.float64)
+    pitch = np.asarray(pitch, dtype=np.float64)
+    count = len(hor_accel)
+
+    if out is None:
+        records = np.empty((count, rs6.tss1_size), dtype=np.uint8)
+    else:
+        records = np.frombuffer(out, dtype=np.uint8)[:count * rs6.tss1_size].reshape(count, rs6.tss1_size)
+    records[:] = _template
+
+    hor_q, vert_q, heave_q, roll_q, pitch_q = quantize_tss1(hor_accel, vert_accel, heave, roll, pitch)
+    _put_hex(records, _hor_accel_column, hor_q, 2)
+    _put_hex(records, _vert_accel_column, vert_q & 0xFFFF, 4)
+    _put_signed(records, _heave_column, heave_q, heave)
+    _put_signed(records, _roll_column, roll_q, roll)
+    _put_signed(records, _pitch_column, pitch_q, pitch)
+
+    if isinstance(status_f, str):
+        records[:, _status_column] = ord(status_f)
+    else:
+        records[:, _status_column] = np.asarray(status_f).view(np.uint8)
+
+    return records, tss1_in_range(hor_accel, vert_accel, heave, roll, pitch)
+
+
+##############################
+###  Decoding
+##############################
+tss1_status_flags = b"UuGgHhFf"  # unaided, GPS, heading and full aiding; lower case while settling
+
+_hex_values = np.full(256, 255, dtype=np.uint8)
+_hex_values[_hex_digits] = np.arange(16)
+_digit_values = np.full(256, 255, dtype=np.uint8)
+_digit_values[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+_valid_status = np.zeros(256, dtype=bool)
+_valid_status[np.frombuffer(tss1_status_flags, dtype=np.uint8)] = True
+_sign_values = np.zeros(256, dtype=np.int8)
+_sign_values[ord(" ")] = 1
+_sign_values[ord("-")] = -1
+
+tss1_fields = ("hor_accel", "vert_accel", "heave", "roll", "pitch")
+
+
+def split_tss1_lines(data):
+    # (n, 27) records of the well-sized lines of a TSS1 capture, their offsets in data,
+    # the offsets and lengths of the lines of any other size and the length of an unterminated tail.
+    # A capture of whole sentences only is reshaped without copying
+    data = np.frombuffer(data, dtype=np.uint8)
+    size = rs6.tss1_size
+    if len(data) % size == 0 and np.all(data[size - 1::size] == ord("\n")):
+        count = len(data) // size
+        return (data.reshape(count, size), np.arange(count, dtype=np.int64) * size,
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 0)
+    ends = np.flatnonzero(data == ord("\n"))
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    lengths = ends + 1 - starts
+    well_sized = lengths == size
+    offsets = starts[well_sized]
+    records = data[offsets[:, None] + np.arange(size)]
+    tail = len(data) - (int(ends[-1]) + 1 if len(ends) else 0)
+    return records, offsets, starts[~well_sized], lengths[~well_sized], tail
+
+
+def _signed_decimal(records, column):
+    # Value of a sign column followed by four decimal digits, and whether it parsed
+    digits = _digit_values[records[:, column + 1:column + 5]]
+    sign = _sign_values[records[:, column]]
+    ok = (sign != 0) & np.all(digits < 10, axis=1)
+    value = ((digits[:, 0].astype(np.int32) * 10 + digits[:, 1]) * 10 + digits[:, 2]) * 10 + digits[:, 3]
+    return sign * value, ok
+
+
+def decode_tss1_batch(records):
+    # Decodes (n, 27) TSS1 records into integer fields in LSBs and a validity mask.
+    # A record is valid when every column holds what create_tss1 writes there (any TSS1 status flag).
+    # Returns ({"hor_accel": ..., "vert_accel": ..., "heave": ..., "roll": ..., "pitch": ...}, status, valid)
+    records = np.asarray(records, dtype=np.uint8).reshape(-1, rs6.tss1_size)
+    hexes = _hex_values[records[:, _hor_accel_column:_hor_accel_column + 6]].astype(np.int32)
+    hor = hexes[:, 0] << 4 | hexes[:, 1]
+    vert = hexes[:, 2] << 12 | hexes[:, 3] << 8 | hexes[:, 4] << 4 | hexes[:, 5]
+    vert = np.where(vert >= 0x8000, vert - 0x10000, vert)
+    heave, heave_ok = _signed_decimal(records, _heave_column)
+    roll, roll_ok = _signed_decimal(records, _roll_column)
+    pitch, pitch_ok = _signed_decimal(records, _pitch_column)
+    status = records[:, _status_column].copy()
+
+    valid = np.all(hexes < 16, axis=1) & heave_ok & roll_ok & pitch_ok & _valid_status[status]
+    valid &= np.all(records[:, [0, 7, 19, 25, 26]] == np.frombuffer(b":  \r\n", dtype=np.uint8), axis=1)
+    fields = {"hor_accel": hor, "vert_accel": vert, "heave": heave, "roll": roll, "pitch": pitch}
+    return fields, status.view("S1"), valid
+
+
+def tss1_values(fields):
+    # Physical values of integer TSS1 fields: m/s^2, m and degrees
+    return {
+        "hor_accel": fields["hor_accel"] * rs6.tss1_hor_accel_lsb,
+        "vert_accel": fields["vert_accel"] * rs6.tss1_vert_accel_lsb,
+        "heave": fields["heave"] * rs6.tss1_angle_lsb,
+        "roll": fields["roll"] * rs6.tss1_angle_lsb,
+        "pitch": fields["pitch"] * rs6.tss1_angle_lsb,
+    }
@@ -0,0 +1,164 @@
+import argparse
+import bisect
+
+import numpy as np
+
+import span6_ascii
+import span6_batch
+import span6_to_tss1 as rs6
+import tss1_batch
+
+# Round-trip check of converter output against its SPAN6 source.
+# The TSS1 capture is decoded in bulk as fixed-width records, malformed and truncated lines are
+# counted, and every sentence is compared with the values the source capture gives for it,
+# within half an LSB of the TSS1 quantization.
+# Run: python tss1_verify.py source.bin output.tss1 [--lossy] [--ascii]
+
+field_lsbs = {
+    "hor_accel": rs6.tss1_hor_accel_lsb,
+    "vert_accel": rs6.tss1_vert_accel_lsb,
+    "heave": rs6.tss1_angle_lsb,
+    "roll": rs6.tss1_angle_lsb,
+    "pitch": rs6.tss1_angle_lsb,
+}
+# what the fields can hold, values beyond saturate in the encoder
+field_limits = {
+    "hor_accel": (0, 255 * rs6.tss1_hor_accel_lsb),
+    "vert_accel": (-32768 * rs6.tss1_vert_accel_lsb, 32767 * rs6.tss1_vert_accel_lsb),
+    "heave": (-99.99, 99.99),
+    "roll": (-99.99, 99.99),
+    "pitch": (-99.99, 99.99),
+}
+
+
+def expected_inputs(path, ascii_logs=False):
+    # TSS1 input arrays of a source capture, one row per sentence the converter sends
+    # (per binary frame, or per ASCII log that decodes), only the rows inside the TSS1 limits
+    if ascii_logs:
+        carry = {name: 0.0 for name in tss1_batch.tss1_fields}
+        blocks = [span6_ascii.tss1_block_inputs(count, decoded, carry)
+                  for count, decoded, _ in span6_ascii.read_ascii_file(path)]
+        inputs = {name: np.concatenate([block[name] for block in blocks]) if blocks else np.zeros(0)
+                  for name in tss1_batch.tss1_fields}
+    else:
+        mapped, data = span6_batch.open_capture(path)
+        try:
+            index, _ = span6_batch.index_frames(mapped)
+            inputs = span6_batch.tss1_inputs(data, index)
+        finally:
+            del data
+            mapped.close()
+    in_range = tss1_batch.tss1_in_range(*(inputs[name] for name in tss1_batch.tss1_fields))
+    return {name: values[in_range] for name, values in inputs.items()}
+
+
+def align_sentences(received, expected):
+    # Index of the expected row each received sentence is, -1 for none: the earliest row after the
+    # previous match with the same quantized fields. For outputs that skipped sentences
+    keys = np.concatenate([np.stack([received[name] for name in tss1_batch.tss1_fields], axis=1),
+                           np.stack(tss1_batch.quantize_tss1(*(expected[name] for name in tss1_batch.tss1_fields)), axis=1)])
+    _, ids = np.unique(keys, axis=0, return_inverse=True)
+    ids = ids.reshape(-1)
+    received_ids, expected_ids = ids[:len(keys) - len(expected["heave"])], ids[len(keys) - len(expected["heave"]):]
+    order = np.argsort(expected_ids, kind="stable")
+    sorted_ids = expected_ids[order]
+    bounds = np.searchsorted(sorted_ids, np.arange(sorted_ids[-1] + 2 if len(sorted_ids) else 1))
+
+    matches = np.full(len(received_ids), -1, dtype=np.int64)
+    last = -1
+    for position, key in enumerate(received_ids.tolist()):
+        if key + 1 >= len(bounds):
+            continue
+        rows = order[bounds[key]:bounds[key + 1]]
+        found = bisect.bisect_right(rows, last)
+        if found < len(rows):
+            last = matches[position] = rows[found]
+    return matches
+
+
+def compare_tss1(received, expected):
+    # Per field: largest error in LSBs and number of sentences more than half an LSB off.
+    # received are integer fields, expected the source values row for row
+    report = {}
+    values = tss1_batch.tss1_values(received)
+    for name in tss1_batch.tss1_fields:
+        low, high = field_limits[name]
+        error = np.abs(values[name] - np.clip(expected[name], low, high)) / field_lsbs[name]
+        report[name] = {
+            "max_error_lsb": float(error.max()) if len(error) else 0.0,
+            "out_of_tolerance": int(np.count_nonzero(error > 0.5 + 1e-6)),
+        }
+    return report
+
+
+def verify_tss1(source_path, tss1_path, lossy=False, ascii_logs=False):
+    # Checks a TSS1 capture against its source capture, returns a report dict.
+    # Without lossy every in-range source row must have its sentence, in order; with lossy the
+    # output may skip rows (rate limiting, dropped sentences) and is aligned by value
+    with open(tss1_path, "rb") as file:
+        data = file.read()
+    records, offsets, odd_offsets, odd_lengths, tail = tss1_batch.split_tss1_lines(data)
+    fields, status, valid = tss1_batch.decode_tss1_batch(records)
+    expected = expected_inputs(source_path, ascii_logs)
+    expected_count = len(expected["heave"])
+
+    report = {
+        "lines": len(records) + len(odd_offsets) + (1 if tail else 0),
+        "valid": int(np.count_nonzero(valid)),
+        "malformed": int(np.count_nonzero(~valid)),
+        "wrong_length": len(odd_offsets),
+        "truncated_tail_bytes": tail,
+        "status_flags": {flag.decode(): int(count) for flag, count in zip(*np.unique(status[valid], return_counts=True))},
+        "expected": expected_count,
+    }
+    bad_offsets = np.sort(np.concatenate([offsets[~valid], odd_offsets]))
+    report["first_bad_offset"] = int(bad_offsets[0]) if len(bad_offsets) else None
+
+    received = {name: values[valid] for name, values in fields.items()}
+    if lossy:
+        matches = align_sentences(received, expected) if expected_count else np.full(report["valid"], -1)
+        matched = matches >= 0
+        report["matched"] = int(np.count_nonzero(matched))
+        report["unmatched"] = int(np.count_nonzero(~matched))
+        received = {name: values[matched] for name, values in received.items()}
+        expected = {name: values[matches[matched]] for name, values in expected.items()}
+    else:
+        # line for row, malformed lines keep their place so the ones after them still line up
+        if len(records) != expected_count:
+            report["count_mismatch"] = len(records) - expected_count
+        rows = np.flatnonzero(valid)
+        rows = rows[rows < expected_count]
+        received = {name: values[:len(rows)] for name, values in received.items()}
+        expected = {name: values[rows] for name, values in expected.items()}
+    report["fields"] = compare_tss1(received, expected)
+    report["ok"] = (report["malformed"] == report["wrong_length"] == report["truncated_tail_bytes"] == 0
+                    and "count_mismatch" not in report and not report.get("unmatched")
+                    and all(field["out_of_tolerance"] == 0 for field in report["fields"].values()))
+    return report
+
+
+def print_report(report):
+    print(f"{report['lines']} lines: {report['valid']} valid, {report['malformed']} malformed, "
+          f"{report['wrong_length']} of wrong length, {report['truncated_tail_bytes']} B truncated tail"
+          + (f", first bad line at byte {report['first_bad_offset']}" if report["first_bad_offset"] is not None else ""))
+    print(f"status flags {report['status_flags']}, {report['expected']} sentences expected from the source")
+    if "matched" in report:
+        print(f"aligned {report['matched']}, unmatched {report['unmatched']}")
+    if "count_mismatch" in report:
+        print(f"sentence count differs from the source by {report['count_mismatch']:+d}")
+    for name, field in report["fields"].items():
+        print(f"  {name:<11} max error {field['max_error_lsb']:.3f} LSB, {field['out_of_tolerance']} out of tolerance")
+    print("OK" if report["ok"] else "MISMATCH")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="check converter TSS1 output against its SPAN6 source")
+    parser.add_argument("source", help="SPAN6 capture the output was produced from")
+    parser.add_argument("tss1", help="TSS1 capture")
+    parser.add_argument("--lossy", action="store_true", help="the output may skip sentences, align by value")
+    parser.add_argument("--ascii", action="store_true", help="the source is an ASCII log capture")
+    args = parser.parse_args()
+
+    report = verify_tss1(args.source, args.tss1, args.lossy, args.ascii)
+    print_report(report)
+    raise SystemExit(0 if report["ok"] else 1)